@@ -29,6 +29,8 @@ from zentropi.frames import (
     Event,
     Frame,
     Message,
+    Request,
+    Response,
     State
 )
 from zentropi.shell import ZentropiShell
@@ -39,6 +41,7 @@ from zentropi.zentropian import (
     Zentropian,
     on_event,
     on_message,
+    on_request,
     on_state
 )
 
@@ -62,8 +65,11 @@ __all__ = [
     'Message',
     'on_event',
     'on_message',
+    'on_request',
     'on_state',
     'on_timer',
+    'Request',
+    'Response',
     'run_agents',
     'ZentropiShell',
     'Spaces',
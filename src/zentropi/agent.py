@@ -2,50 +2,117 @@
 import asyncio
 # import atexit
 import threading
-from inspect import isgeneratorfunction
+from functools import partial
+from inspect import (
+    iscoroutinefunction,
+    isgeneratorfunction
+)
 from typing import Optional, Union
 
 from pybloom_live import ScalableBloomFilter
 
-from zentropi.frames import Event, Frame, Message
+from zentropi.batching import Batcher
+from zentropi.caches import (
+    HandlerCaches,
+    handler_cache_key
+)
+from zentropi.defaults import (
+    ACK_INTERVAL,
+    FLOW_CREDIT_POLL,
+    INBOX_DRAIN_SIZE,
+    PRIORITY_SCHEDULING,
+    REORDER_WAIT,
+    REQUEST_TIMEOUT,
+    TASK_DRAIN_TIMEOUT
+)
+from zentropi.delivery import Delivery
+from zentropi.executors import default_executors
+from zentropi.flow import Credits
+from zentropi.frames import (
+    Command,
+    Event,
+    Frame,
+    Message,
+    Request
+)
 from zentropi.handlers import Handler
+from zentropi.partitions import Lanes
+from zentropi.priorities import FrameQueue
+from zentropi.rates import RateLimit
+from zentropi.requests import (
+    Gather,
+    cancel_command,
+    request_key
+)
+from zentropi.sequences import Sequencer
 from zentropi.symbols import KINDS
+from zentropi.tasks import TaskRegistry
 from zentropi.timer import TimerRegistry
 from zentropi.zentropian import (
     Zentropian,
     on_event,
     on_message,
+    on_request,
     on_state
 )
 
 
+_MISSING = object()
+
+
 class Agent(Zentropian):
-    def __init__(self, name=None):
+    def __init__(self, name=None, *, executors=None, scheduling=PRIORITY_SCHEDULING, reorder_wait=REORDER_WAIT,
+                 delivery=None):
         self.timers = TimerRegistry(callback=self._trigger_frame_handler)
+        self.executors = executors or default_executors()
+        self._executors_used = set()  # type: set
+        self._batches = Batcher(callback=self._invoke_batch)
+        self._lanes = {}  # type: dict
+        self._rate_limits = {}  # type: dict  # {handler: RateLimit}
+        self._space_limits = {}  # type: dict  # {space: RateLimit}
+        self.caches = HandlerCaches()
+        self.tasks = TaskRegistry(on_error=self._on_task_error)
+        self.inbox = FrameQueue(scheduling=scheduling)
+        self.credits = Credits()
+        self.sequencer = Sequencer(wait=reorder_wait)
+        self._release_timer = None
+        self.delivery = delivery if delivery is not None else Delivery()
+        self._ack_timer = None
+        self._redelivery_timer = None
+        self._draining = False
         super().__init__(name=name)
         self.states.should_stop = False
         self.states.running = False
         self.loop = None  # asyncio.get_event_loop()
-        self._spawn_on_start = set()
+        self._spawn_on_start = []  # type: list
+        self._started = False
         self._seen_frames = ScalableBloomFilter(
                     mode=ScalableBloomFilter.LARGE_SET_GROWTH, error_rate=0.001)
 
     @on_state('should_stop')
     def _on_should_stop(self, state):
         if state.data.last is False and state.data.value is True:  # skip double close
-            self.close()
+            if not self._started:  # otherwise closed by _run_forever once tasks are drained.
+                self.close()
         return True
 
     async def _run_forever(self):
         # atexit.register(self.loop.close)
+        self._started = True
         if self._spawn_on_start:
-            [self.spawn(coro) for coro in self._spawn_on_start]
+            [self.spawn(coro, handler=handler) for coro, handler in self._spawn_on_start]
             self._spawn_on_start = None
+        self.executors.warm_up(self._executors_used)
         self.emit('*** started', internal=True)
         self.timers.start_timers(self.spawn)
+        self._schedule_redelivery()  # for reliable frames sent before the loop ran.
         while self.states.should_stop is False:
             await asyncio.sleep(1)
+        await self.tasks.drain(TASK_DRAIN_TIMEOUT)
         self.emit('*** stopped', internal=True)
+        closing = self.close()
+        if closing:
+            await asyncio.wait(closing, timeout=TASK_DRAIN_TIMEOUT)
 
     def _set_asyncio_loop(self, loop=None):
         if self.loop and loop:
@@ -57,46 +124,265 @@ class Agent(Zentropian):
                 self.loop = asyncio.get_event_loop()
             except RuntimeError:
                 self.loop = asyncio.new_event_loop()
+        self.states.set_loop(self.loop)
+
+    def receive(self, frame):
+        """Once running, frames from connections wait in the inbox and are
+        handled by priority a few at a time, so that control frames do not
+        queue behind a flood of bulk events. Frames from spaces joined with
+        ordered=True are put back in sequence first. Reliable frames echoed
+        back by the broker are not acked: only other agents' acks count."""
+        if frame.source != self.name and not self.delivery.incoming(frame):  # a redelivery we already have.
+            return self._send_acks()
+        if not self._started or not self.loop:
+            self.credits.handled(frame)
+            self._delivered(frame)
+            self.handle_frame(frame)
+            self._send_acks()
+            return self._grant_credits()
+        if self.sequencer.ordered(frame):
+            return self._sequenced(*self.sequencer.push(frame, self.loop.time()))
+        self._enqueue(frame)
+
+    def _sequenced(self, frames, gaps):
+        for source, space, priority, expected, missing in gaps:
+            self.emit('*** sequence-gap', data={'source': source, 'space': space, 'priority': priority,
+                                                'expected': expected, 'missing': missing}, internal=True)
+        for frame in frames:
+            self._enqueue(frame)
+        release_at = self.sequencer.next_release()
+        if release_at is not None and self._release_timer is None:
+            self._release_timer = self.loop.call_at(release_at, self._release_frames)
+
+    def _release_frames(self):
+        self._release_timer = None
+        self._sequenced(*self.sequencer.release(self.loop.time()))
+
+    def _enqueue(self, frame):
+        self.inbox.push(frame)
+        if not self._draining:
+            self._draining = True
+            self.loop.call_soon(self._drain_inbox)
+
+    def _drain_inbox(self):
+        for _ in range(INBOX_DRAIN_SIZE):
+            if not self.inbox:
+                break
+            frame = self.inbox.pop()
+            self.credits.handled(frame)
+            self.handle_frame(frame)
+            self._delivered(frame)
+        self._grant_credits()
+        self._send_acks()
+        if self.inbox:
+            self.loop.call_soon(self._drain_inbox)  # let other tasks run in between.
+        else:
+            self._draining = False
+
+    def _delivered(self, frame):
+        if frame.source != self.name:
+            self.delivery.handled(frame)
+
+    def _send_acks(self, now=False):
+        """Acks go out once ACK_BATCH are pending, or ACK_INTERVAL after the first."""
+        if self.loop and self._started and not now and not self.delivery.acks_due:
+            if self._ack_timer is None:
+                self._ack_timer = self.loop.call_later(ACK_INTERVAL, self._send_acks, True)
+            return
+        if self._ack_timer is not None:
+            self._ack_timer.cancel()
+            self._ack_timer = None
+        for source, acks in self.delivery.acks():
+            if self._connections.connected:
+                self._connections.broadcast(frame=Command('ack', data={'acks': acks}, source=self.name,
+                                                          target=source))
+
+    def outgoing(self, frame):
+        self.delivery.outgoing(frame, self.loop.time() if self.loop else 0)
+        self._schedule_redelivery()
+
+    def _schedule_redelivery(self):
+        redeliver_at = self.delivery.next_redelivery()
+        if redeliver_at is None or not self.loop or self._redelivery_timer is not None:
+            return
+        self._redelivery_timer = self.loop.call_at(redeliver_at, self._redeliver)
+
+    def _redeliver(self):
+        self._redelivery_timer = None
+        resend, failed = self.delivery.overdue(self.loop.time())
+        for frame in failed:
+            self.emit('*** delivery-failed', data={'id': frame.id, 'name': frame.name, 'space': frame.space,
+                                                   'target': frame.target}, internal=True)
+        for frame in resend:
+            if self._connections.connected:
+                self._connections.broadcast(frame=frame)
+        self._schedule_redelivery()
+
+    def _grant_credits(self):
+        if not self._connections.connected:
+            return
+        for space, group, credits in self.credits.grants():
+            self._connections.grant(space, group, credits)
+
+    def handle_frame(self, frame):
+        if isinstance(frame, Command) and frame.name == 'credit':
+            return self.credits.wake(frame.data.space)
+        if isinstance(frame, Command) and frame.name == 'ack':
+            for ack in frame.data.acks:
+                self.delivery.acked(ack['destination'], ack['ranges'])
+            return
+        return super().handle_frame(frame)
 
     def _trigger_frame_handler(self, frame: Frame, handler: Handler, internal=False):
         if isinstance(frame, Message) and frame.source == self.name:
             return
         if isinstance(frame, Event) and frame.source != self.name and frame.name.startswith('***'):
             return
-        if frame and frame.id in self._seen_frames:
+        if handler.where is not None and not handler.where(frame):
+            return
+        # per handler: a frame can have several handlers, e.g. supervised agents have one
+        # for '*** stopping' from run_agents() and one from run_worker().
+        seen_key = '{}:{}'.format(frame.id, id(handler)) if frame else None
+        if seen_key and seen_key in self._seen_frames:
             return
         if not self.apply_filters([handler]):
             return
-        if frame:
-            self._seen_frames.add(frame.id)
+        if seen_key:
+            self._seen_frames.add(seen_key)
+        if handler.rate or handler.coalesce or handler.sample:
+            return self._rate_limited(handler, frame)
+        return self._dispatch(handler, frame)
+
+    def _dispatch(self, handler, frame):
+        if handler.batch:
+            return self._batches.add(handler, frame, loop=self.loop)
+        if handler.partition_by:
+            return self._partition(handler, frame)
+        if handler.cache:
+            return self._invoke_cached(handler, frame)
+        return self._invoke_handler(handler, frame, frame)
+
+    def _invoke_cached(self, handler, frame):
+        key = handler_cache_key(handler, frame)
+        ret_val = self.caches.cache(handler).get(key, _MISSING)
+        if ret_val is _MISSING:
+            return self._invoke_handler(handler, frame, frame, cache_key=key)
+        if ret_val or isinstance(frame, Request):
+            return self.handle_return(frame, return_value=ret_val)
+
+    def _invoke_batch(self, handler, frames):
+        """Batch handlers receive a list of frames, replies go to the last one."""
+        fresh = [frame for frame in frames if not frame.expired]
+        self.counters['frames_expired'] += len(frames) - len(fresh)
+        if fresh:
+            self._invoke_handler(handler, fresh[-1], fresh)
+
+    def _payload(self, handler, frames):
         payload = []  # type: list
         if handler.pass_self:
             payload.append(self)
         if handler.kind != KINDS.TIMER:
-            payload.append(frame)
-        if handler.run_async:
-            async def return_handler():
-                ret_val = await handler(*payload)
-                if ret_val:
-                    self.handle_return(frame, return_value=ret_val)
+            payload.append(frames)
+        return payload
 
-            self.spawn(return_handler())
+    async def _run_handler(self, handler, frame, frames, cache_key=None):
+        payload = self._payload(handler, frames)
+        if handler.run_async:
+            ret_val = await handler(*payload)
+        elif handler.executor:
+            ret_val = await self.executors.run_handler(handler.executor, handler, frames, *payload,
+                                                       loop=self.loop)
         else:
             ret_val = handler(*payload)
-            if ret_val:
-                return self.handle_return(frame, return_value=ret_val)
+        if cache_key is not None:
+            self.caches.cache(handler).set(cache_key, ret_val)
+        if ret_val or isinstance(frame, Request):
+            self.handle_return(frame, return_value=ret_val)
+
+    def _invoke_handler(self, handler, frame, frames, cache_key=None):
+        if handler.run_async or handler.executor:
+            self.spawn(self._run_handler(handler, frame, frames, cache_key=cache_key), handler=handler)
+            if handler.kind == KINDS.STATE and handler.executor:
+                return True  # State handlers in executors can not veto updates.
+            return
+        ret_val = handler(*self._payload(handler, frames))
+        if cache_key is not None:
+            self.caches.cache(handler).set(cache_key, ret_val)
+        if ret_val or isinstance(frame, Request):
+            return self.handle_return(frame, return_value=ret_val)
+
+    def _partition(self, handler, frame):
+        lanes = self._lanes.get(handler)
+        if lanes is None:
+            lanes = self._lanes[handler] = Lanes(handler, callback=self._run_in_lane, spawn=self.spawn)
+        if not lanes.put(frame):  # lane is full
+            self.counters['lane_dropped'] += 1
+
+    async def _run_in_lane(self, handler, frame):
+        if frame.expired:  # waited too long behind earlier frames of its lane.
+            self.counters['frames_expired'] += 1
+            return
+        try:
+            await self._run_handler(handler, frame, frame)
+        except Exception as e:
+            self.tasks.report(handler, e)
+
+    def _rate_limited(self, handler, frame):
+        limit = self._rate_limits.get(handler)
+        if limit is None:
+            limit = self._rate_limits[handler] = RateLimit(rate=handler.rate, burst=handler.burst,
+                                                           coalesce=handler.coalesce, sample=handler.sample)
+        limit.submit((frame.name, frame.source), frame, partial(self._dispatch, handler), loop=self.loop)
+
+    def rate_limit(self, space, *, rate=None, burst=None, coalesce=None, sample=None):
+        """
+        Rate controls for the events this agent emits to space, per event
+        name (see RateLimit); rate_limit(space) with no controls removes them.
+
+            agent.rate_limit('sensors', coalesce=0.1)  # newest reading every 100ms at most.
+        """
+        if not (rate or coalesce or sample):
+            self._space_limits.pop(space, None)
+            return
+        self._space_limits[space] = RateLimit(rate=rate, burst=burst, coalesce=coalesce, sample=sample)
+
+    def emit(self, name, data=None, space=None, internal=False, **kwargs):
+        """Events to a space with a rate_limit(...) are not emitted at all
+        if dropped; None is returned for them and for events held back to be
+        coalesced with newer ones."""
+        limit = None if internal else self._space_limits.get(space, None)
+        if limit is None:
+            return super().emit(name, data=data, space=space, internal=internal, **kwargs)
+        emit = partial(super().emit, name, data=data, space=space, **kwargs)
+        return limit.submit((name, self.name), emit, lambda emit: emit(), loop=self.loop)
+
+    def rate_stats(self):
+        """Frames delivered, sampled_out, rate_limited and coalesced by
+        rate limited handlers and spaces."""
+        return {
+            'handlers': {handler.name: limit.stats() for handler, limit in self._rate_limits.items()},
+            'spaces': {space: limit.stats() for space, limit in self._space_limits.items()},
+        }
+
+    def lane_depths(self):
+        return {handler.name: lanes.depths() for handler, lanes in self._lanes.items()}
 
     def add_handler(self, handler):
+        if handler.executor:
+            self._executors_used.add(handler.executor)
+        if handler.invalidate_on:
+            super().add_handler(Handler(kind=KINDS.EVENT, name=handler.invalidate_on,
+                                        handler=lambda event: self.caches.cache(handler).invalidate()))
         if handler.kind == KINDS.TIMER:
             self.timers.add_handler(handler.name, handler)
         else:
             super().add_handler(handler)
 
-    def on_timer(self, interval):
+    def on_timer(self, interval, **kwargs):
         def wrapper(handler):
             name = str(interval)
-            handler_obj = Handler(kind=KINDS.TIMER, name=name, handler=handler)
-            self.timers.add_handler(name, handler_obj)
+            handler_obj = Handler(kind=KINDS.TIMER, name=name, handler=handler, **kwargs)
+            self.add_handler(handler_obj)
             return handler
 
         return wrapper
@@ -113,11 +399,112 @@ class Agent(Zentropian):
         self._set_asyncio_loop()
         self.loop.run_until_complete(self._run_forever())
 
-    def spawn(self, coro):
+    def spawn(self, coro, handler=None):
         if not self.loop:
-            self._spawn_on_start.add(coro)
+            self._spawn_on_start.append((coro, handler))
             return
-        return self.loop.create_task(coro)
+        return self.tasks.spawn(self.loop, coro, handler=handler)
+
+    async def request(self, name, data=None, *, target=None, space=None, timeout=REQUEST_TIMEOUT,
+                      coalesce=True, cache_ttl=None):
+        """
+        Send a request and return the first Response to it.
+        Raises asyncio.TimeoutError if no response arrives within timeout seconds.
+
+        Identical requests (same name, data, target and space) made while
+        one is in flight wait for its response instead of sending another,
+        unless coalesce=False. With cache_ttl the response is also reused
+        for that many seconds.
+        """
+        if not coalesce:
+            return await self._request(name, data, target=target, space=space, timeout=timeout)
+        key = request_key(name, data, target=target, space=space)
+        response = self.requests.cached(key)
+        if response is not None:
+            self.counters['requests_cache_hits'] += 1
+            return response
+        shared = self.requests.shared(key)
+        if shared is None:
+            shared = self.loop.create_task(self._request(name, data, target=target, space=space,
+                                                         timeout=timeout))
+            self.requests.share(key, shared, cache_ttl=cache_ttl)
+        else:
+            self.counters['requests_coalesced'] += 1
+        return await asyncio.shield(shared)
+
+    async def _request(self, name, data, *, target, space, timeout):
+        request = self.requests.request(name, data=data, space=space, source=self.name, target=target,
+                                        ttl=timeout)  # nobody waits for a response after timeout.
+        future = self.loop.create_future()
+        self.requests.expect(request.id, future)
+        try:
+            self.requests.dispatch(request)
+            if not future.done() and self._connections.connected:
+                self._connections.broadcast(frame=request)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.requests.forget(request.id)
+
+    async def emit_async(self, name, data=None, *, space, internal=False, reply_to=None, retain=False,
+                         ttl=None, deadline=None, priority=None):
+        """
+        Emit an event to space once every group that joined it with
+        credits=... has a credit to spare, waiting until its members
+        have handled enough earlier events if not.
+
+            for reading in readings:
+                await agent.emit_async('reading', data=reading, space='sensors')
+
+        Waits are counted in agent.credits.stats().
+        """
+        connections = list(self._connections.connections) if not internal else []
+        stalled_at = None
+        while connections:
+            connections = [c for c in connections if not await self._connections.acquire(c, space)]
+            if not connections:
+                break
+            if stalled_at is None:
+                stalled_at = self.loop.time()
+                self.credits.stalls[space] += 1
+            try:  # woken by a 'credit' command, or try again in case it was lost.
+                await asyncio.wait_for(self.credits.wait(space, self.loop), FLOW_CREDIT_POLL)
+            except asyncio.TimeoutError:
+                pass
+        if stalled_at is not None:
+            self.credits.stalled_seconds[space] += self.loop.time() - stalled_at
+        event = self.events.emit(name=name, data=data, space=space, internal=internal, source=self.name,
+                                 reply_to=reply_to, retain=retain, ttl=ttl, deadline=deadline,
+                                 priority=priority, credit=not internal)
+        if not internal and self._connections.connected:
+            self._connections.broadcast(frame=event)
+        return event
+
+    def gather(self, name, data=None, *, space=None, k=None, timeout=REQUEST_TIMEOUT):
+        """
+        Send one request to everyone in space and collect responses until
+        k have arrived or timeout seconds have passed. Await the returned
+        Gather for a list of responses, or iterate it with async for.
+        Responders are told to stop answering once it is done.
+        """
+        request = self.requests.request(name, data=data, space=space, source=self.name, ttl=timeout)
+        gather = Gather(request, k=k, timeout=timeout, loop=self.loop, on_done=self._gather_done)
+        self.requests.expect(request.id, gather)
+        self.requests.dispatch(request)
+        if not gather.done and self._connections.connected:
+            self._connections.broadcast(frame=request)
+        return gather
+
+    def _gather_done(self, gather):
+        request = gather.request
+        self.requests.forget(request.id)
+        self.requests.cancel(request.id)
+        if self._connections.connected:
+            self._connections.broadcast(frame=cancel_command(request, source=self.name))
+
+    def _on_task_error(self, handler, error):
+        self.counters['task_errors'] += 1
+        self.emit('*** task-error', data={'handler': handler.name if handler else None,
+                                          'error': repr(error)}, internal=True)
 
     @staticmethod
     def spawn_in_thread(func, *args, **kwargs):
@@ -129,6 +516,7 @@ class Agent(Zentropian):
         return self.spawn_in_thread(self.run)
 
     def stop(self):
+        self._batches.flush_all()
         self.emit('*** stopping', internal=True)
         self.states.should_stop = True
         self.timers.should_stop = True
@@ -145,13 +533,27 @@ class Agent(Zentropian):
             return
         self.spawn(retval)
 
-    def join(self, space, *, tags: Optional[Union[list, str]] = None):
-        retval = super().join(space, tags=tags)
+    def join(self, space, *, tags: Optional[Union[list, str]] = None, group: Optional[str] = None,
+             partition_by: Optional[str] = None, credits: Optional[int] = None, ordered: bool = False,
+             reliable: bool = False):
+        """With reliable=True, frames this agent sends to space are sent
+        again until an agent in it acks them (see Delivery)."""
+        retval = super().join(space, tags=tags, group=group, partition_by=partition_by, credits=credits,
+                              ordered=ordered)
+        if credits:
+            self.credits.join(space, group)
+        if ordered:
+            self.sequencer.join(space)
+        if reliable:
+            self.delivery.join(space)
         if not isgeneratorfunction(retval):
             return
         self.spawn(retval)
 
     def leave(self, space, *, tags: Optional[Union[list, str]] = None):
+        self.credits.leave(space)
+        self.sequencer.leave(space)
+        self.delivery.leave(space)
         retval = super().leave(space, tags=tags)
         if not isgeneratorfunction(retval):
             return
@@ -168,8 +570,13 @@ class Agent(Zentropian):
             connections = self._connections.connections_by_tags(tags)
         else:
             connections = self._connections.connections
+        closing = []
         for connection in connections:
-            connection.close()
+            if iscoroutinefunction(connection.close):  # leaves its groups first.
+                closing.append(self.spawn(connection.close()))
+            else:
+                connection.close()
+        return [task for task in closing if task]
 
 
 def on_timer(interval, **kwargs):
@@ -189,6 +596,7 @@ __all__ = [
     'Agent',
     'on_event',
     'on_message',
+    'on_request',
     'on_state',
     'on_timer',
 ]
@@ -0,0 +1,41 @@
+# coding=utf-8
+
+
+class Batcher(object):
+    """
+    Buffers frames per handler and calls back with a list of frames once
+    `handler.batch` frames have arrived, or `handler.linger` seconds after
+    the first frame of a batch, whichever comes first.
+
+    Without an event loop only the size limit (and flush) apply.
+    """
+    def __init__(self, callback):
+        if not callable(callback):
+            raise ValueError('Expected a callable for callback, got: {}'
+                             ''.format(callback))
+        self._callback = callback
+        self._buffers = {}  # type: dict
+        self._timers = {}  # type: dict
+
+    def add(self, handler, frame, loop=None):
+        buffer = self._buffers.setdefault(handler, [])
+        buffer.append(frame)
+        if len(buffer) >= handler.batch:
+            return self.flush(handler)
+        if loop and handler not in self._timers:
+            self._timers[handler] = loop.call_later(handler.linger, self.flush, handler)
+
+    def flush(self, handler):
+        timer = self._timers.pop(handler, None)
+        if timer:
+            timer.cancel()
+        frames = self._buffers.pop(handler, None)
+        if frames:
+            return self._callback(handler, frames)
+
+    def flush_all(self):
+        for handler in list(self._buffers):
+            self.flush(handler)
+
+    def pending(self):
+        return {handler.name: len(frames) for handler, frames in self._buffers.items()}
@@ -0,0 +1,111 @@
+# coding=utf-8
+import json
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """
+    A least recently used cache of at most maxsize entries, where entries
+    also expire ttl seconds after they are set (never if ttl is None).
+
+    Example:
+        >>> from zentropi.caches import TTLCache
+        >>> cache = TTLCache(maxsize=2, ttl=60)
+        >>> cache.set('a', 1)
+        >>> cache.get('a'), cache.get('b')
+        (1, None)
+    """
+    def __init__(self, maxsize, ttl=None, clock=time.monotonic):
+        if not isinstance(maxsize, int) or maxsize < 1:
+            raise ValueError('Expected maxsize to be a positive integer. '
+                             'Got: {!r}'.format(maxsize))
+        if ttl is not None and (not isinstance(ttl, (int, float)) or ttl <= 0):
+            raise ValueError('Expected ttl to be seconds > 0. '
+                             'Got: {!r}'.format(ttl))
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()  # type: OrderedDict
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key, None)
+        if entry is not None and entry[0] is not None and entry[0] <= self._clock():
+            del self._data[key]
+            entry = None
+        if entry is None:
+            self._misses += 1
+            return default
+        self._hits += 1
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = self._ttl if ttl is None else ttl
+        expires = None if ttl is None else self._clock() + ttl
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Forget key, or everything if no key is given."""
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+
+    def stats(self):
+        lookups = self._hits + self._misses
+        return {
+            'size': len(self._data),
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_ratio': round(self._hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def __contains__(self, key):
+        entry = self._data.get(key, None)
+        return entry is not None and (entry[0] is None or entry[0] > self._clock())
+
+    def __len__(self):
+        return len(self._data)
+
+
+def handler_cache_key(handler, frame):
+    """Parse handlers are keyed on their parsed fields rather than the
+    exact text, other handlers on the frame's name and data."""
+    data = dict(frame.data)
+    if handler.match_parse:
+        data.pop('text', None)
+        return handler.name, json.dumps(data, sort_keys=True, default=str)
+    return handler.name, frame.name, json.dumps(data, sort_keys=True, default=str)
+
+
+class HandlerCaches(object):
+    """
+    Memoized return values of an agent's handlers declared with cache=...
+
+    Each handler gets its own TTLCache of handler.cache_size entries that
+    expire after handler.cache seconds (cache=True never expires them).
+    """
+    def __init__(self):
+        self._caches = {}  # type: dict
+
+    def cache(self, handler):
+        cache = self._caches.get(handler, None)
+        if cache is None:
+            ttl = None if handler.cache is True else handler.cache
+            cache = self._caches[handler] = TTLCache(maxsize=handler.cache_size, ttl=ttl)
+        return cache
+
+    def invalidate(self, name=None):
+        """Forget memoized values of handlers for name, or of all handlers."""
+        for handler, cache in self._caches.items():
+            if name is None or handler.name == name:
+                cache.invalidate()
+
+    def stats(self):
+        return {handler.name: cache.stats() for handler, cache in self._caches.items()}
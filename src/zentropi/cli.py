@@ -15,7 +15,9 @@ Why does this file exist, and why not put this in __main__?
 
   Also see (1) from http://click.pocoo.org/5/setuptools/#setuptools-integration
 """
+import importlib
 import os
+import sys
 
 import click
 
@@ -41,3 +43,40 @@ def shell(name, endpoint, join, send_auth):
     if join:
         shell_agent.join(space=join)
     shell_agent.run()
+
+
+def load_agent_spec(spec):
+    """Import 'package.module:AgentClass' (or a factory) from its dotted path."""
+    if ':' not in spec:
+        raise click.BadParameter('Expected module:attribute, got: {!r}'.format(spec))
+    module_name, attribute = spec.split(':', 1)
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        raise click.BadParameter('Could not import {!r}: {}'.format(module_name, e))
+    try:
+        return getattr(module, attribute)
+    except AttributeError:
+        raise click.BadParameter('{!r} not found in module {!r}'.format(attribute, module_name))
+
+
+@main.command()
+@click.argument('agents', nargs=-1, required=True)
+@click.option('--processes', default=1, type=int)
+@click.option('--endpoint', default='redis://127.0.0.1:6379')
+@click.option('--auth/--no-auth', 'send_auth', is_flag=True, default=True)
+@click.option('--join', default='zentropia')
+@click.option('--pin/--no-pin', default=True)
+def run(agents, processes, endpoint, send_auth, join, pin):
+    from .supervisor import Supervisor
+    if send_auth:
+        auth = os.getenv('ZENTROPI_REDIS_PASSWORD', None)
+    else:
+        auth = None
+    agent_factories = [load_agent_spec(spec) for spec in agents]
+    supervisor = Supervisor(agent_factories, processes=processes, endpoint=endpoint,
+                            auth=auth, space=join, pin=pin)
+    for stats in supervisor.run():
+        click.echo('worker {index}: {frames} frames, {restarts} restarts'.format(**stats))
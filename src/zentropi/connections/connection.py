@@ -28,12 +28,30 @@ class Connection(object):
     def broadcast(self, frame) -> None:
         raise NotImplementedError()
 
-    def join(self, space: str) -> None:
+    def join(self, space: str, group: Optional[str] = None, partition_by: Optional[str] = None,
+             credits: Optional[int] = None, ordered: bool = False) -> None:
         raise NotImplementedError()
 
+    def acquire(self, space: str) -> bool:
+        """Take a flow control credit from each group in space that has
+        them; False (taking none) if one of them has run out."""
+        return True
+
+    def grant(self, space: str, group: str, credits: int) -> None:
+        """Give group in space credits for frames its member handled."""
+        pass
+
+    def update_interests(self, interests) -> None:
+        """Brokers that can filter deliveries per agent override this."""
+        pass
+
     def leave(self, space: str) -> None:
         raise NotImplementedError()
 
+    def load(self) -> int:
+        """Work the agent has in hand, for least-loaded group delivery."""
+        return 0
+
     def spaces(self) -> List[str]:
         raise NotImplementedError()
 
@@ -35,6 +35,7 @@ class InMemoryConnection(Connection):
         self._validate_connection(endpoint)
         self._spaces = SPACES[endpoint]
         self._spaces.agent_connect(agent_name, self)   # type: ignore
+        self._spaces.update_interests(agent_name, self._agent.interests())   # type: ignore
         self._connected = True
         self._endpoint = endpoint
 
@@ -50,6 +51,7 @@ class InMemoryConnection(Connection):
         SPACES[endpoint] = spaces
         self._spaces = spaces
         self._spaces.agent_connect(agent_name, self)
+        self._spaces.update_interests(agent_name, self._agent.interests())
         self._connected = True
         self._endpoint = endpoint
 
@@ -68,15 +70,32 @@ class InMemoryConnection(Connection):
             self._connected = False
         return True
 
-    def join(self, space: str) -> None:  # type: ignore
+    def update_interests(self, interests):
         self.validate_is_connected()
-        self._spaces.join(self._agent.name, space)  # type: ignore
+        self._spaces.update_interests(self._agent.name, interests)  # type: ignore
 
-    # def leave(self, space: str):
-    #     self._spaces._leave(self._agent.name, space)
-    #     # cmd = Command(name='leave', space=space, source=self._agent.name)
-    #     # self.broadcast(cmd)
-    #     print('*** leave', space)
+    def join(self, space: str, group: Optional[str] = None,  # type: ignore
+             partition_by: Optional[str] = None, credits: Optional[int] = None,
+             ordered: bool = False) -> None:
+        self.validate_is_connected()
+        self._spaces.join(self._agent.name, space, group=group, partition_by=partition_by,  # type: ignore
+                          credits=credits, ordered=ordered)
+
+    def acquire(self, space: str) -> bool:
+        self.validate_is_connected()
+        return self._spaces.acquire(self._agent.name, space)  # type: ignore
+
+    def grant(self, space: str, group: str, credits: int) -> None:
+        self.validate_is_connected()
+        self._spaces.grant(space, group, credits)  # type: ignore
+
+    def leave(self, space: str) -> None:  # type: ignore
+        self.validate_is_connected()
+        self._spaces.leave(self._agent.name, space)  # type: ignore
+
+    def load(self) -> int:
+        tasks = getattr(self._agent, 'tasks', None)
+        return tasks.load() if tasks else 0
 
     def spaces(self) -> List[str]:
         self.validate_is_connected()
@@ -88,7 +107,7 @@ class InMemoryConnection(Connection):
 
     def send(self, frame, internal=False):
         if internal:
-            self._agent.handle_frame(frame)
+            self._agent.receive(frame)
         else:
             raise NotImplementedError()
 
@@ -1,12 +1,30 @@
 # coding=utf-8
 import asyncio
+import json
 import os
+import re
+import time
 from typing import Optional
 
 from ..agent import Agent
 from ..connections.connection import Connection
-from ..frames import Frame
+from ..defaults import RETAINED_FRAMES_PER_SPACE
+from ..frames import (
+    PRIORITIES,
+    Command,
+    Frame,
+    expired
+)
+from ..partitions import HashRing
+from ..spaces import (
+    WILDCARDS,
+    is_pattern,
+    space_matches,
+    split_space
+)
+from ..symbols import KINDS
 from ..utils import (
+    resolve_field,
     validate_auth,
     validate_endpoint,
     validate_name
@@ -21,6 +39,104 @@ except ImportError:
 assert Optional  # ignore unused error for now.
 
 
+def inbox(agent_name):
+    """Channel for frames targeted at one agent."""
+    return 'inbox:{}'.format(agent_name)
+
+
+def group_queue(space, group, priority):
+    """List that the members of a queue group take turns to pop frames
+    of one priority from."""
+    return 'group:{}:{}:{}'.format(space, group, priority)
+
+
+def glob_pattern(pattern):
+    """
+    PSUBSCRIBE glob for a space pattern. Globs match across dots, so
+    this matches more spaces than the pattern does and subscribers check
+    each space with space_matches().
+
+    Example:
+        >>> from zentropi.connections.redis_connection import glob_pattern
+        >>> glob_pattern('home.*'), glob_pattern('sensors.#')
+        ('home.*', 'sensors*')
+    """
+    glob = ''
+    after_any = True
+    for word in split_space(pattern):
+        separator = '' if after_any or word == '#' else '.'
+        after_any = word == '#'
+        glob += separator + ('*' if word in WILDCARDS else re.sub(r'([\\\[\]?])', r'\\\1', word))
+    return glob
+
+
+def retained_frames(space):
+    """Hash of frame name -> last retained frame in space."""
+    return 'retained:{}'.format(space)
+
+
+def retained_order(space):
+    """Sorted set of retained frame names by when they were last retained."""
+    return 'retained-order:{}'.format(space)
+
+
+def retained_spaces():
+    """Set of the spaces with retained frames, for patterns to match
+    without scanning the keyspace."""
+    return 'retained-spaces'
+
+
+def field_sets(agent_name):
+    """Hash of frame name -> data keys the agent's handlers read (json list)."""
+    return 'fields:{}'.format(agent_name)
+
+
+def member_queue(space, group, agent_name, priority):
+    """List of frames of one priority that only one member of a
+    partitioned group may pop."""
+    return 'group:{}:{}:{}:{}'.format(space, group, agent_name, priority)
+
+
+def member_queues(space, group, agent_name):
+    """
+    Lists a group member pops from, most urgent first; BLPOP takes from
+    the first one that is not empty, so control frames are never stuck
+    behind bulk ones.
+
+    Example:
+        >>> from zentropi.connections.redis_connection import member_queues
+        >>> member_queues('sensors', 'workers', 'worker-1')[:2]
+        ['group:sensors:workers:worker-1:control', 'group:sensors:workers:control']
+    """
+    return [queue for priority in PRIORITIES
+            for queue in (member_queue(space, group, agent_name, priority), group_queue(space, group, priority))]
+
+
+def group_members(space, group):
+    """Set of the agent names in a group."""
+    return 'group:{}:{}:members'.format(space, group)
+
+
+def space_groups(space):
+    """Hash of group name -> partition_by ('' if none) for the groups in space."""
+    return 'groups:{}'.format(space)
+
+
+def group_changes():
+    """Channel on which spaces are published when their groups or group members change."""
+    return 'group-changes'
+
+
+def space_credits(space):
+    """Hash of group name -> credits left, for the groups in space joined with credits."""
+    return 'credits:{}'.format(space)
+
+
+def stalled_producers(space):
+    """Set of agents waiting for credits to emit to space."""
+    return 'stalled:{}'.format(space)
+
+
 class RedisConnection(Connection):
     def __init__(self, agent: Agent) -> None:
         super().__init__()
@@ -31,20 +147,69 @@ class RedisConnection(Connection):
         self._endpoint = None  # type: Optional[str]
         self._spaces = set()  # type: set
         self._listener_task = None
+        self._inbox_task = None
         self._auth = None
+        self._address = None
+        self._groups = {}  # type: dict  # {space: group}
+        self._group_tasks = {}  # type: dict  # {space: (task, redis)}
+        self._rings = {}  # type: dict  # {(space, group): HashRing}
+        self._pattern_tasks = {}  # type: dict  # {pattern: task}
+        self._changes_task = None
+        self._space_groups = {}  # type: dict  # {space: {group: partition_by}}, until group-changes.
+        self._group_members = {}  # type: dict  # {(space, group): members}, until group-changes.
 
-    async def _connection_listener(self):
-        connection = self._connection
+    async def _connection_listener(self, connection=None):
+        connection = connection or self._connection
         while await connection.wait_message():
             frame_as_dict = await connection.get_json()
             if not frame_as_dict:
                 break
             if not self._connected:
                 break
+            if self._expired(frame_as_dict):
+                continue
             frame = Frame.from_dict(frame_as_dict)
             # print('*** redis: incoming frame',
             #       self._agent.name, frame.source,  frame.name, frame.data)
-            self._agent.handle_frame(frame)
+            self._agent.receive(frame)
+
+    async def _pattern_listener(self, pattern, channel):
+        while await channel.wait_message():
+            space, frame_as_dict = await channel.get_json()
+            if not frame_as_dict or not self._connected:
+                break
+            if not space_matches(pattern, space.decode('utf-8')) or self._expired(frame_as_dict):
+                continue
+            self._agent.receive(Frame.from_dict(frame_as_dict))
+
+    async def _group_listener(self, space, group, redis):
+        """Members of a group block on the same list, so each frame is
+        popped by exactly one of them, whichever is free first; frames
+        for the keys a member owns in a partitioned group wait on its own list."""
+        queues = member_queues(space, group, self._agent.name)
+        while self._connected:
+            _, frame_as_json = await redis.blpop(*queues, encoding='utf-8')
+            frame_as_dict = json.loads(frame_as_json)
+            if not self._expired(frame_as_dict):
+                self._agent.receive(Frame.from_dict(frame_as_dict))
+
+    async def _changes_listener(self, channel):
+        """Forget the groups cached for a space whenever they change."""
+        while await channel.wait_message():
+            space = await channel.get(encoding='utf-8')
+            if not space or not self._connected:
+                break
+            self._space_groups.pop(space, None)
+            for key in [key for key in self._group_members if key[0] == space]:
+                del self._group_members[key]
+
+    def _expired(self, frame_as_dict):
+        """Drop frames whose deadline passed while they were queued,
+        before building them."""
+        if not expired(frame_as_dict.get('meta', None)):
+            return False
+        self._agent.counters['frames_expired'] += 1
+        return True
 
     def bind(self, endpoint: str) -> None:
         self.connect(endpoint)
@@ -60,6 +225,7 @@ class RedisConnection(Connection):
             raise ValueError('Expected endpoint to begin with "redis://".'
                              'Got: {!r}'.format(endpoint))
         host, port = endpoint.replace('redis://', '').split(':')  # todo: handle exception
+        self._address = (host, port)
         self._subscriber = await aioredis.create_redis((host, port))
         self._publisher = await aioredis.create_redis((host, port))
         if auth:
@@ -68,23 +234,111 @@ class RedisConnection(Connection):
         else:
             print('*** WARNING: Redis connection has no password.')
         self._connected = True
+        channel, *_ = await self._subscriber.subscribe(group_changes())
+        self._changes_task = self._agent.spawn(self._changes_listener(channel))
+        await self.update_interests(self._agent.interests())
 
     async def _reconnect(self):
         timeout = 100
         while not self._connected and timeout:
             await asyncio.sleep(0.1)
             timeout -= 1
-        connection, *_ = await self._subscriber.subscribe(*self._spaces)
+        if not self._inbox_task:
+            inbox_channel, *_ = await self._subscriber.subscribe(inbox(self._agent.name))
+            self._inbox_task = self._agent.spawn(self._connection_listener(inbox_channel))
         if self._connection:
             self._connection.close()
+            self._connection = None
         if self._listener_task:
             self._listener_task.cancel()
+            self._listener_task = None
+        patterns = {s for s in self._spaces if is_pattern(s) and s not in self._groups}
+        for pattern in set(self._pattern_tasks) - patterns:
+            self._pattern_tasks.pop(pattern).cancel()
+            await self._subscriber.punsubscribe(glob_pattern(pattern))
+        for pattern in patterns - set(self._pattern_tasks):
+            channel, *_ = await self._subscriber.psubscribe(glob_pattern(pattern))
+            self._pattern_tasks[pattern] = self._agent.spawn(self._pattern_listener(pattern, channel))
+        channels = [s for s in self._spaces if s not in self._groups and s not in patterns]
+        if not channels:
+            return
+        connection, *_ = await self._subscriber.subscribe(*channels)
         self._connection = connection
         self._listener_task = self._agent.spawn(self._connection_listener())
 
-    def close(self):
+    async def _join_group(self, space, group, partition_by=None, credits=None):
+        partition_by_ = await self._publisher.hget(space_groups(space), group, encoding='utf-8')
+        if partition_by_ is not None and partition_by and partition_by != partition_by_:
+            raise ValueError('Expected agent {!r} to partition group {!r} by {!r} like its '
+                             'other members. Got: {!r}'.format(self._agent.name, group,
+                                                                partition_by_, partition_by))
+        redis = await aioredis.create_redis(self._address)  # blpop blocks its connection.
+        if self._auth:
+            await redis.auth(self._auth)
+        await self._publisher.hsetnx(space_groups(space), group, partition_by or '')
+        await self._publisher.sadd(group_members(space, group), self._agent.name)
+        if credits:
+            await self._publisher.hincrby(space_credits(space), group, credits)
+            await self._wake_stalled(space)
+        self._groups[space] = group
+        task = self._agent.spawn(self._group_listener(space, group, redis))
+        self._group_tasks[space] = (task, redis)
+        await self._rebalance(space, group, joined=self._agent.name)
+
+    async def _leave_group(self, space):
+        group = self._groups.pop(space)
+        task, redis = self._group_tasks.pop(space)
+        task.cancel()
+        redis.close()
+        if not self._publisher:
+            return
+        await self._publisher.srem(group_members(space, group), self._agent.name)
+        if not await self._publisher.scard(group_members(space, group)):
+            await self._publisher.hdel(space_groups(space), group)
+            await self._publisher.hdel(space_credits(space), group)
+        await self._rebalance(space, group, left=self._agent.name)
+
+    async def _rebalance(self, space, group, joined=None, left=None):
+        """Tell every member, and the one that left, who is in group now."""
+        members = await self._publisher.smembers(group_members(space, group), encoding='utf-8')
+        partition_by = await self._publisher.hget(space_groups(space), group, encoding='utf-8')
+        command = Command('group-rebalance', space=space, data={
+            'space': space,
+            'group': group,
+            'members': sorted(members),
+            'partition_by': partition_by or None,
+            'joined': joined,
+            'left': left,
+        })
+        for member in members:
+            await self._publisher.rpush(member_queue(space, group, member, command.priority),
+                                        json.dumps(command.as_dict()))
+        await self._publisher.publish(group_changes(), space)
+        if left:
+            self._agent.handle_frame(command)
+
+    def _ring(self, space, group, members):
+        ring = self._rings.get((space, group), None)
+        if ring is None or set(ring.nodes) != set(members):
+            ring = self._rings[space, group] = HashRing(members)
+        return ring
+
+    async def close(self):  # type: ignore
+        """Leaves its groups, so that their other members are rebalanced,
+        before closing the connections to Redis."""
+        for space in list(self._groups):
+            try:
+                await self._leave_group(space)
+            except aioredis.errors.ConnectionClosedError:
+                pass
         if self._listener_task:
             self._listener_task.cancel()
+        if self._inbox_task:
+            self._inbox_task.cancel()
+        if self._changes_task:
+            self._changes_task.cancel()
+        for task in self._pattern_tasks.values():
+            task.cancel()
         if self._connection:
             self._connection.close()
         if self._subscriber:
@@ -92,14 +346,26 @@ class RedisConnection(Connection):
         if self._publisher:
             self._publisher.close()
 
-    async def join(self, space: str) -> None:  # type: ignore
+    async def join(self, space: str, group: Optional[str] = None,  # type: ignore
+                   partition_by: Optional[str] = None, credits: Optional[int] = None,
+                   ordered: bool = False) -> None:
+        """Every subscriber of a space channel gets all of its frames, so
+        ordered needs nothing more from Redis."""
         space = validate_name(space)
+        if group and is_pattern(space):
+            raise ValueError('Expected a space without wildcards for group {!r}. '
+                             'Got: {!r}'.format(group, space))
+        if group:
+            await self._join_group(space, validate_name(group), partition_by, credits)
         self._spaces.add(space)
+        await self._replay(space)
         await self._reconnect()
 
     async def leave(self, space: str) -> None:  # type: ignore
         space = validate_name(space)
         self._spaces.remove(space)
+        if space in self._groups:
+            await self._leave_group(space)
         await self._reconnect()
 
     def spaces(self):
@@ -108,12 +374,117 @@ class RedisConnection(Connection):
     async def broadcast(self, frame):
         if not self._publisher:
             return
-        if frame.space:
+        if frame.expired:
+            self._agent.counters['frames_expired'] += 1
+            return
+        if frame.target:
+            frame = await self._project(frame.target, frame)
+            spaces = [inbox(frame.target)]
+        elif frame.space:
             spaces = [frame.space]
         else:
             spaces = self._spaces
         for space in spaces:
             try:
+                if frame.retain and not frame.target:
+                    await self._retain(space, frame)
                 await self._publisher.publish_json(space, frame.as_dict())
+                if not frame.target:
+                    await self._push_to_groups(space, frame)
             except aioredis.errors.ConnectionClosedError:
                 self._connected = False
+
+    async def acquire(self, space: str) -> bool:  # type: ignore
+        """Take a credit from each group in space that has them, like
+        Spaces.acquire(); credits taken before finding a group out of
+        them are put back."""
+        if not self._publisher:
+            return True
+        taken = []
+        for group in await self._publisher.hkeys(space_credits(space), encoding='utf-8'):
+            taken.append(group)
+            if await self._publisher.hincrby(space_credits(space), group, -1) < 0:
+                for group_ in taken:
+                    await self._publisher.hincrby(space_credits(space), group_, 1)
+                await self._publisher.sadd(stalled_producers(space), self._agent.name)
+                return False
+        return True
+
+    async def grant(self, space: str, group: str, credits: int) -> None:  # type: ignore
+        if not self._publisher or not await self._publisher.hexists(space_credits(space), group):
+            return
+        await self._publisher.hincrby(space_credits(space), group, credits)
+        await self._wake_stalled(space)
+
+    async def _wake_stalled(self, space):
+        """Tell producers waiting on space to try again."""
+        agents = await self._publisher.smembers(stalled_producers(space), encoding='utf-8')
+        if not agents:
+            return
+        await self._publisher.srem(stalled_producers(space), *agents)
+        command = Command('credit', data={'space': space})
+        for agent in agents:
+            await self._publisher.publish_json(inbox(agent), command.as_dict())
+
+    async def _push_to_groups(self, space, frame):
+        """Groups and their members are cached per space until a
+        group-changes message says otherwise, so that publishing to a
+        space costs no lookups."""
+        groups = self._space_groups.get(space, None)
+        if groups is None:
+            groups = self._space_groups[space] = await self._publisher.hgetall(space_groups(space),
+                                                                               encoding='utf-8')
+        frame_as_json = json.dumps(frame.as_dict()) if groups else None
+        for group, partition_by in groups.items():
+            key = resolve_field(frame, partition_by) if partition_by else None
+            if key is None:
+                await self._publisher.rpush(group_queue(space, group, frame.priority), frame_as_json)
+                continue
+            members = self._group_members.get((space, group), None)
+            if members is None:
+                members = self._group_members[space, group] = await self._publisher.smembers(
+                    group_members(space, group), encoding='utf-8')
+            owner = self._ring(space, group, members).node(key)
+            if owner:
+                await self._publisher.rpush(member_queue(space, group, owner, frame.priority), frame_as_json)
+
+    async def _retain(self, space, frame):
+        await self._publisher.hset(retained_frames(space), frame.name, json.dumps(frame.as_dict()))
+        await self._publisher.zadd(retained_order(space), time.time(), frame.name)
+        await self._publisher.sadd(retained_spaces(), space)
+        extra = await self._publisher.zcard(retained_order(space)) - RETAINED_FRAMES_PER_SPACE
+        if extra > 0:
+            names = await self._publisher.zrange(retained_order(space), 0, extra - 1)
+            await self._publisher.zrem(retained_order(space), *names)
+            await self._publisher.hdel(retained_frames(space), *names)
+
+    async def _replay(self, space):
+        """Hand the frames retained in space (or in the spaces it matches)
+        to the agent as one 'replay' command, like Spaces does."""
+        if is_pattern(space):
+            spaces = await self._publisher.smembers(retained_spaces(), encoding='utf-8')
+            keys = [retained_frames(s) for s in sorted(spaces) if space_matches(space, s)]
+        else:
+            keys = [retained_frames(space)]
+        frames = []
+        for key in keys:
+            frames.extend(json.loads(f) for f in await self._publisher.hvals(key, encoding='utf-8'))
+        if frames:
+            self._agent.handle_frame(Command('replay', data={'frames': frames}, space=space))
+
+    async def update_interests(self, interests):
+        """Publishes which data keys this agent reads, so that frames sent
+        to its inbox can leave out the others. Frames published to a space
+        reach every subscriber as they are."""
+        if not self._publisher:
+            return
+        await self._publisher.delete(field_sets(self._agent.name))
+        if interests.fields:
+            await self._publisher.hmset_dict(field_sets(self._agent.name), {
+                name: json.dumps(sorted(keys)) for name, keys in interests.fields.items()})
+
+    async def _project(self, agent_name, frame):
+        keys = await self._publisher.hget(field_sets(agent_name), frame.name, encoding='utf-8')
+        if keys is None or frame.kind not in (KINDS.EVENT, KINDS.MESSAGE, KINDS.REQUEST):
+            return frame
+        return frame.project(json.loads(keys))
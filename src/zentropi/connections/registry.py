@@ -1,10 +1,13 @@
 # coding=utf-8
 
-from collections import defaultdict
+from collections import Counter, defaultdict
 from inspect import iscoroutinefunction
 from typing import Optional, Union
+from uuid import uuid4
 
 from ..agent import Agent
+from ..frames import Command
+from ..priorities import FrameQueue
 from ..zentropian import Zentropian
 from .connection import Connection
 from .in_memory import InMemoryConnection
@@ -32,6 +35,10 @@ class ConnectionRegistry(object):
         self._tags = defaultdict(set)  # type: dict
         self._endpoints = defaultdict(set)  # type: dict
         self._connections = set()  # type: set
+        self._outboxes = defaultdict(FrameQueue)  # type: dict  # {connection: FrameQueue}
+        self._sending = set()  # type: set  # connections with a _send task
+        self._epoch = uuid4().hex  # tells receivers that sequences started over.
+        self._sequences = Counter()  # type: Counter  # {(space, priority): last seq}
 
     @property
     def connected(self):
@@ -62,19 +69,60 @@ class ConnectionRegistry(object):
         self._endpoints[endpoint].add(connection)
 
     def broadcast(self, frame, *, tags: Optional[Union[list, str]] = None):
+        self._stamp(frame)
+        self._agent.outgoing(frame)
         for connection in self.connections_by_tags(tags):
             # print('broadcasting on', connection, frame.name)
             if iscoroutinefunction(connection.broadcast):
-                self._agent.spawn(connection.broadcast(frame))
+                self._outboxes[connection].push(frame)
+                if connection not in self._sending:
+                    self._sending.add(connection)
+                    self._agent.spawn(self._send(connection))
             else:
                 connection.broadcast(frame)
 
-    def join(self, space: str, *, tags: Optional[Union[list, str]] = None):
+    def _stamp(self, frame):
+        """Number the frames this agent sends to each space, per priority
+        class, so that receivers can put them back in order."""
+        if isinstance(frame, Command) or frame.target or not frame.space or frame.seq is not None:
+            return
+        if frame.source != self._agent.name:
+            return
+        key = (frame.space, frame.priority)
+        self._sequences[key] += 1
+        frame.meta.update({'seq': self._sequences[key], 'epoch': self._epoch})
+
+    async def _send(self, connection):
+        """Frames for connection go out one at a time by priority rather
+        than as a task each, so control frames overtake queued bulk ones."""
+        outbox = self._outboxes[connection]
+        try:
+            while outbox:
+                await connection.broadcast(outbox.pop())
+        finally:
+            self._sending.discard(connection)
+
+    def update_interests(self, interests, *, tags: Optional[Union[list, str]] = None):
+        for connection in self.connections_by_tags(tags):
+            if iscoroutinefunction(connection.update_interests):
+                self._agent.spawn(connection.update_interests(interests))
+            else:
+                connection.update_interests(interests)
+
+    def join(self, space: str, *, tags: Optional[Union[list, str]] = None, group: Optional[str] = None,
+             partition_by: Optional[str] = None, credits: Optional[int] = None, ordered: bool = False):
+        kwargs = {'group': group} if group else {}
+        if partition_by:
+            kwargs['partition_by'] = partition_by
+        if credits:
+            kwargs['credits'] = credits
+        if ordered:
+            kwargs['ordered'] = True
         for connection in self.connections_by_tags(tags):
             if iscoroutinefunction(connection.join):
-                self._agent.spawn(connection.join(space))
+                self._agent.spawn(connection.join(space, **kwargs))
             else:
-                connection.join(space)
+                connection.join(space, **kwargs)
 
     def leave(self, space: str, *, tags: Optional[Union[list, str]] = None):
         for connection in self.connections_by_tags(tags):
@@ -83,6 +131,19 @@ class ConnectionRegistry(object):
             else:
                 connection.leave(space)
 
+    async def acquire(self, connection, space: str) -> bool:
+        """Take a flow control credit for space from connection."""
+        if iscoroutinefunction(connection.acquire):
+            return await connection.acquire(space)
+        return connection.acquire(space)
+
+    def grant(self, space: str, group: str, credits: int, *, tags: Optional[Union[list, str]] = None):
+        for connection in self.connections_by_tags(tags):
+            if iscoroutinefunction(connection.grant):
+                self._agent.spawn(connection.grant(space, group, credits))
+            else:
+                connection.grant(space, group, credits)
+
     def connections_by_tags(self, tags: Optional[Union[list, str]] = None):
         if isinstance(tags, str):
             if ',' in tags:
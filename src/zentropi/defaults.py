@@ -1,5 +1,6 @@
 # coding=utf-8
 import logging
+import os
 
 LOCALE = 'en_US'
 LOG_LEVEL = logging.DEBUG
@@ -7,3 +8,45 @@ LOG_LEVEL = logging.DEBUG
 MATCH_FUZZY_THRESHOLD = 70
 
 FRAME_NAME_MAX_LENGTH = 128
+
+EXECUTOR_THREAD_WORKERS = 4
+EXECUTOR_PROCESS_WORKERS = os.cpu_count() or 1
+EXECUTOR_CHUNK_SIZE = 64
+
+SUPERVISOR_POLL_INTERVAL = 0.5
+SUPERVISOR_REPORT_INTERVAL = 10
+SUPERVISOR_STOP_TIMEOUT = 5
+
+BATCH_LINGER = 0.05
+
+TASK_DRAIN_TIMEOUT = 5
+
+PARTITION_LANES = 8
+PARTITION_LANE_SIZE = 1000
+PARTITION_VIRTUAL_NODES = 64
+
+REQUEST_TIMEOUT = 10
+REQUEST_CANCELLED_SIZE = 10000
+REQUEST_CACHE_SIZE = 1000
+
+HANDLER_CACHE_SIZE = 1000
+
+GROUP_STRATEGY = 'round-robin'
+
+RETAINED_FRAMES_PER_SPACE = 1000
+
+PRIORITY_SCHEDULING = 'weighted'
+PRIORITY_WEIGHTS = {'control': 16, 'interactive': 4, 'bulk': 1}
+INBOX_DRAIN_SIZE = 100
+
+FLOW_CREDIT_POLL = 1
+
+REORDER_WAIT = 0.05
+REORDER_BUFFER_SIZE = 1000
+
+RELIABLE_WINDOW = 10000
+RELIABLE_ATTEMPTS = 5
+ACK_TIMEOUT = 1
+ACK_BATCH = 64
+ACK_INTERVAL = 0.05
+DEDUPE_WINDOW = 10000
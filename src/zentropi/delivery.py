@@ -0,0 +1,178 @@
+# coding=utf-8
+from collections import (
+    Counter,
+    OrderedDict,
+    defaultdict
+)
+
+from zentropi.defaults import (
+    ACK_BATCH,
+    ACK_TIMEOUT,
+    DEDUPE_WINDOW,
+    RELIABLE_ATTEMPTS,
+    RELIABLE_WINDOW
+)
+from zentropi.frames import Command
+from zentropi.utils import BoundedSet
+
+
+def ack_ranges(seqs):
+    """
+    Sequence numbers as [first, last] runs, so that an ack for many
+    frames in a row stays small.
+
+    Example:
+        >>> from zentropi.delivery import ack_ranges
+        >>> ack_ranges({1, 2, 3, 4, 7, 9, 10})
+        [[1, 4], [7, 7], [9, 10]]
+    """
+    ranges = []  # type: list
+    for seq in sorted(seqs):
+        if ranges and seq == ranges[-1][1] + 1:
+            ranges[-1][1] = seq
+        else:
+            ranges.append([seq, seq])
+    return ranges
+
+
+def destination(frame):
+    """Where frame was sent: its target, else its space, else '' for
+    the spaces its source joined."""
+    return frame.target or frame.space or ''
+
+
+class Delivery(object):
+    """
+    At-least-once delivery of reliable frames, both ends of it for one agent.
+
+    Frames sent with reliable=True, or to a space joined with
+    reliable=True, are numbered per destination and kept until acked;
+    after timeout seconds without an ack they are sent again, up to
+    attempts times in all. At most window frames are kept: size it to
+    the frames per second sent reliably times the timeout, frames pushed
+    out of a full window are given up on.
+
+    Receivers drop reliable frames they already have (the last
+    dedupe_size ids) and ack those they handled in batches, as runs of
+    sequence numbers per source and destination. A frame sent to a space
+    counts as delivered once any agent in it has acked it; agents that
+    already had it drop its redeliveries.
+
+    Example:
+        >>> from zentropi.delivery import Delivery
+        >>> from zentropi.frames import Event, frame_meta
+        >>> sender, receiver = Delivery(), Delivery()
+        >>> event = Event('toggle', source='relay', space='gpio', meta=frame_meta(reliable=True))
+        >>> sender.outgoing(event, now=0)
+        >>> receiver.incoming(event), receiver.incoming(event)
+        (True, False)
+        >>> receiver.handled(event)
+        >>> receiver.acks()
+        [('relay', [{'destination': 'gpio', 'ranges': [[1, 1]]}])]
+        >>> sender.acked('gpio', [[1, 1]])
+        >>> len(sender)
+        0
+    """
+    def __init__(self, *, window=RELIABLE_WINDOW, timeout=ACK_TIMEOUT, attempts=RELIABLE_ATTEMPTS,
+                 dedupe_size=DEDUPE_WINDOW, ack_batch=ACK_BATCH):
+        for name, value in (('window', window), ('attempts', attempts), ('ack_batch', ack_batch)):
+            if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+                raise ValueError('Expected {} to be a positive integer. '
+                                 'Got: {!r}'.format(name, value))
+        if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0:
+            raise ValueError('Expected timeout to be seconds > 0. '
+                             'Got: {!r}'.format(timeout))
+        self._window = window
+        self._timeout = timeout
+        self._attempts = attempts
+        self._ack_batch = ack_batch
+        self._spaces = set()  # type: set  # frames sent to these are reliable
+        self._sequences = Counter()  # type: Counter  # {destination: last rseq}
+        self._unacked = OrderedDict()  # type: OrderedDict  # {(destination, rseq): [frame, sent_at, attempts]}
+        self._seen = BoundedSet(maxlen=dedupe_size)  # ids of reliable frames received
+        self._pending = defaultdict(set)  # type: dict  # {(source, destination): {rseq, }} to ack
+        self.counters = Counter()  # type: Counter
+
+    def __len__(self):
+        """Frames sent and not acked yet."""
+        return len(self._unacked)
+
+    def join(self, space):
+        self._spaces.add(space)
+
+    def leave(self, space):
+        self._spaces.discard(space)
+
+    def outgoing(self, frame, now):
+        """Number frame and keep it until it is acked, if it is reliable."""
+        if isinstance(frame, Command) or frame.meta.get('rseq', None) is not None:
+            return  # acks are not acked, redeliveries are kept already.
+        if not frame.meta.get('reliable', False) and not (frame.space in self._spaces and not frame.target):
+            return
+        key = destination(frame)
+        self._sequences[key] += 1
+        frame.meta.update({'reliable': True, 'rseq': self._sequences[key]})
+        self._unacked[key, self._sequences[key]] = [frame, now, 1]
+        self.counters['frames_reliable'] += 1
+        while len(self._unacked) > self._window:
+            self._unacked.popitem(last=False)
+            self.counters['frames_abandoned'] += 1
+
+    def acked(self, destination_, ranges):
+        for first, last in ranges:
+            for seq in range(first, last + 1):
+                if self._unacked.pop((destination_, seq), None) is not None:
+                    self.counters['frames_acked'] += 1
+
+    def overdue(self, now):
+        """Frames to send again, and frames given up on after the last attempt."""
+        resend = []  # type: list
+        failed = []  # type: list
+        for key, entry in list(self._unacked.items()):
+            frame, sent_at, attempts = entry
+            if sent_at + self._timeout > now:
+                continue
+            if attempts >= self._attempts:
+                del self._unacked[key]
+                failed.append(frame)
+                self.counters['frames_failed'] += 1
+                continue
+            entry[1:] = [now, attempts + 1]
+            resend.append(frame)
+            self.counters['frames_redelivered'] += 1
+        return resend, failed
+
+    def next_redelivery(self):
+        """When overdue() next has something to do, or None."""
+        if not self._unacked:
+            return None
+        return min(sent_at for _, sent_at, _ in self._unacked.values()) + self._timeout
+
+    def incoming(self, frame):
+        """False for a reliable frame that was received before; it is
+        acked again, in case the ack was lost."""
+        if not frame.meta.get('reliable', False):
+            return True
+        if frame.id not in self._seen:
+            self._seen.add(frame.id)
+            return True
+        self.counters['frames_duplicate'] += 1
+        self.handled(frame)
+        return False
+
+    def handled(self, frame):
+        if frame.meta.get('reliable', False) and frame.source:
+            self._pending[frame.source, destination(frame)].add(frame.meta['rseq'])
+
+    @property
+    def acks_due(self):
+        """True once enough acks are pending to send them without waiting."""
+        return sum(len(seqs) for seqs in self._pending.values()) >= self._ack_batch
+
+    def acks(self):
+        """(source, [{'destination': ..., 'ranges': [[first, last], ]}, ]) to send, once each."""
+        by_source = defaultdict(list)  # type: dict
+        for (source, destination_), seqs in self._pending.items():
+            by_source[source].append({'destination': destination_, 'ranges': ack_ranges(seqs)})
+        self._pending.clear()
+        return sorted(by_source.items())
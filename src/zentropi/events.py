@@ -1,5 +1,5 @@
 # coding=utf-8
-from zentropi.frames import Event
+from zentropi.frames import Event, frame_meta
 from zentropi.handlers import Registry
 
 
@@ -15,8 +15,14 @@ class Events(Registry):
     def handle_event_name(event):
         pass
     """
-    def emit(self, name, data=None, space=None, internal=False, source=None, reply_to=None):
-        frame_ = Event(name=name, data=data, space=space, source=source, reply_to=reply_to, internal=internal)
+    def emit(self, name, data=None, space=None, internal=False, source=None, reply_to=None, target=None,
+             retain=False, ttl=None, deadline=None, priority=None, credit=False, reliable=False):
+        meta = frame_meta(retain=retain, ttl=ttl, deadline=deadline, priority=priority, credit=credit,
+                          reliable=reliable)
+        frame_ = Event(name=name, data=data, space=space, source=source, reply_to=reply_to, internal=internal,
+                       target=target, meta=meta)
+        if target and target != source:
+            return frame_
         frame, handlers = self._registry.match(frame=frame_)
         for handler in handlers:
             ret_val = self._trigger_frame_handler(
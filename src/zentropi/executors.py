@@ -0,0 +1,224 @@
+# coding=utf-8
+import asyncio
+import os
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor
+)
+
+from zentropi.defaults import (
+    EXECUTOR_CHUNK_SIZE,
+    EXECUTOR_PROCESS_WORKERS,
+    EXECUTOR_THREAD_WORKERS
+)
+from zentropi.frames import Frame
+from zentropi.utils import validate_name
+
+
+def _noop():
+    return None
+
+
+def snapshot(frames):
+    if frames is None:
+        return None
+    if isinstance(frames, list):
+        return [frame.as_dict() for frame in frames]
+    return frames.as_dict()
+
+
+def run_frame_handler(func, frames_snapshot=None):
+    """Runs in a worker process: rebuild the frame snapshot and call func."""
+    if frames_snapshot is None:
+        return func()
+    if isinstance(frames_snapshot, list):
+        return func([Frame.from_dict(f) for f in frames_snapshot])
+    return func(Frame.from_dict(frames_snapshot))
+
+
+def run_frame_chunk(func, frames_as_dicts):
+    return [func(Frame.from_dict(f)) for f in frames_as_dicts]
+
+
+class Pool(object):
+    """
+    A named executor with a bounded number of workers and queue metrics.
+
+    Example:
+        >>> from zentropi.executors import Pool
+        >>> pool = Pool('io', max_workers=2)
+        >>> pool.stats()
+        {'max_workers': 2, 'submitted': 0, 'completed': 0, 'failed': 0, 'in_flight': 0, 'queued': 0}
+    """
+    def __init__(self, name, *, max_workers, executor_class=ThreadPoolExecutor):
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError('Expected max_workers to be a positive integer. '
+                             'Got: {!r}'.format(max_workers))
+        self._name = validate_name(name)
+        self._max_workers = max_workers
+        self._executor_class = executor_class
+        self._executor = None
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = self._executor_class(max_workers=self._max_workers)
+        return self._executor
+
+    @property
+    def isolated(self):
+        """True if work leaves this process and must be picklable."""
+        return issubclass(self._executor_class, ProcessPoolExecutor)
+
+    @property
+    def in_flight(self):
+        return self._submitted - self._completed - self._failed
+
+    async def run(self, loop, func, *args):
+        self._submitted += 1
+        try:
+            result = await loop.run_in_executor(self.executor, func, *args)
+        except BaseException:
+            self._failed += 1
+            raise
+        self._completed += 1
+        return result
+
+    @property
+    def warm(self):
+        return self._executor is not None
+
+    def warm_up(self):
+        """Start every worker now instead of on the first frame;
+        does nothing if the workers are already running."""
+        if self.warm:
+            return []
+        return [self.executor.submit(_noop) for _ in range(self._max_workers)]
+
+    def stats(self):
+        return {
+            'max_workers': self._max_workers,
+            'submitted': self._submitted,
+            'completed': self._completed,
+            'failed': self._failed,
+            'in_flight': self.in_flight,
+            'queued': max(0, self.in_flight - self._max_workers),
+        }
+
+    def shutdown(self, wait=False):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=wait)
+        self._executor = None
+
+
+class ExecutorRegistry(object):
+    """
+    Named pools that synchronous handlers can be sent to with
+    `executor='name'`, keeping blocking work off the agent's event loop.
+
+    The 'thread' pool is always available, as is the 'process' pool
+    whose workers are started once and reused. Handlers sent to a process
+    pool must be module level functions (no self), they receive a
+    picklable copy of the frame and their return value is sent back to
+    the agent.
+    """
+    def __init__(self):
+        self._pools = {}  # type: dict
+        self.add_pool('thread', max_workers=EXECUTOR_THREAD_WORKERS)
+        self.add_pool('process', max_workers=EXECUTOR_PROCESS_WORKERS,
+                      executor_class=ProcessPoolExecutor)
+
+    @property
+    def pools(self):
+        return list(self._pools)
+
+    def add_pool(self, name, *, max_workers, executor_class=ThreadPoolExecutor):
+        name = validate_name(name)
+        if name in self._pools:
+            self._pools[name].shutdown()
+        pool = Pool(name, max_workers=max_workers, executor_class=executor_class)
+        self._pools[name] = pool
+        return pool
+
+    def pool(self, name):
+        if name not in self._pools:
+            raise ValueError('Executor pool {!r} not found in pools: {!r}'
+                             ''.format(name, self.pools))
+        return self._pools[name]
+
+    async def run(self, name, func, *args, loop=None):
+        loop = loop or asyncio.get_event_loop()
+        return await self.pool(name).run(loop, func, *args)
+
+    async def run_handler(self, name, handler, frames, *payload, loop=None):
+        pool = self.pool(name)
+        if not pool.isolated:
+            return await self.run(name, handler, *payload, loop=loop)
+        if handler.pass_self:
+            raise ValueError('Expected a module level function for executor {!r}, '
+                             'methods can not be sent to another process. '
+                             'Got: {!r}'.format(name, handler.function))
+        return await self.run(name, run_frame_handler, handler.function, snapshot(frames), loop=loop)
+
+    async def map(self, name, func, frames, *, chunksize=EXECUTOR_CHUNK_SIZE, loop=None):
+        """
+        Call func(frame) for many small frames, sending them to the pool
+        in chunks to amortize the cost of each round trip.
+        Returns results in the same order as frames.
+        """
+        loop = loop or asyncio.get_event_loop()
+        snapshots = [frame.as_dict() for frame in frames]
+        chunks = [snapshots[i:i + chunksize] for i in range(0, len(snapshots), chunksize)]
+        results = await asyncio.gather(*[self.run(name, run_frame_chunk, func, chunk, loop=loop)
+                                         for chunk in chunks])
+        return [result for chunk in results for result in chunk]
+
+    def warm_up(self, names=None):
+        for name in (self.pools if names is None else names):
+            pool = self.pool(name)
+            if pool.isolated:
+                pool.warm_up()
+
+    def stats(self):
+        return {name: pool.stats() for name, pool in self._pools.items()}
+
+    def shutdown(self, wait=False):
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait)
+
+
+_default_registry = None
+_default_registry_pid = None
+
+
+def default_executors():
+    """
+    The registry shared by every agent in this process, so that a named
+    pool's size limit and metrics cover all agents using it.
+    A forked child gets a fresh registry rather than its parent's workers.
+    """
+    global _default_registry, _default_registry_pid
+
+    if _default_registry is None or _default_registry_pid != os.getpid():
+        _default_registry = ExecutorRegistry()
+        _default_registry_pid = os.getpid()
+    return _default_registry
+
+
+__all__ = [
+    'default_executors',
+    'ExecutorRegistry',
+    'Pool',
+]
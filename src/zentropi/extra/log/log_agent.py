@@ -4,6 +4,8 @@ import traceback
 
 from zentropi import Agent, on_event, on_message
 
+LOG_BATCH_SIZE = 500
+
 
 class LogAgent(Agent):
     def __init__(self, name=None):
@@ -16,16 +18,18 @@ class LogAgent(Agent):
         self.event_log_file.close()
         self.message_log_file.close()
 
-    @on_event('*')
-    def on_any_event(self, event):
-        if event.source == self.name:
-            return  # skip own events
-        self.event_log_file.write(event.as_json() + '\n')
+    @on_event('*', batch=LOG_BATCH_SIZE)
+    def on_any_event(self, events):
+        for event in events:
+            if event.source == self.name:
+                continue  # skip own events
+            self.event_log_file.write(event.as_json() + '\n')
         self.event_log_file.flush()
 
-    @on_message('*')
-    def on_any_message(self, message):
-        if message.source == self.name:
-            return  # skip own messages
-        self.message_log_file.write(message.as_json() + '\n')
+    @on_message('*', batch=LOG_BATCH_SIZE)
+    def on_any_message(self, messages):
+        for message in messages:
+            if message.source == self.name:
+                continue  # skip own messages
+            self.message_log_file.write(message.as_json() + '\n')
         self.message_log_file.flush()
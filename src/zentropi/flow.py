@@ -0,0 +1,70 @@
+# coding=utf-8
+from collections import Counter, defaultdict
+
+
+class Credits(object):
+    """
+    Credit-based flow control, both ends of it for one agent.
+
+    A consumer that joins a space with a group and credits=N lets
+    producers send N frames to the group with emit_async() before they
+    have to wait; it grants a credit back for each of those frames it
+    takes out of its inbox. A producer out of credits for a space waits
+    on wait(space) until the broker says more were granted.
+
+    Example:
+        >>> from zentropi.flow import Credits
+        >>> from zentropi.frames import Event, frame_meta
+        >>> credits = Credits()
+        >>> credits.join('sensors', 'workers')
+        >>> credits.handled(Event('reading', space='sensors', meta=frame_meta(credit=True)))
+        >>> credits.grants()
+        [('sensors', 'workers', 1)]
+    """
+    def __init__(self):
+        self._groups = {}  # type: dict  # {space: group joined with credits}
+        self._handled = Counter()  # type: Counter  # {space: frames to grant credits for}
+        self._waiters = defaultdict(list)  # type: dict  # {space: [future, ]}
+        self.stalls = Counter()  # type: Counter  # {space: emits that had to wait}
+        self.stalled_seconds = Counter()  # type: Counter  # {space: seconds spent waiting}
+
+    def join(self, space, group):
+        self._groups[space] = group
+
+    def leave(self, space):
+        self._groups.pop(space, None)
+        self._handled.pop(space, None)
+
+    def handled(self, frame):
+        """Count frame if a producer took a credit to send it to us."""
+        if frame.meta.get('credit', False) and frame.space in self._groups and not frame.target:
+            self._handled[frame.space] += 1
+
+    def grants(self):
+        """(space, group, credits) to grant back, once each."""
+        grants = [(space, self._groups[space], count) for space, count in self._handled.items()]
+        self._handled.clear()
+        return grants
+
+    def wait(self, space, loop):
+        """A future that is done when credits are granted for space."""
+        waiter = loop.create_future()
+        self._waiters[space].append(waiter)
+        return waiter
+
+    def wake(self, space):
+        for waiter in self._waiters.pop(space, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def stalled(self):
+        """Producers waiting on credits right now, per space."""
+        return {space: len([w for w in waiters if not w.done()])
+                for space, waiters in self._waiters.items() if any(not w.done() for w in waiters)}
+
+    def stats(self):
+        return {
+            'stalls': dict(self.stalls),
+            'stalled_seconds': {space: round(seconds, 3) for space, seconds in self.stalled_seconds.items()},
+            'stalled': self.stalled(),
+        }
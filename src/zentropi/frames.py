@@ -15,6 +15,53 @@ from zentropi.utils import (
     validate_name
 )
 
+PRIORITIES = ('control', 'interactive', 'bulk')  # most urgent first.
+
+
+def frame_meta(retain=False, ttl=None, deadline=None, priority=None, credit=False,
+               reliable=False) -> Optional[dict]:
+    """
+    Meta for a new frame: retain, a deadline after which the frame is
+    dropped unhandled, given as a time.time() or as ttl seconds from now,
+    a priority other than the default for its kind, credit if a flow
+    control credit was taken to send it, and reliable if it is to be
+    sent again until acked.
+
+    Example:
+        >>> from zentropi.frames import frame_meta
+        >>> frame_meta(retain=True, deadline=1500000000)
+        {'retain': True, 'deadline': 1500000000.0}
+    """
+    if priority is not None and priority not in PRIORITIES:
+        raise ValueError('Expected priority to be one of {!r}. '
+                         'Got: {!r}'.format(PRIORITIES, priority))
+    if ttl is not None and (isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl <= 0):
+        raise ValueError('Expected ttl to be seconds > 0. '
+                         'Got: {!r}'.format(ttl))
+    if ttl is not None and deadline is not None:
+        raise ValueError('Expected either ttl: {!r} or deadline: {!r}.'.format(ttl, deadline))
+    if ttl is not None:
+        deadline = time.time() + ttl
+    meta = {}
+    if retain:
+        meta['retain'] = True
+    if deadline is not None:
+        meta['deadline'] = round(float(deadline), 3)
+    if priority is not None:
+        meta['priority'] = priority
+    if credit:
+        meta['credit'] = True
+    if reliable:
+        meta['reliable'] = True
+    return meta or None
+
+
+def expired(meta, now=None) -> bool:
+    """True if frame meta (a dict, so that frames can be dropped before
+    they are built) has a deadline that has passed."""
+    deadline = meta.get('deadline', None) if meta else None
+    return deadline is not None and deadline <= (time.time() if now is None else now)
+
 
 class FrameData(UserDict):
     def __init__(self, *args, **kwargs):
@@ -130,6 +177,39 @@ class Frame(object):
     def internal(self) -> bool:
         return self._meta.get('internal', False)
 
+    @property
+    def retain(self) -> bool:
+        """Brokers keep the last retained frame of each name in a space
+        and replay it to agents that join later."""
+        return self._meta.get('retain', False)
+
+    @property
+    def deadline(self) -> Optional[float]:
+        return self._meta.get('deadline', None)
+
+    @property
+    def expired(self) -> bool:
+        return expired(self._meta)
+
+    @property
+    def seq(self) -> Optional[int]:
+        """Position among the frames its source sent to its space, see Sequencer."""
+        return self._meta.get('seq', None)
+
+    @property
+    def priority(self) -> str:
+        """Queues hand out control frames (commands, states and *** events)
+        before interactive ones (messages, requests and responses), and
+        those before bulk events, unless meta says otherwise."""
+        priority = self._meta.get('priority', None)
+        if priority in PRIORITIES:
+            return priority
+        if self._kind in (KINDS.COMMAND, KINDS.STATE) or (self._name or '').startswith('***'):
+            return 'control'
+        if self._kind == KINDS.EVENT:
+            return 'bulk'
+        return 'interactive'
+
     @staticmethod
     def build(name: str, *,
               data: dict = None,
@@ -151,6 +231,12 @@ class Frame(object):
         else:
             return Frame(name, data=data, meta=meta, kind=kind, id=id)
 
+    def project(self, fields) -> 'Frame':
+        """A copy of this frame with only the data keys in fields."""
+        data = self._data.data
+        return Frame.build(self._name, data={k: data[k] for k in fields if k in data},
+                           meta=dict(self._meta), kind=self._kind, id=self.id)
+
     @staticmethod
     def from_dict(frame_as_dict):
         return Frame.build(**frame_as_dict)
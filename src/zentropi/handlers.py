@@ -1,5 +1,5 @@
 # coding=utf-8
-from collections import defaultdict
+from collections import Counter, defaultdict
 from inspect import (
     getfullargspec,
     iscoroutinefunction
@@ -9,9 +9,18 @@ from fuzzywuzzy import fuzz, process
 from parse import parse as string_parse
 from sortedcontainers import SortedListWithKey
 
-from zentropi.defaults import \
-    MATCH_FUZZY_THRESHOLD
+from zentropi.defaults import (
+    BATCH_LINGER,
+    HANDLER_CACHE_SIZE,
+    MATCH_FUZZY_THRESHOLD,
+    PARTITION_LANE_SIZE,
+    PARTITION_LANES
+)
+from zentropi.predicates import Predicate
+from zentropi.rates import validate_rates
+from zentropi.symbols import KINDS
 from zentropi.utils import (
+    validate_executor,
     validate_handler,
     validate_kind,
     validate_name
@@ -23,11 +32,20 @@ class Handler(object):
         '_kind', '_name', '_handler',
         '_meta', '_async', '_pass_self',
         '_match_exact', '_match_parse', '_match_fuzzy',
-        '_ignore_case', '_length', '_filters'
+        '_ignore_case', '_length', '_filters',
+        '_executor', '_batch', '_linger', '_max_concurrency',
+        '_partition_by', '_lanes', '_lane_size',
+        '_cache', '_cache_size', '_invalidate_on',
+        '_where', '_fields',
+        '_rate', '_burst', '_coalesce', '_sample',
     ]
 
     def __init__(self, kind, name, handler, meta=None,
-                 exact=True, parse=False, fuzzy=False, ignore_case=False, **kwargs):
+                 exact=True, parse=False, fuzzy=False, ignore_case=False,
+                 executor=None, batch=None, linger=None, max_concurrency=None,
+                 partition_by=None, lanes=PARTITION_LANES, lane_size=PARTITION_LANE_SIZE,
+                 cache=None, cache_size=HANDLER_CACHE_SIZE, invalidate_on=None, where=None, fields=None,
+                 rate=None, burst=None, coalesce=None, sample=None, **kwargs):
         if callable(handler) and not iscoroutinefunction(handler):
             self._async = False
         elif iscoroutinefunction(handler):
@@ -48,6 +66,60 @@ class Handler(object):
                              'to be True.'.format(parse, fuzzy))
         if parse or fuzzy:
             exact = False
+        if batch is not None and (not isinstance(batch, int) or batch < 1):
+            raise ValueError('Expected batch to be a positive integer. '
+                             'Got: {!r}'.format(batch))
+        if batch and validate_kind(kind) in (KINDS.STATE, KINDS.TIMER):
+            raise ValueError('Expected batch only for event, message or request handlers. '
+                             'Got kind: {!r}'.format(kind))
+        if max_concurrency is not None and (not isinstance(max_concurrency, int) or max_concurrency < 1):
+            raise ValueError('Expected max_concurrency to be a positive integer. '
+                             'Got: {!r}'.format(max_concurrency))
+        if partition_by is not None and (not isinstance(partition_by, str) or not partition_by.strip()):
+            raise ValueError('Expected partition_by to be a dotted path like \'data.chat_id\'. '
+                             'Got: {!r}'.format(partition_by))
+        if partition_by and (batch or validate_kind(kind) in (KINDS.STATE, KINDS.TIMER)):
+            raise ValueError('Expected partition_by only for event, message or request handlers '
+                             'without batch. Got kind: {!r} batch: {!r}'.format(kind, batch))
+        if cache is not None and cache is not True and (
+                not isinstance(cache, (int, float)) or isinstance(cache, bool) or cache <= 0):
+            raise ValueError('Expected cache to be True or a ttl in seconds > 0. '
+                             'Got: {!r}'.format(cache))
+        if cache and (batch or partition_by or validate_kind(kind) not in (KINDS.MESSAGE, KINDS.REQUEST)):
+            raise ValueError('Expected cache only for message or request handlers '
+                             'without batch or partition_by. Got kind: {!r}'.format(kind))
+        if invalidate_on is not None and (not cache or not isinstance(invalidate_on, str)):
+            raise ValueError('Expected invalidate_on to be an event name for a handler with cache. '
+                             'Got: invalidate_on: {!r} cache: {!r}'.format(invalidate_on, cache))
+        if where is not None and validate_kind(kind) not in (KINDS.EVENT, KINDS.MESSAGE, KINDS.REQUEST):
+            raise ValueError('Expected where only for event, message or request handlers. '
+                             'Got kind: {!r}'.format(kind))
+        if fields is not None and (isinstance(fields, str) or not all(isinstance(f, str) and f for f in fields)):
+            raise ValueError('Expected fields to be a list of data keys like [\'text\', \'user_id\']. '
+                             'Got: {!r}'.format(fields))
+        if fields is not None and (parse or fuzzy or validate_kind(kind) not in (
+                KINDS.EVENT, KINDS.MESSAGE, KINDS.REQUEST)):
+            raise ValueError('Expected fields only for exact event, message or request handlers. '
+                             'Got kind: {!r} parse: {!r} fuzzy: {!r}'.format(kind, parse, fuzzy))
+        validate_rates(rate=rate, burst=burst, coalesce=coalesce, sample=sample)
+        if (rate or coalesce or sample) and validate_kind(kind) != KINDS.EVENT:
+            raise ValueError('Expected rate, coalesce or sample only for event handlers. '
+                             'Got kind: {!r}'.format(kind))
+        for option, value in (('lanes', lanes), ('lane_size', lane_size), ('cache_size', cache_size)):
+            if not isinstance(value, int) or value < 1:
+                raise ValueError('Expected {} to be a positive integer. '
+                                 'Got: {!r}'.format(option, value))
+        if linger is not None and (not batch or not isinstance(linger, (int, float)) or linger < 0):
+            raise ValueError('Expected linger to be seconds >= 0 for a batch handler. '
+                             'Got: linger: {!r} batch: {!r}'.format(linger, batch))
+        if executor is not None and self._async:
+            raise ValueError('Expected executor: {!r} only for synchronous handlers, '
+                             'coroutine functions already run on the event loop.'
+                             ''.format(executor))
+        if executor == 'process' and self._pass_self:
+            raise ValueError('Expected a module level function for executor: \'process\', '
+                             'methods can not be sent to another process. '
+                             'Got: {!r}'.format(handler))
         self._kind = validate_kind(kind)
         self._name = validate_name(name)
         self._handler = handler
@@ -57,6 +129,27 @@ class Handler(object):
         self._match_fuzzy = bool(fuzzy)
         self._length = len(name)
         self._ignore_case = bool(ignore_case)
+        self._executor = validate_executor(executor)
+        self._batch = batch
+        self._linger = BATCH_LINGER if linger is None else linger
+        self._max_concurrency = max_concurrency
+        self._partition_by = partition_by
+        self._lanes = lanes
+        self._lane_size = lane_size
+        self._cache = cache
+        self._cache_size = cache_size
+        self._invalidate_on = invalidate_on
+        self._where = Predicate(where) if where is not None else None
+        self._fields = None
+        if fields is not None:
+            paths = [path for path, _, _ in self._where.clauses] if self._where else []
+            paths.append(partition_by or '')
+            self._fields = frozenset(fields).union(  # keys that where= and partition_by read too.
+                path.split('.')[1] for path in paths if path.startswith('data.'))
+        self._rate = rate
+        self._burst = burst
+        self._coalesce = coalesce
+        self._sample = sample
         self._filters = {k[1:]: a for k, a in kwargs.items() if k.startswith('_')}
         unexpected_kwargs = [k for k in kwargs if not k.startswith('_')]
         if unexpected_kwargs:
@@ -68,6 +161,10 @@ class Handler(object):
     def __call__(self, *args, **kwargs):
         return self._handler(*args, **kwargs)
 
+    @property
+    def function(self):
+        return self._handler
+
     @property
     def name(self):
         return self._name
@@ -108,10 +205,188 @@ class Handler(object):
     def filters(self):
         return self._filters
 
+    @property
+    def executor(self):
+        return self._executor
+
+    @property
+    def batch(self):
+        return self._batch
+
+    @property
+    def linger(self):
+        return self._linger
+
+    @property
+    def max_concurrency(self):
+        return self._max_concurrency
+
+    @property
+    def partition_by(self):
+        return self._partition_by
+
+    @property
+    def lanes(self):
+        return self._lanes
+
+    @property
+    def lane_size(self):
+        return self._lane_size
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def cache_size(self):
+        return self._cache_size
+
+    @property
+    def invalidate_on(self):
+        return self._invalidate_on
+
+    @property
+    def where(self):
+        return self._where
+
+    @property
+    def fields(self):
+        """Data keys the handler reads, None for all of them."""
+        return self._fields
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def burst(self):
+        return self._burst
+
+    @property
+    def coalesce(self):
+        return self._coalesce
+
+    @property
+    def sample(self):
+        return self._sample
+
+
+class Interests(object):
+    """
+    What an agent's handlers could match, for brokers to skip delivering
+    frames that no handler would accept: exact names, literal prefixes of
+    parse patterns and a wildcard flag for '*' and fuzzy handlers (or parse
+    patterns without a literal prefix).
+
+    Names whose handlers all have a where= predicate are only interesting
+    when one of those predicates holds; brokers index them with
+    PredicateIndex rather than calling accepts() for every agent.
+    Names whose handlers all declare fields= only need those data keys,
+    unless a parse pattern's prefix could match them too.
+
+    Example:
+        >>> from zentropi.frames import Event
+        >>> from zentropi.handlers import Interests
+        >>> interests = Interests(names=['ping'], prefixes=['get '])
+        >>> interests.accepts(Event('ping')), interests.accepts(Event('get a')), interests.accepts(Event('pong'))
+        (True, True, False)
+    """
+    def __init__(self, names=(), prefixes=(), wildcard=False, predicates=None, fields=None):
+        self._names = frozenset(names)
+        self._prefixes = tuple(sorted(set(p.lower() for p in prefixes)))
+        self._wildcard = bool(wildcard)
+        self._predicates = {name: tuple(sorted({Predicate(w) for w in wheres}, key=lambda p: p.where))
+                            for name, wheres in (predicates or {}).items()
+                            if name not in self._names}  # type: dict
+        self._fields = {name: frozenset(keys) for name, keys in (fields or {}).items()
+                        if not self._prefixed(name)}  # type: dict  # parse handlers may read any key.
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def prefixes(self):
+        return self._prefixes
+
+    @property
+    def wildcard(self):
+        return self._wildcard
+
+    @property
+    def predicates(self):
+        """{name: (Predicate, )} for names only handled on a condition."""
+        return self._predicates
+
+    @property
+    def fields(self):
+        """{name: frozenset(data keys)} for names only handled with fields=."""
+        return self._fields
+
+    def _prefixed(self, text):
+        return bool(self._prefixes) and text.lower().startswith(self._prefixes)
+
+    def fields_for(self, frame):
+        """Data keys of frame that are used, None if all of them may be."""
+        if self._wildcard or frame.kind not in (KINDS.EVENT, KINDS.MESSAGE, KINDS.REQUEST):
+            return None
+        if self._prefixed(frame.data.text if isinstance(frame.data.text, str) else frame.name):
+            return None
+        return self._fields.get(frame.name, None) or self._fields.get(frame.name.lower(), None)
+
+    def accepts(self, frame):
+        if self.matches(frame):
+            return True
+        predicates = self._predicates.get(frame.name, None) or self._predicates.get(frame.name.lower(), ())
+        return any(predicate(frame) for predicate in predicates)
+
+    def matches(self, frame):
+        """Accepts frame whatever its data."""
+        if self._wildcard or frame.kind not in (KINDS.EVENT, KINDS.MESSAGE, KINDS.REQUEST):
+            return True
+        name = frame.name
+        if name in self._names or name.lower() in self._names:
+            return True
+        return self._prefixed(frame.data.text if isinstance(frame.data.text, str) else name)
+
+    def merge(self, *others):
+        predicates = {}  # type: dict
+        fields = {}  # type: dict
+        everything = set()  # type: set  # names some handler needs all data keys of
+        for interests in (self, ) + others:
+            for name, predicates_ in interests.predicates.items():
+                predicates.setdefault(name, set()).update(p.where for p in predicates_)
+            for name in interests.names.union(interests.predicates):
+                if name in interests.fields:
+                    fields[name] = fields.get(name, frozenset()).union(interests.fields[name])
+                else:
+                    everything.add(name)
+        return Interests(names=self._names.union(*[o.names for o in others]),
+                         prefixes=self._prefixes + tuple(p for o in others for p in o.prefixes),
+                         wildcard=self._wildcard or any(o.wildcard for o in others),
+                         predicates=predicates,
+                         fields={name: keys for name, keys in fields.items() if name not in everything})
+
+    def as_dict(self):
+        interests = {'names': sorted(self._names), 'prefixes': list(self._prefixes), 'wildcard': self._wildcard}
+        if self._predicates:
+            interests['predicates'] = {name: [p.where for p in predicates]
+                                       for name, predicates in self._predicates.items()}
+        if self._fields:
+            interests['fields'] = {name: sorted(keys) for name, keys in self._fields.items()}
+        return interests
+
+    def __eq__(self, other):
+        return isinstance(other, Interests) and self.as_dict() == other.as_dict()
+
 
 class HandlerRegistry(object):
     def __init__(self):
         self._handlers = defaultdict(set)
+        self._interest_names = Counter()  # type: Counter
+        self._interest_prefixes = Counter()  # type: Counter
+        self._interest_wildcards = 0
+        self._interest_predicates = Counter()  # type: Counter  # {(name, where): count}
         self._index_exact = SortedListWithKey(key=len)
         self._index_parse = SortedListWithKey(key=len)
         self._index_fuzzy = SortedListWithKey(key=len)
@@ -142,8 +417,11 @@ class HandlerRegistry(object):
             self._index_parse.add(name)
         else:  # handler.match_fuzzy:
             self._index_fuzzy.add(name)
+        self._count_interest(name, handler, 1)
 
     def remove_handler(self, name, handler):
+        if handler.ignore_case:
+            name = name.lower()
         self._handlers[name].remove(handler)
         if handler.match_exact:
             self._index_exact.remove(name)
@@ -151,6 +429,30 @@ class HandlerRegistry(object):
             self._index_parse.remove(name)
         else:  # handler.match_fuzzy:
             self._index_fuzzy.remove(name)
+        self._count_interest(name, handler, -1)
+
+    def _count_interest(self, name, handler, count):
+        prefix = name.split('{', 1)[0] if handler.match_parse else None
+        if name == '*' or handler.match_fuzzy or prefix == '':
+            self._interest_wildcards += count
+        elif handler.match_parse:
+            self._interest_prefixes[prefix] += count
+        elif handler.where is not None:
+            self._interest_predicates[name, handler.where.where] += count
+        else:
+            self._interest_names[name] += count
+
+    def interests(self):
+        predicates = defaultdict(list)  # type: dict
+        for name, where in +self._interest_predicates:
+            predicates[name].append(where)
+        fields = {}
+        for name in set(+self._interest_names).union(predicates):
+            handlers = self._handlers.get(name, ())
+            if handlers and all(h.fields is not None for h in handlers):
+                fields[name] = frozenset().union(*[h.fields for h in handlers])
+        return Interests(names=+self._interest_names, prefixes=+self._interest_prefixes,
+                         wildcard=self._interest_wildcards > 0, predicates=predicates, fields=fields)
 
     def match(self, frame):
         for match_function in self.match_functions:
@@ -218,6 +520,9 @@ class Registry(object):
     def remove_handler(self, name, handler):
         self._registry.remove_handler(name, handler)
 
+    def interests(self):
+        return self._registry.interests()
+
     def match(self, frame):
         """Returns (frame, {handlers})"""
         return self._registry.match(frame)
@@ -1,11 +1,13 @@
 # coding=utf-8
-from zentropi.frames import Message
+from zentropi.frames import Message, frame_meta
 from zentropi.handlers import Registry
 
 
 class Messages(Registry):
-    def message(self, name, data=None, space=None, internal=False, source=None, reply_to=None):
-        frame_ = Message(name=name, data=data, space=space, source=source, reply_to=reply_to, internal=internal)
+    def message(self, name, data=None, space=None, internal=False, source=None, reply_to=None, target=None,
+                ttl=None, deadline=None, priority=None, reliable=False):
+        frame_ = Message(name=name, data=data, space=space, source=source, reply_to=reply_to, internal=internal,
+                         target=target, meta=frame_meta(ttl=ttl, deadline=deadline, priority=priority, reliable=reliable))
         # frame, handlers = self._registry.match(frame=frame_)
         # for handler in handlers:
         #     ret_val = self._trigger_frame_handler(
@@ -0,0 +1,112 @@
+# coding=utf-8
+import hashlib
+import zlib
+from bisect import bisect, insort
+from collections import deque
+
+from zentropi.defaults import \
+    PARTITION_VIRTUAL_NODES
+from zentropi.utils import resolve_field
+
+
+def key_hash(key):
+    """A hash that is stable across processes (unlike hash() on str)."""
+    return zlib.crc32(str(key).encode('utf-8'))
+
+
+def ring_hash(key):
+    """Like key_hash, but similar keys land far apart on a HashRing."""
+    return int(hashlib.md5(str(key).encode('utf-8')).hexdigest()[:8], 16)
+
+
+class Lanes(object):
+    """
+    Serial lanes for one handler: frames are hashed on handler.partition_by
+    to one of handler.lanes lanes, each lane handles its frames one at a
+    time and in order while different lanes run concurrently.
+
+    Lanes are bounded to handler.lane_size frames; put() refuses frames
+    arriving at a full lane and returns False.
+    """
+    def __init__(self, handler, callback, spawn):
+        self._handler = handler
+        self._callback = callback  # coroutine function(handler, frame)
+        self._spawn = spawn  # spawn(coro, handler=None)
+        self._queues = [deque() for _ in range(handler.lanes)]
+        self._running = [False] * handler.lanes
+
+    def lane(self, frame):
+        return key_hash(resolve_field(frame, self._handler.partition_by)) % len(self._queues)
+
+    def put(self, frame):
+        index = self.lane(frame)
+        queue = self._queues[index]
+        if len(queue) >= self._handler.lane_size:
+            return False
+        queue.append(frame)
+        if not self._running[index]:
+            self._running[index] = True
+            self._spawn(self._drain(index), handler=self._handler)
+        return True
+
+    async def _drain(self, index):
+        queue = self._queues[index]
+        try:
+            while queue:
+                await self._callback(self._handler, queue.popleft())
+        finally:
+            self._running[index] = False
+
+    def depths(self):
+        return [len(queue) for queue in self._queues]
+
+
+class HashRing(object):
+    """
+    Consistent hashing of keys to nodes: each node is placed on the ring
+    at `replicas` points and a key belongs to the node of the first point
+    at or after the key's hash. Adding or removing a node only moves the
+    keys between that node's points and their neighbours.
+
+    Example:
+        >>> from zentropi.partitions import HashRing
+        >>> ring = HashRing(['a', 'b'])
+        >>> ring.node('device-1') == HashRing(['b', 'a']).node('device-1')
+        True
+    """
+    def __init__(self, nodes=None, replicas=PARTITION_VIRTUAL_NODES):
+        if not isinstance(replicas, int) or replicas < 1:
+            raise ValueError('Expected replicas to be a positive integer. '
+                             'Got: {!r}'.format(replicas))
+        self._replicas = replicas
+        self._points = []  # type: list  # sorted [(hash, node), ]
+        self._nodes = set()  # type: set
+        for node in nodes or []:
+            self.add(node)
+
+    @property
+    def nodes(self):
+        return sorted(self._nodes)
+
+    def add(self, node):
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for replica in range(self._replicas):
+            insort(self._points, (ring_hash('{}#{}'.format(node, replica)), node))
+
+    def remove(self, node):
+        if node not in self._nodes:
+            return
+        self._nodes.remove(node)
+        self._points = [point for point in self._points if point[1] != node]
+
+    def node(self, key):
+        """The node key belongs to, None if the ring is empty."""
+        if not self._points:
+            return None
+        index = bisect(self._points, (ring_hash(key), ''))
+        return self._points[index % len(self._points)][1]
+
+    def __len__(self):
+        return len(self._nodes)
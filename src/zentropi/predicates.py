@@ -0,0 +1,248 @@
+# coding=utf-8
+import operator
+import re
+from ast import literal_eval
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+
+from zentropi.utils import resolve_field
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    'in': lambda value, values: value in values,
+}
+RANGE_OPERATORS = ('>', '>=', '<', '<=')
+
+_CLAUSE = re.compile(r'''\s*(?P<path>[A-Za-z_][\w.]*)\s*(?P<op>==|!=|>=|<=|>|<|in\b)\s*
+                         (?P<value>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|\[[^\]]*\]|[^\s\]]+)
+                         \s*(?P<end>\band\b|$)''', re.VERBOSE)
+
+
+def parse_where(where):
+    """
+    Clauses (path, operator, value) of a predicate like
+    "data.value > 30 and data.room == 'lab'"; all clauses must hold.
+
+    Example:
+        >>> from zentropi.predicates import parse_where
+        >>> parse_where("data.value > 30 and data.room in ['lab', 'office']")
+        (('data.value', '>', 30), ('data.room', 'in', ('lab', 'office')))
+    """
+    if not isinstance(where, str) or not where.strip():
+        raise ValueError('Expected where to be a predicate like "data.value > 30". '
+                         'Got: {!r}'.format(where))
+    clauses = []
+    position = 0
+    while position < len(where):
+        match = _CLAUSE.match(where, position)
+        if not match or (match.group('end') and match.end() == len(where)):
+            raise ValueError('Expected clauses like "data.value > 30" joined by "and" in where. '
+                             'Got: {!r} at: {!r}'.format(where, where[position:]))
+        path, op, value = match.group('path', 'op', 'value')
+        try:
+            value = literal_eval(value)
+        except (ValueError, SyntaxError):
+            raise ValueError('Expected a number, string, True, False, None or a list in where. '
+                             'Got: {!r} in: {!r}'.format(value, where))
+        if op == 'in' and not isinstance(value, (list, tuple)):
+            raise ValueError('Expected a list after "in" in where. '
+                             'Got: {!r} in: {!r}'.format(value, where))
+        if op in RANGE_OPERATORS and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError('Expected a number after {!r} in where. '
+                             'Got: {!r} in: {!r}'.format(op, value, where))
+        clauses.append((path, op, tuple(value) if op == 'in' else value))
+        position = match.end()
+    return tuple(clauses)
+
+
+def _compile(path, op, value):
+    compare = OPERATORS[op]
+
+    def clause(frame):
+        found = resolve_field(frame, path)
+        if found is None:
+            return False
+        try:
+            return compare(found, value)
+        except TypeError:  # '30' > 20
+            return False
+
+    return clause
+
+
+class Predicate(object):
+    """
+    A where= predicate compiled to one closure per clause.
+
+    Example:
+        >>> from zentropi.frames import Event
+        >>> from zentropi.predicates import Predicate
+        >>> hot_lab = Predicate("data.value > 30 and data.room == 'lab'")
+        >>> hot_lab(Event('temperature', data={'value': 35, 'room': 'lab'}))
+        True
+    """
+    __slots__ = ('_where', '_clauses', '_compiled')
+
+    def __init__(self, where):
+        self._where = where.strip() if isinstance(where, str) else where
+        self._clauses = parse_where(where)
+        self._compiled = tuple(_compile(*clause) for clause in self._clauses)
+
+    @property
+    def where(self):
+        return self._where
+
+    @property
+    def clauses(self):
+        return self._clauses
+
+    def __call__(self, frame):
+        for clause in self._compiled:
+            if not clause(frame):
+                return False
+        return True
+
+    def __eq__(self, other):
+        return isinstance(other, Predicate) and self._clauses == other.clauses
+
+    def __hash__(self):
+        return hash(self._clauses)
+
+    def __repr__(self):
+        return 'Predicate({!r})'.format(self._where)
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class _NameIndex(object):
+    """Clauses of the predicates for one frame name, by path and operator."""
+    def __init__(self):
+        self.equal = defaultdict(lambda: defaultdict(Counter))  # {path: {value: Counter(id)}}
+        self.ranges = defaultdict(lambda: defaultdict(lambda: ([], [])))  # {path: {op: (values, ids)}}
+        self.residual = []  # type: list  # [(id, clause), ]
+        self.sizes = {}  # type: dict  # {id: number of clauses}
+
+
+class PredicateIndex(object):
+    """
+    Many subscribers' predicates indexed by frame name, field path and
+    operator, so that a frame is checked with a lookup per field instead
+    of evaluating every predicate.
+
+    A predicate holds when all its clauses do: equality and 'in' clauses
+    are found with a dict lookup of the frame's value, range clauses with
+    a bisect of their sorted thresholds; only '!=' is evaluated per clause.
+
+    Example:
+        >>> from zentropi.frames import Event
+        >>> from zentropi.predicates import Predicate, PredicateIndex
+        >>> index = PredicateIndex()
+        >>> index.add('temperature', Predicate('data.value > 30'), key='hot')
+        >>> index.add('temperature', Predicate('data.value < 0'), key='cold')
+        >>> index.match(Event('temperature', data={'value': 35}))
+        {'hot'}
+    """
+    def __init__(self):
+        self._names = defaultdict(_NameIndex)  # {frame_name: _NameIndex}
+        self._entries = {}  # type: dict  # {id: (name, predicate, key)}
+        self._ids = {}  # type: dict  # {(name, predicate, key): id}
+        self._keys = defaultdict(set)  # type: dict  # {key: {(name, predicate), }}
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, name, predicate, key):
+        if (name, predicate, key) in self._ids:
+            return
+        id_ = self._next_id
+        self._next_id += 1
+        self._entries[id_] = (name, predicate, key)
+        self._ids[name, predicate, key] = id_
+        self._keys[key].add((name, predicate))
+        index = self._names[name]
+        index.sizes[id_] = len(predicate.clauses)
+        for path, op, value in predicate.clauses:
+            if op == '==' and _hashable(value):
+                index.equal[path][value][id_] += 1
+            elif op == 'in' and all(_hashable(v) for v in value):
+                for value_ in set(value):
+                    index.equal[path][value_][id_] += 1
+            elif op in RANGE_OPERATORS:
+                values, ids = index.ranges[path][op]
+                position = bisect_right(values, value)
+                values.insert(position, value)
+                ids.insert(position, id_)
+            else:
+                index.residual.append((id_, _compile(path, op, value)))
+
+    def remove(self, name, predicate, key):
+        id_ = self._ids.pop((name, predicate, key), None)
+        if id_ is None:
+            return
+        del self._entries[id_]
+        self._keys[key].discard((name, predicate))
+        if not self._keys[key]:
+            del self._keys[key]
+        index = self._names[name]
+        del index.sizes[id_]
+        for by_value in index.equal.values():
+            for ids in by_value.values():
+                ids.pop(id_, None)
+        for by_op in index.ranges.values():
+            for values, ids in by_op.values():
+                while id_ in ids:
+                    position = ids.index(id_)
+                    del values[position], ids[position]
+        index.residual = [(i, clause) for i, clause in index.residual if i != id_]
+        if not index.sizes:
+            del self._names[name]
+
+    def remove_key(self, key):
+        for name, predicate in list(self._keys.get(key, ())):
+            self.remove(name, predicate, key)
+
+    def match(self, frame):
+        """Keys of the predicates that frame satisfies."""
+        keys = set()
+        for name in {frame.name, frame.name.lower()}:
+            index = self._names.get(name, None)
+            if index is not None:
+                keys.update(self._entries[id_][2] for id_ in self._match(index, frame))
+        return keys
+
+    @staticmethod
+    def _match(index, frame):
+        counts = Counter()  # type: Counter
+        for path, by_value in index.equal.items():
+            value = resolve_field(frame, path)
+            if value is not None and _hashable(value):
+                counts.update(by_value.get(value, ()))
+        for path, by_op in index.ranges.items():
+            value = resolve_field(frame, path)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            for op, (values, ids) in by_op.items():
+                if op == '>':  # thresholds below value
+                    counts.update(ids[:bisect_left(values, value)])
+                elif op == '>=':
+                    counts.update(ids[:bisect_right(values, value)])
+                elif op == '<':
+                    counts.update(ids[bisect_right(values, value):])
+                else:  # '<='
+                    counts.update(ids[bisect_left(values, value):])
+        for id_, clause in index.residual:
+            if clause(frame):
+                counts[id_] += 1
+        return [id_ for id_, count in counts.items() if count == index.sizes[id_]]
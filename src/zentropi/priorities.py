@@ -0,0 +1,74 @@
+# coding=utf-8
+from collections import deque
+
+from zentropi.defaults import (
+    PRIORITY_SCHEDULING,
+    PRIORITY_WEIGHTS
+)
+from zentropi.frames import PRIORITIES
+
+SCHEDULINGS = ('strict', 'weighted')
+
+
+class FrameQueue(object):
+    """
+    Frames queued per priority class (see Frame.priority).
+
+    With strict scheduling pop() always hands out the most urgent frame,
+    so a flood of bulk events waits behind every control frame. With
+    weighted scheduling each class takes up to its weight in frames per
+    round, most urgent first, so bulk frames keep moving too.
+
+    Example:
+        >>> from zentropi.frames import Command, Event
+        >>> from zentropi.priorities import FrameQueue
+        >>> queue = FrameQueue(scheduling='strict')
+        >>> queue.push(Event('reading'))
+        >>> queue.push(Command('join'))
+        >>> queue.pop().name, queue.depths()
+        ('join', {'control': 0, 'interactive': 0, 'bulk': 1})
+    """
+    def __init__(self, scheduling=PRIORITY_SCHEDULING, weights=None):
+        if scheduling not in SCHEDULINGS:
+            raise ValueError('Expected scheduling to be one of {!r}. '
+                             'Got: {!r}'.format(SCHEDULINGS, scheduling))
+        weights = dict(PRIORITY_WEIGHTS, **(weights or {}))
+        for priority, weight in weights.items():
+            if priority not in PRIORITIES or not isinstance(weight, int) or weight < 1:
+                raise ValueError('Expected weights to be positive integers for priorities in {!r}. '
+                                 'Got: {!r}'.format(PRIORITIES, weights))
+        self._scheduling = scheduling
+        self._weights = weights
+        self._credits = dict(weights)
+        self._queues = {priority: deque() for priority in PRIORITIES}  # type: dict
+
+    @property
+    def scheduling(self):
+        return self._scheduling
+
+    def push(self, frame):
+        self._queues[frame.priority].append(frame)
+
+    def pop(self):
+        """The next frame to handle; raises IndexError if there is none."""
+        if self._scheduling == 'strict':
+            for priority in PRIORITIES:
+                if self._queues[priority]:
+                    return self._queues[priority].popleft()
+            raise IndexError('pop from an empty FrameQueue')
+        for _ in range(2):  # a second pass after a new round of credits.
+            for priority in PRIORITIES:
+                if self._queues[priority] and self._credits[priority]:
+                    self._credits[priority] -= 1
+                    return self._queues[priority].popleft()
+            self._credits = dict(self._weights)
+        raise IndexError('pop from an empty FrameQueue')
+
+    def depths(self):
+        return {priority: len(self._queues[priority]) for priority in PRIORITIES}
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def __bool__(self):
+        return any(self._queues.values())
@@ -0,0 +1,144 @@
+# coding=utf-8
+import time
+from collections import Counter
+
+
+def validate_rates(rate=None, burst=None, coalesce=None, sample=None):
+    if rate is not None and (isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate <= 0):
+        raise ValueError('Expected rate to be frames per second > 0. '
+                         'Got: {!r}'.format(rate))
+    if burst is not None and (rate is None or isinstance(burst, bool) or not isinstance(burst, int) or burst < 1):
+        raise ValueError('Expected burst to be a positive integer with a rate. '
+                         'Got: burst: {!r} rate: {!r}'.format(burst, rate))
+    if coalesce is not None and (isinstance(coalesce, bool) or not isinstance(coalesce, (int, float))
+                                 or coalesce <= 0):
+        raise ValueError('Expected coalesce to be a window in seconds > 0. '
+                         'Got: {!r}'.format(coalesce))
+    if sample is not None and (isinstance(sample, bool) or not isinstance(sample, int) or sample < 1):
+        raise ValueError('Expected sample to be a positive integer N, to keep 1 in N frames. '
+                         'Got: {!r}'.format(sample))
+
+
+class TokenBucket(object):
+    """
+    Lets through up to burst frames at once and rate frames per second
+    on average: each frame takes a token, tokens come back at rate per
+    second up to burst.
+
+    Example:
+        >>> from zentropi.rates import TokenBucket
+        >>> bucket = TokenBucket(rate=10, burst=2)
+        >>> [bucket.take(now=0) for _ in range(3)], bucket.take(now=0.1)
+        ([True, True, False], True)
+    """
+    __slots__ = ('_rate', '_burst', '_tokens', '_updated', '_clock')
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        validate_rates(rate=rate, burst=burst)
+        self._rate = rate
+        self._burst = burst or max(1, int(rate))
+        self._tokens = float(self._burst)
+        self._updated = None
+        self._clock = clock
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def burst(self):
+        return self._burst
+
+    def take(self, now=None):
+        now = self._clock() if now is None else now
+        if self._updated is not None:
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class RateLimit(object):
+    """
+    Rate controls for frames of one name from one source (the key):
+    1-in-sample of them are kept, then at most rate per second (with
+    bursts of burst), then with coalesce only the newest one of each
+    window of that many seconds is delivered, at the end of the window.
+
+    Without an event loop coalesce does not hold frames back.
+    counters has how many frames were delivered, sampled_out,
+    rate_limited and coalesced (replaced by a newer one).
+
+    Example:
+        >>> from zentropi.rates import RateLimit
+        >>> limit = RateLimit(sample=2)
+        >>> delivered = []
+        >>> for value in range(5):
+        ...     limit.submit(('reading', 'probe'), value, delivered.append)
+        >>> delivered, limit.counters['sampled_out']
+        ([0, 2, 4], 2)
+    """
+    def __init__(self, rate=None, burst=None, coalesce=None, sample=None, clock=time.monotonic):
+        validate_rates(rate=rate, burst=burst, coalesce=coalesce, sample=sample)
+        self._rate = rate
+        self._burst = burst
+        self._coalesce = coalesce
+        self._sample = sample
+        self._clock = clock
+        self._buckets = {}  # type: dict  # {key: TokenBucket}
+        self._seen = Counter()  # type: Counter  # {key: frames seen, for sample}
+        self._latest = {}  # type: dict  # {key: newest item of the open coalesce window}
+        self.counters = Counter()  # type: Counter
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def burst(self):
+        return self._burst
+
+    @property
+    def coalesce(self):
+        return self._coalesce
+
+    @property
+    def sample(self):
+        return self._sample
+
+    def submit(self, key, item, deliver, loop=None):
+        """Call deliver(item) now (returning what it returns), at the end
+        of the coalesce window if item is still the newest then, or never."""
+        if self._sample:
+            self._seen[key] += 1
+            if (self._seen[key] - 1) % self._sample:
+                self.counters['sampled_out'] += 1
+                return None
+        if self._rate:
+            bucket = self._buckets.get(key, None)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self._rate, self._burst, clock=self._clock)
+            if not bucket.take():
+                self.counters['rate_limited'] += 1
+                return None
+        if self._coalesce and loop:
+            if key in self._latest:
+                self.counters['coalesced'] += 1
+            else:
+                loop.call_later(self._coalesce, self._flush, key, deliver)
+            self._latest[key] = item
+            return None
+        self.counters['delivered'] += 1
+        return deliver(item)
+
+    def _flush(self, key, deliver):
+        item = self._latest.pop(key, None)
+        if item is not None:
+            self.counters['delivered'] += 1
+            deliver(item)
+
+    def stats(self):
+        return {counter: self.counters[counter]
+                for counter in ('delivered', 'sampled_out', 'rate_limited', 'coalesced')}
@@ -0,0 +1,222 @@
+# coding=utf-8
+import asyncio
+import json
+from collections import deque
+from collections.abc import Mapping
+from functools import partial
+
+from zentropi.caches import TTLCache
+from zentropi.defaults import (
+    REQUEST_CACHE_SIZE,
+    REQUEST_CANCELLED_SIZE
+)
+from zentropi.frames import (
+    Command,
+    Request,
+    Response,
+    frame_meta
+)
+from zentropi.handlers import Registry
+from zentropi.utils import BoundedSet
+
+
+def request_key(name, data=None, *, target=None, space=None):
+    """
+    Identical requests have identical keys, whatever the order of their data.
+
+    Example:
+        >>> from zentropi.requests import request_key
+        >>> request_key('get', {'a': 1, 'b': 2}) == request_key('get', {'b': 2, 'a': 1})
+        True
+    """
+    data = json.dumps(dict(data) if data else {}, sort_keys=True, separators=(',', ':'))
+    return name, target, space, data
+
+
+def cancel_command(request, source=None):
+    """Tells responders that request needs no more responses."""
+    return Command('cancel', data={'request': request.id}, space=request.space, source=source)
+
+
+class Gather(object):
+    """
+    Collects the responses to one request until k of them have arrived
+    or timeout seconds have passed, whichever comes first.
+
+        async for response in agent.gather('ping', k=3, timeout=1):
+            ...
+
+        responses = await agent.gather('ping', timeout=1)
+
+    on_done(gather) is called once, when no more responses are accepted.
+    """
+    def __init__(self, request, *, k=None, timeout, loop, on_done=None):
+        if k is not None and (not isinstance(k, int) or k < 1):
+            raise ValueError('Expected k to be a positive integer. '
+                             'Got: {!r}'.format(k))
+        self._request = request
+        self._k = k
+        self._loop = loop
+        self._deadline = loop.time() + timeout
+        self._on_done = on_done
+        self._responses = deque()  # type: deque
+        self._received = 0
+        self._waiter = None
+        self._done = False
+        self._timer = loop.call_later(timeout, self.finish)  # even if nobody is iterating.
+
+    @property
+    def request(self):
+        return self._request
+
+    @property
+    def done(self):
+        return self._done
+
+    def put(self, response):
+        if self._done:
+            return
+        self._received += 1
+        self._responses.append(response)
+        self._wake()
+        if self._k and self._received >= self._k:
+            self.finish()
+
+    def finish(self):
+        if self._done:
+            return
+        self._done = True
+        self._timer.cancel()
+        self._wake()
+        if self._on_done:
+            self._on_done(self)
+
+    def _wake(self):
+        if self._waiter and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._responses:
+            remaining = self._deadline - self._loop.time()
+            if remaining <= 0:
+                self.finish()
+            if self._done:
+                raise StopAsyncIteration
+            self._waiter = self._loop.create_future()
+            try:
+                await asyncio.wait_for(self._waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+        return self._responses.popleft()
+
+    async def collect(self):
+        responses = []
+        async for response in self:
+            responses.append(response)
+        return responses
+
+    def __await__(self):
+        return self.collect().__await__()
+
+
+class Requests(Registry):
+    """
+    class Agent:
+        self.requests = Requests(callback=self._trigger_frame_handler)
+
+
+    response = await agent.request('kvstore-get', data={'key': 'a'}, timeout=1)
+
+    @agent.on_request('kvstore-get')
+    def handle_get(request):
+        return {'value': ...}  # sent back as a Response to the requester.
+
+    Requests waiting for a response are kept as request id -> future
+    (or Gather) until they are answered, time out or are given up.
+    Cancelled request ids are remembered so that they are not answered.
+    """
+    def __init__(self, callback=None):
+        super().__init__(callback=callback)
+        self._pending = {}  # type: dict
+        self._cancelled = BoundedSet(maxlen=REQUEST_CANCELLED_SIZE)
+        self._shared = {}  # type: dict
+        self._results = TTLCache(maxsize=REQUEST_CACHE_SIZE)
+
+    @property
+    def pending(self):
+        return list(self._pending)
+
+    def request(self, name, data=None, space=None, internal=False, source=None, target=None, ttl=None):
+        return Request(name=name, data=data, space=space, source=source, target=target, internal=internal,
+                       meta=frame_meta(ttl=ttl))
+
+    def dispatch(self, request):
+        """Call local handlers for a request that is not targeted elsewhere."""
+        if request.target and request.target != request.source:
+            return
+        frame, handlers = self._registry.match(frame=request)
+        for handler in handlers:
+            self._trigger_frame_handler(frame=frame, handler=handler, internal=request.internal)
+
+    @staticmethod
+    def response(request, value, source=None):
+        data = dict(value) if isinstance(value, Mapping) else {'value': value}
+        return Response(name=request.name, data=data, space=request.space, source=source,
+                        target=request.source, reply_to=request.id, meta=frame_meta(deadline=request.deadline))
+
+    def expect(self, request_id, waiter):
+        if request_id in self._pending:
+            raise ValueError('Expected a new request id, already waiting for: {!r}'
+                             ''.format(request_id))
+        self._pending[request_id] = waiter
+
+    def resolve(self, response):
+        """Hand response to whoever waits on response.reply_to,
+        returns False for responses nobody is waiting for."""
+        waiter = self._pending.get(response.reply_to, None)
+        if waiter is None:
+            return False
+        if isinstance(waiter, Gather):
+            waiter.put(response)
+            return True
+        del self._pending[response.reply_to]
+        if not waiter.done():
+            waiter.set_result(response)
+        return True
+
+    def forget(self, request_id):
+        waiter = self._pending.pop(request_id, None)
+        if isinstance(waiter, Gather):
+            waiter.finish()
+        elif waiter is not None and not waiter.done():
+            waiter.cancel()
+
+    def cancel(self, request_id):
+        self._cancelled.add(request_id)
+
+    def cancelled(self, request_id):
+        return request_id in self._cancelled
+
+    def shared(self, key):
+        """The in-flight request task for key, if any."""
+        return self._shared.get(key, None)
+
+    def share(self, key, task, cache_ttl=None):
+        """Let identical requests wait on task while it is in flight,
+        and reuse its response for cache_ttl seconds once it is done."""
+        self._shared[key] = task
+        task.add_done_callback(partial(self._shared_done, key, cache_ttl))
+
+    def _shared_done(self, key, cache_ttl, task):
+        if self._shared.get(key, None) is task:
+            del self._shared[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        if cache_ttl:
+            self._results.set(key, task.result(), ttl=cache_ttl)
+
+    def cached(self, key):
+        return self._results.get(key, None)
@@ -0,0 +1,130 @@
+# coding=utf-8
+from collections import Counter
+
+from zentropi.defaults import (
+    REORDER_BUFFER_SIZE,
+    REORDER_WAIT
+)
+from zentropi.spaces import space_matches
+
+
+class _Stream(object):
+    """Frames of one (source, space, priority) waiting for earlier ones."""
+    __slots__ = ('epoch', 'expected', 'held', 'since')
+
+    def __init__(self, epoch, expected):
+        self.epoch = epoch
+        self.expected = expected
+        self.held = {}  # type: dict  # {seq: frame}
+        self.since = None  # when the oldest hole was noticed
+
+
+class Sequencer(object):
+    """
+    Puts frames from each source back in the order it sent them.
+
+    Connections number the frames an agent sends to a space, per priority
+    class since higher priorities are meant to overtake lower ones. For
+    the spaces an agent joined with ordered=True, a frame that arrives
+    ahead of an earlier one is held for up to wait seconds (and at most
+    size frames per source); if the earlier one has not come by then it
+    is reported as a gap and the held frames are handed on. Frames that
+    arrive after their turn, or twice, are dropped.
+
+    Example:
+        >>> from zentropi.frames import Event
+        >>> from zentropi.sequences import Sequencer
+        >>> sequencer = Sequencer(wait=1)
+        >>> sequencer.join('sensors')
+        >>> def reading(seq):
+        ...     return Event('reading', source='probe', space='sensors', meta={'seq': seq, 'epoch': 'a'})
+        >>> sequencer.push(reading(1), now=0)[0][0].seq
+        1
+        >>> sequencer.push(reading(3), now=0)
+        ([], [])
+        >>> [frame.seq for frame in sequencer.push(reading(2), now=0.5)[0]]
+        [2, 3]
+    """
+    def __init__(self, wait=REORDER_WAIT, size=REORDER_BUFFER_SIZE):
+        if isinstance(wait, bool) or not isinstance(wait, (int, float)) or wait <= 0:
+            raise ValueError('Expected wait to be seconds > 0. '
+                             'Got: {!r}'.format(wait))
+        if isinstance(size, bool) or not isinstance(size, int) or size < 1:
+            raise ValueError('Expected size to be a positive integer. '
+                             'Got: {!r}'.format(size))
+        self._wait = wait
+        self._size = size
+        self._spaces = set()  # type: set  # joined with ordered=True
+        self._streams = {}  # type: dict  # {(source, space, priority): _Stream}
+        self.counters = Counter()  # type: Counter
+
+    @property
+    def wait(self):
+        return self._wait
+
+    def join(self, space):
+        self._spaces.add(space)
+
+    def leave(self, space):
+        self._spaces.discard(space)
+
+    def ordered(self, frame):
+        """True if frame is numbered and came through an ordered space."""
+        if frame.seq is None or not frame.space or frame.target:
+            return False
+        return any(space_matches(space, frame.space) for space in self._spaces)
+
+    def push(self, frame, now):
+        """Frames now ready to be handled, in order, and the gaps found
+        on the way as (source, space, priority, first missing seq, count)."""
+        key = (frame.source, frame.space, frame.priority)
+        seq, epoch = frame.seq, frame.meta.get('epoch', None)
+        stream = self._streams.get(key, None)
+        if stream is None or stream.epoch != epoch:  # first frame seen, or the source restarted.
+            stream = self._streams[key] = _Stream(epoch, seq)
+        if seq < stream.expected or seq in stream.held:
+            self.counters['frames_late'] += 1
+            return [], []
+        if seq > stream.expected:
+            stream.held[seq] = frame
+            self.counters['frames_held'] += 1
+            if stream.since is None:
+                stream.since = now
+            if len(stream.held) > self._size:
+                return self._skip(key, stream, now)
+            return [], []
+        stream.expected += 1
+        return [frame] + self._drain(stream, now), []
+
+    def release(self, now):
+        """Stop waiting for frames that are overdue; like push()."""
+        ready = []  # type: list
+        gaps = []  # type: list
+        for key, stream in self._streams.items():
+            if stream.since is not None and stream.since + self._wait <= now:
+                ready_, gaps_ = self._skip(key, stream, now)
+                ready.extend(ready_)
+                gaps.extend(gaps_)
+        return ready, gaps
+
+    def next_release(self):
+        """When release() next has something to do, or None."""
+        waiting = [stream.since for stream in self._streams.values() if stream.since is not None]
+        return min(waiting) + self._wait if waiting else None
+
+    def _skip(self, key, stream, now):
+        first = min(stream.held)
+        gap = key + (stream.expected, first - stream.expected)
+        self.counters['sequence_gaps'] += 1
+        self.counters['frames_missing'] += first - stream.expected
+        stream.expected = first
+        return self._drain(stream, now), [gap]
+
+    @staticmethod
+    def _drain(stream, now):
+        ready = []
+        while stream.expected in stream.held:
+            ready.append(stream.held.pop(stream.expected))
+            stream.expected += 1
+        stream.since = now if stream.held else None  # wait afresh for the next hole.
+        return ready
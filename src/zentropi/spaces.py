@@ -1,41 +1,252 @@
 # coding=utf-8
+from collections import (
+    Counter,
+    OrderedDict,
+    defaultdict
+)
+
 from zentropi.connections.connection import \
     Connection
-from zentropi.frames import Command
+from zentropi.defaults import (
+    GROUP_STRATEGY,
+    REQUEST_CANCELLED_SIZE,
+    RETAINED_FRAMES_PER_SPACE
+)
+from zentropi.frames import Command, Response
+from zentropi.partitions import HashRing
+from zentropi.predicates import PredicateIndex
+from zentropi.utils import (
+    BoundedSet,
+    resolve_field
+)
+
+
+GROUP_STRATEGIES = ('round-robin', 'least-loaded')
+WILDCARDS = ('*', '#')
+
+
+def split_space(name):
+    """
+    Words of a dotted space name, where a whole word may be a wildcard:
+    '*' matches exactly one word and '#' zero or more.
+
+    Example:
+        >>> from zentropi.spaces import split_space
+        >>> split_space('sensors.#')
+        ['sensors', '#']
+    """
+    words = name.split('.')
+    for word in words:
+        if not word or (word not in WILDCARDS and ('*' in word or '#' in word)):
+            raise ValueError('Expected a dotted space name with * or # as whole words, '
+                             'like \'home.*\' or \'sensors.#\'. Got: {!r}'.format(name))
+    return words
+
+
+def is_pattern(name):
+    return any(word in WILDCARDS for word in name.split('.'))
+
+
+class _Node(object):
+    __slots__ = ('children', 'values')
+
+    def __init__(self):
+        self.children = {}  # type: dict  # {word: _Node}
+        self.values = set()  # type: set
+
+
+class SubscriptionTrie(object):
+    """
+    Subscriptions to dotted space names, some with wildcards, kept as a
+    trie of words so that everything subscribed to a space name is found
+    in one walk instead of by testing every subscription.
+
+    Example:
+        >>> from zentropi.spaces import SubscriptionTrie
+        >>> trie = SubscriptionTrie()
+        >>> for pattern in ('home.*', 'home.kitchen', 'sensors.#', 'home.garage'):
+        ...     trie.add(pattern, pattern)
+        >>> sorted(trie.match('home.kitchen'))
+        ['home.*', 'home.kitchen']
+    """
+    def __init__(self):
+        self._root = _Node()
+
+    def add(self, pattern, value):
+        node = self._root
+        for word in split_space(pattern):
+            node = node.children.setdefault(word, _Node())
+        node.values.add(value)
+
+    def remove(self, pattern, value):
+        node = self._root
+        for word in split_space(pattern):
+            node = node.children.get(word, None)
+            if node is None:
+                return
+        node.values.discard(value)
+
+    def match(self, name):
+        found = set()  # type: set
+        self._walk(self._root, name.split('.'), 0, found)
+        return found
+
+    def _walk(self, node, words, index, found):
+        any_words = node.children.get('#', None)
+        if any_words is not None:
+            for next_index in range(index, len(words) + 1):
+                self._walk(any_words, words, next_index, found)
+        if index == len(words):
+            found.update(node.values)
+            return
+        for key in {words[index], '*'}:
+            child = node.children.get(key, None)
+            if child is not None:
+                self._walk(child, words, index + 1, found)
+
+
+def space_matches(pattern, name):
+    """True if name is pattern or one of the space names it stands for."""
+    trie = SubscriptionTrie()
+    trie.add(pattern, pattern)
+    return bool(trie.match(name))
 
 
 class Space(object):
     def __init__(self, name):
         self._name = name
         self._agents = set()
+        self._groups = {}  # {group_name: [agent_name, ]}
+        self._turns = Counter()  # type: Counter
+        self._partitions = {}  # {group_name: (partition_by, HashRing)}
 
     @property
     def agents(self):
         return self._agents
 
+    @property
+    def groups(self):
+        return {group: list(members) for group, members in self._groups.items()}
+
     @property
     def name(self):
         return self._name
 
-    def join(self, agent_name):
+    def join(self, agent_name, group=None, partition_by=None):
         if agent_name in self._agents:  # todo: is exception needed/useful/harmful?
             raise ValueError('Agent {!r} failed to join space {!r} because'
                              'another agent by same name had already joined.'
                              ''.format(agent_name, self._name))
+        if partition_by and not group:
+            raise ValueError('Expected a group to partition by {!r}.'.format(partition_by))
+        if group in self._groups and partition_by and partition_by != self.partition_by(group):
+            raise ValueError('Expected agent {!r} to partition group {!r} by {!r} like its '
+                             'other members. Got: {!r}'.format(agent_name, group,
+                                                                self.partition_by(group), partition_by))
+        if partition_by and group not in self._groups:
+            self._partitions[group] = (partition_by, HashRing())
         self._agents.add(agent_name)
+        if group:
+            self._groups.setdefault(group, []).append(agent_name)
+            if group in self._partitions:
+                self._partitions[group][1].add(agent_name)
 
     def leave(self, agent_name):
         if agent_name not in self._agents:
             raise ValueError('Agent: {} not found in space: {}'
                              ''.format(agent_name, self._name))
         self._agents.remove(agent_name)
+        group = self.group_of(agent_name)
+        if group is None:
+            return
+        members = self._groups[group]
+        members.remove(agent_name)
+        if group in self._partitions:
+            self._partitions[group][1].remove(agent_name)
+        if not members:
+            del self._groups[group]
+            del self._turns[group]
+            self._partitions.pop(group, None)
+
+    def group_of(self, agent_name):
+        for group, members in self._groups.items():
+            if agent_name in members:
+                return group
+        return None
+
+    def partition_by(self, group):
+        return self._partitions[group][0] if group in self._partitions else None
+
+    def owner(self, group, key):
+        """The member of a partitioned group that every frame with key goes to."""
+        return self._partitions[group][1].node(key)
+
+    def ungrouped(self):
+        grouped = {agent for members in self._groups.values() for agent in members}
+        return [agent for agent in self._agents if agent not in grouped]
+
+    def turn(self, group):
+        """Round-robin position of group, moves on with every call."""
+        turn = self._turns[group]
+        self._turns[group] += 1
+        return turn
 
 
 class Spaces(object):
-    def __init__(self):
+    """
+    The in-memory broker. Every agent in a space receives each frame,
+    except agents that joined with a group: each frame goes to only one
+    member of a group, picked round-robin or, with
+    group_strategy='least-loaded', the member with the fewest handler
+    tasks running.
+
+    A group joined with partition_by='data.device_id' instead sends all
+    frames with the same device_id to the same member, using a HashRing
+    so that members joining or leaving move as few keys as possible.
+    Members are sent a 'group-rebalance' command with the new member list
+    whenever it changes (agents emit it as a '*** group-rebalance' event),
+    so that they can hand off state for keys they no longer own.
+
+    Space names are dotted ('home.kitchen') and an agent can join many
+    of them at once with wildcards: 'home.*' or 'sensors.#'.
+
+    The last frame of each name sent with retain (emit(..., retain=True))
+    is kept per space, up to retain_size names per space with the least
+    recently updated dropped first, and replayed to agents joining the
+    space as a single 'replay' command.
+
+    Agents whose handlers for a name declare fields= get a copy of the
+    frame with only those data keys, one copy per distinct set of keys.
+
+    Groups joined with credits=N are flow controlled: producers take a
+    credit from every such group in a space before emit_async() sends to
+    it, members grant them back as they handle those frames, and
+    producers that found a group out of credits are sent a 'credit'
+    command when it has some again.
+
+    Agents that join a space with ordered=True get every frame sent to
+    it, whether their handlers could match it or not, so that they see
+    no holes in each source's sequence numbers other than lost frames.
+    """
+    def __init__(self, group_strategy=GROUP_STRATEGY, retain_size=RETAINED_FRAMES_PER_SPACE):
         super().__init__()
+        if not isinstance(retain_size, int) or retain_size < 0:
+            raise ValueError('Expected retain_size to be an integer >= 0. '
+                             'Got: {!r}'.format(retain_size))
+        self.group_strategy = group_strategy
+        self._retain_size = retain_size
+        self._retained = {}  # {space_name: OrderedDict(frame_name: frame)}
         self._spaces = {}  # {space_name: space_instance}
+        self._trie = SubscriptionTrie()  # space names and patterns
         self._agents = {}  # todo: weak reference
+        self._cancelled = BoundedSet(maxlen=REQUEST_CANCELLED_SIZE)  # request ids
+        self._interests = {}  # {agent_name: Interests}
+        self._predicates = PredicateIndex()  # where= predicates of all agents
+        self._matched = (None, set())  # (frame, agents whose predicates it satisfies)
+        self._credits = {}  # {(space_name, group): credits left}
+        self._stalled = defaultdict(set)  # {space_name: agents that found it out of credits}
+        self._ordered = set()  # {(agent_name, space_name)} joined with ordered=True
+        self.counters = Counter()  # type: Counter
 
     def agents(self, space=None):
         if not space:
@@ -50,18 +261,121 @@ class Spaces(object):
             return list(self._spaces)
         return [n for n, s in self._spaces.items() if agent in s.agents]
 
-    def join(self, agent_name, space_name):
+    @property
+    def group_strategy(self):
+        return self._group_strategy
+
+    @group_strategy.setter
+    def group_strategy(self, strategy):
+        if strategy not in GROUP_STRATEGIES:
+            raise ValueError('Expected group_strategy to be one of {!r}. '
+                             'Got: {!r}'.format(GROUP_STRATEGIES, strategy))
+        self._group_strategy = strategy
+
+    def join(self, agent_name, space_name, group=None, partition_by=None, credits=None, ordered=False):
         spaces = self._spaces
         if space_name not in spaces:
             space = Space(name=space_name)
         else:
             space = spaces[space_name]
+        data = {'space': str(space.name)}
+        if group:
+            data['group'] = str(group)
+        if partition_by:
+            data['partition_by'] = str(partition_by)
+        if credits:
+            data['credits'] = int(credits)
+        if ordered:
+            data['ordered'] = True
         try:
-            space.join(agent_name)
+            split_space(space_name)
+            space.join(agent_name, group=group, partition_by=partition_by)
+            if space_name not in spaces:
+                self._trie.add(space_name, space_name)
             self._spaces[space_name] = space
-            return Command('join', data={'space': str(space.name)})
         except ValueError:
-            return Command('join-failed', data={'space': str(space.name)})
+            return Command('join-failed', data=data)
+        if ordered:
+            self._ordered.add((agent_name, space_name))
+        if group and credits:
+            self.grant(space_name, group, credits, new=True)
+        if group:
+            self._rebalance(space, group, joined=agent_name)
+        self._replay(agent_name, space_name)
+        return Command('join', data=data)
+
+    def leave(self, agent_name, space_name):
+        if space_name not in self._spaces:
+            raise ValueError('Space: {} not found in spaces.'
+                             ''.format(space_name))
+        space = self._spaces[space_name]
+        group = space.group_of(agent_name)
+        space.leave(agent_name)
+        self._ordered.discard((agent_name, space_name))
+        if group and group not in space.groups:
+            self._credits.pop((space_name, group), None)
+        if group:
+            self._rebalance(space, group, left=agent_name)
+        return Command('leave', data={'space': str(space_name)})
+
+    def _rebalance(self, space, group, joined=None, left=None):
+        members = space.groups.get(group, [])
+        command = Command('group-rebalance', space=space.name, data={
+            'space': space.name,
+            'group': group,
+            'members': sorted(members),
+            'partition_by': space.partition_by(group),
+            'joined': joined,
+            'left': left,
+        })
+        for agent in members + ([left] if left else []):
+            connection = self._agents.get(agent, None)
+            if connection:
+                connection.send(frame=command, internal=True)
+
+    def _retain(self, space_name, frame):
+        retained = self._retained.setdefault(space_name, OrderedDict())
+        retained.pop(frame.name, None)
+        retained[frame.name] = frame
+        while len(retained) > self._retain_size:
+            retained.popitem(last=False)
+            self.counters['retained_evicted'] += 1
+
+    def retained(self, space_name):
+        """Frames retained in space_name, or in the spaces a pattern matches."""
+        return [frame for name, retained in self._retained.items() if space_matches(space_name, name)
+                for frame in retained.values()]
+
+    def _replay(self, agent_name, space_name):
+        connection = self._agents.get(agent_name, None)
+        frames = [self._project(agent_name, frame, {}).as_dict()
+                  for frame in self.retained(space_name) if self._accepts(agent_name, frame)]
+        if connection and frames:
+            connection.send(frame=Command('replay', data={'frames': frames}, space=space_name), internal=True)
+
+    def acquire(self, agent_name, space_name):
+        """Take a credit from each flow controlled group in space_name,
+        or none if one of them is out of credits."""
+        space = self._spaces.get(space_name, None)
+        keys = [(space_name, group) for group in (space.groups if space else ())
+                if (space_name, group) in self._credits]
+        if any(self._credits[key] < 1 for key in keys):
+            self._stalled[space_name].add(agent_name)
+            self.counters['credits_exhausted'] += 1
+            return False
+        for key in keys:
+            self._credits[key] -= 1
+        return True
+
+    def grant(self, space_name, group, credits, new=False):
+        key = (space_name, group)
+        if key not in self._credits and not new:
+            return  # the group is gone or not flow controlled.
+        self._credits[key] = self._credits.get(key, 0) + credits
+        for agent in self._stalled.pop(space_name, ()):
+            connection = self._agents.get(agent, None)
+            if connection:
+                connection.send(frame=Command('credit', data={'space': space_name}), internal=True)
 
     def agent_connect(self, agent_name, connection):
         agents = self._agents
@@ -77,26 +391,141 @@ class Spaces(object):
     def broadcast(self, frame):
         if isinstance(frame, Command):
             return self.handle_command(frame)
+        if isinstance(frame, Response) and frame.reply_to in self._cancelled:
+            return  # requester is no longer listening.
+        picked = set()  # type: set  # {(space, group) that got the frame}
+        try:
+            self._broadcast(frame, picked)
+        finally:
+            self._refund(frame, picked)
+
+    def _broadcast(self, frame, picked):
+        if frame.expired:
+            self.counters['frames_expired'] += 1
+            return
+        if frame.target:  # direct route, whatever the size of the space.
+            connection = self._agents.get(frame.target, None)
+            if connection:
+                connection.send(frame=frame, internal=True)
+            return
+        projections = {}  # type: dict
+        for name, spaces in self._routes(frame):
+            if frame.retain and self._retain_size:
+                self._retain(name, frame)
+            delivered = set()  # agents in both home.* and home.kitchen get a frame once.
+            for space in spaces:
+                for agent in space.ungrouped():
+                    if agent in delivered:
+                        continue
+                    delivered.add(agent)
+                    if (agent, space.name) not in self._ordered and not self._accepts(agent, frame):
+                        self.counters['frames_skipped'] += 1
+                        continue
+                    self._agents[agent].send(frame=self._project(agent, frame, projections), internal=True)
+                for group, members in space.groups.items():
+                    agent = self._pick(space, group, members, frame)
+                    if agent and agent not in delivered:
+                        delivered.add(agent)
+                        picked.add((space.name, group))
+                        self._agents[agent].send(frame=self._project(agent, frame, projections), internal=True)
+
+    def _refund(self, frame, picked):
+        """Give back the credit acquire() took for frame to the flow
+        controlled groups that did not get it, as none of their members
+        will grant it back."""
+        if not frame.meta.get('credit', False):
+            return
+        space = self._spaces.get(frame.space, None)
+        for group in (space.groups if space else ()):
+            if (frame.space, group) in self._credits and (frame.space, group) not in picked:
+                self.counters['credits_refunded'] += 1
+                self.grant(frame.space, group, 1)
+
+    def _accepts(self, agent_name, frame):
+        interests = self._interests.get(agent_name, None)
+        if interests is None or interests.matches(frame):
+            return True
+        return agent_name in self._predicate_matches(frame)
+
+    def _project(self, agent_name, frame, projections):
+        """frame with only the data keys agent_name's handlers read; agents
+        reading the same keys share one copy from projections."""
+        interests = self._interests.get(agent_name, None)
+        fields = interests.fields_for(frame) if interests else None
+        if fields is None:
+            return frame
+        if fields not in projections:
+            projections[fields] = frame.project(fields)
+            self.counters['frames_projected'] += 1
+        return projections[fields]
+
+    def _predicate_matches(self, frame):
+        """Agents with a predicate that frame satisfies, looked up once per frame."""
+        if self._matched[0] is not frame:
+            self._matched = (frame, self._predicates.match(frame))
+        return self._matched[1]
+
+    def _pick(self, space, group, members, frame):
+        """One member of group to deliver to, or None; rotating the members
+        first makes least-loaded share out ties round-robin."""
+        partition_by = space.partition_by(group)
+        key = resolve_field(frame, partition_by) if partition_by else None
+        if key is not None:
+            agent = space.owner(group, key)
+            return agent if self._accepts(agent, frame) else None
+        members = [m for m in members if self._accepts(m, frame)]
+        if not members:
+            return None
+        turn = space.turn(group) % len(members)
+        members = members[turn:] + members[:turn]
+        if self._group_strategy == 'least-loaded':
+            return min(members, key=lambda m: self._agents[m].load())
+        return members[0]
+
+    def update_interests(self, agent_name, interests):
+        """Agents with interests only receive frames their handlers could match."""
+        self._interests[agent_name] = interests
+        self._predicates.remove_key(agent_name)
+        for name, predicates in interests.predicates.items():
+            for predicate in predicates:
+                self._predicates.add(name, predicate, key=agent_name)
+        self._matched = (None, set())
+
+    def _routes(self, frame):
+        """The spaces subscribed to frame.space if its source joined it
+        (or a pattern matching it), otherwise to each space the source
+        joined; (space name, [spaces]) per destination."""
         space = frame.space
         source = frame.source
-        if space and space in self.spaces(source):
-            spaces_ = [self._spaces[space]]
+        if space and any(source in self._spaces[s].agents for s in self._trie.match(space)):
+            names = [space]
         else:
-            spaces_ = [self._spaces[s] for s in self.spaces(source)]
-        spaces = [self._spaces[s.name] for s in spaces_]
-        for space in spaces:
-            for connection in [self._agents[a] for a in space.agents]:
-                connection.send(frame=frame, internal=True)
+            names = self.spaces(source)
+        return [(name, [self._spaces[s] for s in self._trie.match(name)]) for name in names]
 
     def handle_command(self, command):
         if not isinstance(command, Command):
             raise ValueError('Expected command to be instance of Command, got: {}'
                              ''.format(command))
         connection = self._agents[command.source]
-        # todo: handle leaves
         if command.name == 'join':
-            frame = self.join(command.source, command.data.space)
+            frame = self.join(command.source, command.data.space, group=command.data.get('group', None),
+                              partition_by=command.data.get('partition_by', None),
+                              credits=command.data.get('credits', None),
+                              ordered=command.data.get('ordered', False))
+            connection.broadcast(frame)
+        elif command.name == 'leave':
+            frame = self.leave(command.source, command.data.space)
             connection.broadcast(frame)
+        elif command.name == 'ack':
+            target = self._agents.get(command.target, None)
+            if target:
+                target.send(frame=command, internal=True)
+        elif command.name == 'cancel':
+            self._cancelled.add(command.data.request)
+            agents = {agent for _, spaces in self._routes(command) for space in spaces for agent in space.agents}
+            for agent in agents - {command.source}:
+                self._agents[agent].send(frame=command, internal=True)
 
     def agent_close(self, agent_name):
         # connection = self._agents[agent_name]
@@ -5,15 +5,34 @@ from zentropi.fields import Field
 from zentropi.frames import State
 from zentropi.handlers import HandlerRegistry
 
+STATES_UPDATED = '*** states-updated'
+
 
 class States(UserDict):
-    def __init__(self, callback=None):
+    """
+    Fields of an agent, set as attributes or items; state handlers
+    are called with a State frame for each change and can veto it
+    by returning False. Setting a state to its current value does nothing.
+
+        agent.states.temperature = 21
+        agent.states.batch_update({'temperature': 22, 'humidity': 40})
+
+    With an event loop, states can be debounced (set once updates stop
+    for a while) or throttled (set at most once in a while, to the latest value).
+    """
+    def __init__(self, callback=None, loop=None):
         super().__init__()
         if callback and not callable(callback):
             raise ValueError('Expected a callable for callback, got: {}'
                              ''.format(callback))
         self._trigger_frame_handler = callback
         self._handlers = HandlerRegistry()
+        self._loop = loop
+        self._debounce = {}  # type: dict  # {name: seconds}
+        self._throttle = {}  # type: dict  # {name: seconds}
+        self._pending = {}  # type: dict  # {name: latest value not set yet}
+        self._timers = {}  # type: dict  # {name: TimerHandle}
+        self._throttled_until = {}  # type: dict  # {name: loop time}
 
     def _add_state(self, name, value_or_state):
         if isinstance(value_or_state, Field):
@@ -30,14 +49,49 @@ class States(UserDict):
                              ''.format(state))
         return state.value
 
-    def _update_state(self, name, value):
-        should_update = [True]
+    def _field(self, name):
         state = self.data[name]
         if not isinstance(state, Field):
             raise ValueError('Expected instance of Field, got: {}'
                              ''.format(state))
+        return state
+
+    def _update_state(self, name, value):
+        self._field(name)
+        if self._loop is None or (name not in self._debounce and name not in self._throttle):
+            return self._set_state(name, value)
+        if name in self._debounce:
+            self._cancel_timer(name)
+            self._pending[name] = value
+            self._timers[name] = self._loop.call_later(self._debounce[name], self._flush, name)
+            return
+        now = self._loop.time()
+        until = self._throttled_until.get(name, now)
+        if now >= until and name not in self._pending:
+            self._throttled_until[name] = now + self._throttle[name]
+            return self._set_state(name, value)
+        self._pending[name] = value
+        if name not in self._timers:
+            self._timers[name] = self._loop.call_later(until - now, self._flush, name)
+
+    def _flush(self, name):
+        self._timers.pop(name, None)
+        if name not in self._pending or name not in self.data:
+            self._pending.pop(name, None)
+            return
+        if name in self._throttle:
+            self._throttled_until[name] = self._loop.time() + self._throttle[name]
+        self._set_state(name, self._pending.pop(name))
+
+    def _cancel_timer(self, name):
+        timer = self._timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _should_update(self, frame):
+        """Call state handlers for frame, False if any of them vetoes it."""
+        should_update = [True]  # Default is True if not callback set.
         if self._trigger_frame_handler:
-            frame = State(name, data={'value': value, 'last': state.value})
             frame, handlers = self._handlers.match(frame)
             for handler in handlers:
                 _should_update = self._trigger_frame_handler(
@@ -47,12 +101,83 @@ class States(UserDict):
                                      'from state callback, got: {}'
                                      ''.format(_should_update))
                 should_update.append(_should_update)
-        if all(should_update):  # Default is True if not callback set.
+        return all(should_update)
+
+    def _set_state(self, name, value):
+        state = self._field(name)
+        value = state.clean_and_validate(value)
+        if value == state.value:
+            return
+        if self._should_update(State(name, data={'value': value, 'last': state.value})):
             state.value = value
             self.data[name] = state
 
+    def batch_update(self, values):
+        """
+        Set several states at once. Every value is validated before any
+        is set, unchanged ones are skipped and new names are added.
+        State handlers are called for each change until one returns
+        False, in which case none of the states are set. Once they are
+        set, handlers of the '*** states-updated' state are called once
+        with the names of the changed states.
+        Returns {name: value} of the states that were set.
+        """
+        added = {name: value for name, value in values.items() if name not in self.data}
+        changes, last = {}, {}
+        for name, value in values.items():
+            if name in added:
+                continue
+            state = self._field(name)
+            value = state.clean_and_validate(value)
+            if value != state.value:
+                changes[name], last[name] = value, state.value
+        if not all(self._should_update(State(name, data={'value': value, 'last': last[name]}))
+                   for name, value in changes.items()):
+            return {}
+        for name, value in changes.items():
+            self._cancel_timer(name)  # a debounced or throttled value would be older.
+            self._pending.pop(name, None)
+            self.data[name].value = value
+        for name, value in added.items():
+            self._add_state(name, value)
+        if changes and self._trigger_frame_handler:
+            frame, handlers = self._handlers.match(State(STATES_UPDATED, data={'names': sorted(changes)}))
+            for handler in handlers:
+                self._trigger_frame_handler(frame=frame, handler=handler, internal=True)
+        return dict(changes, **added)
+
+    def debounce(self, name, seconds=None):
+        """Set state name only once it has not been updated for seconds,
+        to its latest value; debounce(name) sets it right away again."""
+        self._pace(self._debounce, name, seconds)
+
+    def throttle(self, name, seconds=None):
+        """Set state name at most once every seconds, to its latest
+        value; throttle(name) sets it right away again."""
+        self._pace(self._throttle, name, seconds)
+
+    def _pace(self, paces, name, seconds):
+        if seconds is not None and (isinstance(seconds, bool) or not isinstance(seconds, (int, float))
+                                    or seconds <= 0):
+            raise ValueError('Expected seconds > 0 for state: {!r}. '
+                             'Got: {!r}'.format(name, seconds))
+        self._debounce.pop(name, None)
+        self._throttle.pop(name, None)
+        self._throttled_until.pop(name, None)
+        if seconds:
+            paces[name] = seconds
+        if name in self._pending:
+            self._cancel_timer(name)
+            self._set_state(name, self._pending.pop(name))
+
+    def set_loop(self, loop):
+        """The event loop debounced and throttled states are set on."""
+        self._loop = loop
+
     def _remove_state(self, name):
         del self.data[name]
+        self._cancel_timer(name)
+        self._pending.pop(name, None)
 
     def __getattribute__(self, item):
         if item in ['data', 'callback'] or item.startswith('_'):
@@ -0,0 +1,255 @@
+# coding=utf-8
+import asyncio
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+
+from zentropi.defaults import (
+    SUPERVISOR_POLL_INTERVAL,
+    SUPERVISOR_REPORT_INTERVAL,
+    SUPERVISOR_STOP_TIMEOUT
+)
+from zentropi.utils import (
+    logger,
+    validate_endpoint,
+    validate_space
+)
+
+
+def partition(items, count):
+    """
+    Deal items round-robin into at most count non-empty lists.
+
+    Example:
+        >>> from zentropi.supervisor import partition
+        >>> partition(['a', 'b', 'c'], 2)
+        [['a', 'c'], ['b']]
+    """
+    return [p for p in [items[i::count] for i in range(count)] if p]
+
+
+def pin_to_core(index):
+    """Pin the current process to one of the cores available to it,
+    returns the core or None where the platform does not support it."""
+    if not hasattr(os, 'sched_setaffinity'):  # pragma: no cover
+        return None
+    cores = sorted(os.sched_getaffinity(0))
+    core = cores[index % len(cores)]
+    os.sched_setaffinity(0, {core})
+    return core
+
+
+def build_agents(agents):
+    """Agents may be given as instances, or as classes or factories
+    that are called inside the worker process."""
+    from zentropi import Agent
+
+    built = []
+    for agent in agents:
+        if not isinstance(agent, Agent) and callable(agent):
+            agent = agent()
+        if not isinstance(agent, Agent):
+            raise ValueError('Expected an instance of Agent. Got: {!r}'.format(agent))
+        built.append(agent)
+    return built
+
+
+def _watch(agents, loop, stop_event, exited, frames, interval):
+    while not stop_event.wait(interval) and not exited.is_set():
+        frames.value = sum(a.counters['frames_handled'] for a in agents)
+    frames.value = sum(a.counters['frames_handled'] for a in agents)
+    if exited.is_set():
+        return
+    for agent in agents:
+        if not agent.states.should_stop:
+            loop.call_soon_threadsafe(agent.stop)
+
+
+def run_worker(index, agents, endpoint, auth, space, pin, stop_event, frames, core):
+    from zentropi.utils import run_agents
+
+    pinned = pin_to_core(index) if pin else None
+    if pinned is not None:
+        core.value = pinned
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    agents = build_agents(agents)
+    stopped = threading.Event()  # an agent stopped cleanly, rather than crashed.
+
+    def on_stopping(event):
+        stopped.set()
+        stop_event.set()
+
+    for agent in agents:
+        agent.on_event('*** stopping')(on_stopping)
+    exited = threading.Event()
+    watcher = threading.Thread(target=_watch, args=(agents, loop, stop_event, exited, frames,
+                                                    SUPERVISOR_POLL_INTERVAL), daemon=True)
+    watcher.start()
+    try:
+        run_agents(*agents, endpoint=endpoint, auth=auth, space=space, loop=loop)
+    finally:
+        exited.set()
+        watcher.join()  # exiting while it holds the shared event's lock would block the supervisor.
+    if not stopped.is_set():  # run_agents() logs and returns when an agent raises.
+        logger.error('Worker {} exited without its agents being stopped.'.format(index))
+        sys.exit(1)
+
+
+class Worker(object):
+    def __init__(self, index, agents):
+        self.index = index
+        self.agents = agents
+        self.process = None
+        self.restarts = 0
+        self.abandoned = False
+        self.frames = multiprocessing.Value('L', 0)
+        self.core = multiprocessing.Value('i', -1)
+        self._last_frames = 0
+        self._last_time = time.time()
+        self.frames_per_second = 0.0
+
+    @property
+    def alive(self):
+        return bool(self.process and self.process.is_alive())
+
+    @property
+    def crashed(self):
+        return bool(self.process and self.process.exitcode not in (None, 0))
+
+    def measure(self):
+        now, frames = time.time(), self.frames.value
+        if frames < self._last_frames:  # restarted worker counts from zero.
+            self._last_frames = 0
+        elapsed = now - self._last_time
+        if elapsed > 0:
+            self.frames_per_second = (frames - self._last_frames) / elapsed
+        self._last_frames, self._last_time = frames, now
+
+    def describe(self):
+        return {
+            'index': self.index,
+            'pid': self.process.pid if self.process else None,
+            'core': self.core.value if self.core.value >= 0 else None,
+            'alive': self.alive,
+            'restarts': self.restarts,
+            'frames': self.frames.value,
+            'frames_per_second': round(self.frames_per_second, 2),
+        }
+
+
+class Supervisor(object):
+    """
+    Runs agents in several worker processes that all connect to one
+    shared endpoint (anything but inmemory://, which only exists inside
+    a single process). Agents are dealt round-robin to processes and each
+    process is pinned to a core where the platform allows it.
+
+    Crashed workers are restarted, and an agent stopping in any
+    process stops the whole cluster.
+    """
+    def __init__(self, agents, *, processes, endpoint='inmemory://', auth=None, space='zentropia',
+                 pin=True, restart=True, report_interval=SUPERVISOR_REPORT_INTERVAL):
+        endpoint = validate_endpoint(endpoint)
+        if not isinstance(processes, int) or processes < 1:
+            raise ValueError('Expected processes to be a positive integer. '
+                             'Got: {!r}'.format(processes))
+        if processes > 1 and endpoint.startswith('inmemory://'):
+            raise ValueError('Expected a shared endpoint for {} processes, '
+                             'inmemory:// can not be reached from other processes.'
+                             ''.format(processes))
+        if not agents:
+            raise ValueError('Expected at least one agent to supervise.')
+        self._endpoint = endpoint
+        self._auth = auth
+        self._space = validate_space(space)
+        self._pin = pin
+        self._restart = restart
+        self._report_interval = report_interval
+        self._context = multiprocessing.get_context('fork') if hasattr(os, 'fork') else multiprocessing
+        self._stop_event = self._context.Event()
+        self._workers = [Worker(index, agents_) for index, agents_
+                         in enumerate(partition(list(agents), processes))]
+
+    @property
+    def workers(self):
+        return list(self._workers)
+
+    def _start_worker(self, worker):
+        worker.process = self._context.Process(
+            target=run_worker, name='zentropi-worker-{}'.format(worker.index),
+            args=(worker.index, worker.agents, self._endpoint, self._auth, self._space,
+                  self._pin, self._stop_event, worker.frames, worker.core))
+        worker.process.start()
+
+    def start(self):
+        for worker in self._workers:
+            self._start_worker(worker)
+
+    def stop(self):
+        self._stop_event.set()
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def check(self):
+        """Restart crashed workers; returns False once every worker has exited."""
+        for worker in self._workers:
+            if not worker.crashed or self.stopped or worker.abandoned:
+                continue
+            if not self._restart:
+                logger.error('Worker {} exited with code {}.'.format(worker.index, worker.process.exitcode))
+                worker.abandoned = True
+                continue
+            logger.warning('Restarting worker {} after exit code {}.'
+                           ''.format(worker.index, worker.process.exitcode))
+            worker.restarts += 1
+            self._start_worker(worker)
+        return any(w.alive for w in self._workers)
+
+    def stats(self):
+        for worker in self._workers:
+            worker.measure()
+        return [w.describe() for w in self._workers]
+
+    def report(self):
+        for stats in self.stats():
+            logger.info('worker {index} pid {pid} core {core}: {frames} frames, '
+                        '{frames_per_second}/s, {restarts} restarts'.format(**stats))
+
+    def join(self, timeout=SUPERVISOR_STOP_TIMEOUT):
+        deadline = time.time() + timeout
+        for worker in self._workers:
+            if not worker.process:
+                continue
+            worker.process.join(max(0, deadline - time.time()))
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    def run(self):
+        self.start()
+        last_report = time.time()
+        try:
+            while not self._stop_event.wait(SUPERVISOR_POLL_INTERVAL):
+                if not self.check():
+                    break
+                if time.time() - last_report >= self._report_interval:
+                    self.report()
+                    last_report = time.time()
+        except KeyboardInterrupt:
+            self.stop()
+        except Exception:
+            traceback.print_exc()
+            self.stop()
+        self.stop()
+        self.join()
+        return self.stats()
+
+
+__all__ = [
+    'Supervisor',
+]
@@ -0,0 +1,85 @@
+# coding=utf-8
+import asyncio
+from collections import defaultdict, deque
+from functools import partial
+
+from zentropi.utils import logger
+
+
+class TaskRegistry(object):
+    """
+    Keeps track of the tasks an agent spawns.
+
+    Tasks spawned for a handler are counted per handler, can be bounded
+    with the handler's max_concurrency (extra invocations are queued and
+    only started once a slot is free) and are drained when the agent stops. Exceptions from any task are
+    logged and passed to on_error instead of being lost with the task.
+    """
+    def __init__(self, on_error=None):
+        if on_error and not callable(on_error):
+            raise ValueError('Expected a callable for on_error, got: {}'
+                             ''.format(on_error))
+        self._on_error = on_error
+        self._tasks = defaultdict(set)  # type: dict
+        self._pending = defaultdict(deque)  # type: dict
+
+    def spawn(self, loop, coro, handler=None):
+        """Start coro as a task, or queue it until one of the handler's
+        max_concurrency slots is free; returns None if queued."""
+        if handler and handler.max_concurrency and len(self._tasks[handler]) >= handler.max_concurrency:
+            self._pending[handler].append((loop, coro))
+            return None
+        task = loop.create_task(coro)
+        self._tasks[handler].add(task)
+        task.add_done_callback(partial(self._done, handler))
+        return task
+
+    def _done(self, handler, task):
+        self._tasks[handler].discard(task)
+        pending = self._pending.get(handler)
+        if pending:
+            loop, coro = pending.popleft()
+            self.spawn(loop, coro, handler=handler)
+        if task.cancelled() or task.exception() is None:
+            return
+        self.report(handler, task.exception())
+
+    def report(self, handler, error):
+        logger.error('Task for handler {!r} failed: {!r}'
+                     ''.format(handler.name if handler else None, error),
+                     exc_info=(type(error), error, error.__traceback__))
+        if self._on_error:
+            self._on_error(handler, error)
+
+    def in_flight(self):
+        return {handler.name: len(tasks) for handler, tasks in self._tasks.items()
+                if handler and tasks}
+
+    def queued(self):
+        return {handler.name: len(pending) for handler, pending in self._pending.items() if pending}
+
+    def load(self):
+        """Handler tasks running or queued."""
+        return sum(self.in_flight().values()) + sum(self.queued().values())
+
+    def _handler_tasks(self):
+        return {task for handler, tasks in self._tasks.items() if handler is not None for task in tasks}
+
+    async def drain(self, timeout):
+        """Wait for handler tasks, including queued ones, to finish and
+        cancel what is left after timeout. Returns the number of cancelled tasks."""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        tasks = self._handler_tasks()
+        while tasks and loop.time() < deadline:
+            await asyncio.wait(tasks, timeout=deadline - loop.time())
+            tasks = self._handler_tasks()
+        cancelled = 0
+        for pending in self._pending.values():
+            while pending:
+                _, coro = pending.popleft()
+                coro.close()
+                cancelled += 1
+        for task in tasks:
+            task.cancel()
+        return cancelled + len(tasks)
@@ -7,6 +7,7 @@ import os
 import sys
 import traceback
 import warnings
+from collections import OrderedDict
 from typing import Any, Optional
 
 logger = logging.getLogger(__name__)
@@ -79,6 +80,63 @@ def deflate_dict(frame_as_dict):
     return {k: v for k, v in frame_as_dict.items() if v}
 
 
+def resolve_field(frame, path):
+    """
+    Look up a dotted path on a frame: 'data.chat_id', 'meta.source', 'name'.
+    Returns None if any part of the path is missing.
+
+    Example:
+        >>> from zentropi.frames import Event
+        >>> from zentropi.utils import resolve_field
+        >>> resolve_field(Event('reading', data={'device': {'id': 7}}), 'data.device.id')
+        7
+    """
+    head, *rest = path.split('.')
+    if head == 'data':
+        value = frame.data.data
+    elif head == 'meta':
+        value = frame.meta
+    else:
+        value = getattr(frame, head, None)
+    for part in rest:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part, None)
+    return value
+
+
+class BoundedSet(object):
+    """
+    A set that forgets its oldest items once it holds more than maxlen.
+
+    Example:
+        >>> from zentropi.utils import BoundedSet
+        >>> ids = BoundedSet(maxlen=2)
+        >>> for id_ in ('a', 'b', 'c'):
+        ...     ids.add(id_)
+        >>> 'a' in ids, 'c' in ids
+        (False, True)
+    """
+    def __init__(self, maxlen):
+        if not isinstance(maxlen, int) or maxlen < 1:
+            raise ValueError('Expected maxlen to be a positive integer. '
+                             'Got: {!r}'.format(maxlen))
+        self._items = OrderedDict()  # type: OrderedDict
+        self._maxlen = maxlen
+
+    def add(self, item):
+        self._items[item] = True
+        self._items.move_to_end(item)
+        while len(self._items) > self._maxlen:
+            self._items.popitem(last=False)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
 def validate_handler(handler):
     from zentropi.handlers import Handler
 
@@ -144,6 +202,15 @@ def validate_id(id: str = None) -> Optional[str]:
     return id
 
 
+def validate_executor(executor):
+    if executor is None:
+        return None
+    if not isinstance(executor, str) or not executor.strip():
+        raise ValueError('Expected executor to be the name of an executor pool. '
+                         'Got: {!r}'.format(executor))
+    return executor
+
+
 def validate_endpoint(endpoint: str) -> str:
     if not isinstance(endpoint, str):
         raise ValueError('Expected endpoint to be a string.'
@@ -167,7 +234,8 @@ def validate_auth(auth):
     return auth
 
 
-def run_agents(*agents, endpoint='inmemory://', auth=None, space='zentropia', shell=False, loop=None):
+def run_agents(*agents, endpoint='inmemory://', auth=None, space='zentropia', shell=False, loop=None,
+               processes=1):
     import asyncio
     from zentropi import Agent, ZentropiShell
 
@@ -176,6 +244,14 @@ def run_agents(*agents, endpoint='inmemory://', auth=None, space='zentropia', sh
 
     if not agents:
         return
+    if processes > 1:
+        from zentropi.supervisor import Supervisor
+
+        if shell:
+            raise ValueError('Expected shell=False when running agents in {} processes, '
+                             'connect a shell to {!r} instead.'.format(processes, endpoint))
+        supervisor = Supervisor(agents, processes=processes, endpoint=endpoint, auth=auth, space=space)
+        return supervisor.run()
     agents = list(agents)
     for agent in agents:
         if not isinstance(agent, Agent):
@@ -188,7 +264,10 @@ def run_agents(*agents, endpoint='inmemory://', auth=None, space='zentropia', sh
 
     if len(agents) == 1:
         agent = agents[0]
-        agent.connect(endpoint, auth=auth)
+        if endpoint.startswith('inmemory://'):
+            agent.bind(endpoint)
+        else:
+            agent.connect(endpoint, auth=auth)
         agent.join(space)
         agent.run()
         return
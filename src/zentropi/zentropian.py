@@ -1,13 +1,19 @@
 # coding=utf-8
+from collections import Counter
 from typing import Optional, Union
 from uuid import uuid4
 
 from zentropi.defaults import \
     FRAME_NAME_MAX_LENGTH
 from zentropi.events import Event, Events
-from zentropi.frames import Frame
+from zentropi.frames import Command, Frame
 from zentropi.handlers import Handler
 from zentropi.messages import Message, Messages
+from zentropi.requests import (
+    Request,
+    Requests,
+    Response
+)
 from zentropi.states import State, States
 from zentropi.symbols import KINDS
 from zentropi.utils import validate_name
@@ -21,7 +27,9 @@ class Zentropian(object):
         self.states = States(callback=callback)
         self.events = Events(callback=callback)
         self.messages = Messages(callback=callback)
+        self.requests = Requests(callback=callback)
         self._connections = ConnectionRegistry(self)
+        self.counters = Counter()  # type: Counter
         self.inspect_handlers()
 
     @property
@@ -39,8 +47,32 @@ class Zentropian(object):
             self.states.add_handler(handler.name, handler)
         elif handler.kind == KINDS.MESSAGE:
             self.messages.add_handler(handler.name, handler)
+        elif handler.kind == KINDS.REQUEST:
+            self.requests.add_handler(handler.name, handler)
         else:  # pragma: no cover
             raise ValueError('Unknown handler kind: {}'.format(handler.kind))
+        self._push_interests()
+
+    def remove_handler(self, handler):
+        if handler.kind == KINDS.EVENT:
+            self.events.remove_handler(handler.name, handler)
+        elif handler.kind == KINDS.STATE:
+            self.states.remove_handler(handler.name, handler)
+        elif handler.kind == KINDS.MESSAGE:
+            self.messages.remove_handler(handler.name, handler)
+        elif handler.kind == KINDS.REQUEST:
+            self.requests.remove_handler(handler.name, handler)
+        else:  # pragma: no cover
+            raise ValueError('Unknown handler kind: {}'.format(handler.kind))
+        self._push_interests()
+
+    def interests(self):
+        """What frames from other agents could match any of our handlers."""
+        return self.events.interests().merge(self.messages.interests(), self.requests.interests())
+
+    def _push_interests(self):
+        if self._connections.connected:
+            self._connections.update_interests(self.interests())
 
     def inspect_handlers(self):
         for attribute_name in dir(self):
@@ -50,13 +82,44 @@ class Zentropian(object):
             for handler in attr.meta:
                 self.add_handler(handler)
 
+    def receive(self, frame):
+        """Frames from connections; Agent queues them by priority."""
+        self.handle_frame(frame)
+
+    def outgoing(self, frame):
+        """Frames to connections; Agent keeps reliable ones until acked."""
+        pass
+
     def handle_frame(self, frame):
+        if frame.target and frame.target != self.name:
+            return  # for brokers that can not deliver to the target alone.
+        if frame.expired:
+            self.counters['frames_expired'] += 1
+            return
+        self.counters['frames_handled'] += 1
         if isinstance(frame, Event):
             frame, handlers = self.events.match(frame)
         elif isinstance(frame, State):
             frame, handlers = self.states.match(frame)
         elif isinstance(frame, Message):
             frame, handlers = self.messages.match(frame)
+        elif isinstance(frame, Request):
+            if self.requests.cancelled(frame.id):
+                return
+            frame, handlers = self.requests.match(frame)
+        elif isinstance(frame, Response):
+            self.requests.resolve(frame)
+            return
+        elif isinstance(frame, Command) and frame.name == 'cancel':
+            self.requests.cancel(frame.data.request)
+            return
+        elif isinstance(frame, Command) and frame.name == 'replay':
+            for frame_as_dict in frame.data.frames:
+                self.handle_frame(Frame.from_dict(frame_as_dict))
+            return
+        elif isinstance(frame, Command) and frame.name == 'group-rebalance':
+            self.emit('*** group-rebalance', data=frame.data, space=frame.space, internal=True)
+            return
         else:
             raise ValueError('Unknown frame {!r} with kind {!r}'
                              ''.format(frame.name, KINDS(frame.kind)))  # todo: KINDS might throw an exception?
@@ -87,7 +150,10 @@ class Zentropian(object):
                 name = return_value
             self.message(name=name,
                          data={'text': return_value},
-                         reply_to=frame.id)
+                         reply_to=frame.id,
+                         deadline=frame.deadline)
+        elif isinstance(frame, Request):
+            self.respond(frame, return_value)
         else:
             raise NotImplementedError()
 
@@ -96,11 +162,18 @@ class Zentropian(object):
             return
         if isinstance(frame, Event) and frame.source != self.name and frame.name.startswith('***'):
             return
+        if handler.where is not None and not handler.where(frame):
+            return
         if handler.run_async:
             raise NotImplementedError(
                 'Async handlers are not supported '
                 'by the base Zentropian class. '
                 'Please use Agent.')
+        if handler.executor:
+            raise NotImplementedError(
+                'Executor handlers are not supported '
+                'by the base Zentropian class. '
+                'Please use Agent.')
         payload = []  # type: list
         if handler.pass_self:
             payload.append(self)
@@ -113,7 +186,7 @@ class Zentropian(object):
         def wrapper(handler):
             handler_obj = Handler(kind=KINDS.STATE, name=name, handler=handler,
                                   exact=exact, parse=parse, fuzzy=fuzzy, ignore_case=ignore_case, **kwargs)
-            self.states.add_handler(name, handler_obj)
+            self.add_handler(handler_obj)
             return handler
 
         return wrapper
@@ -122,7 +195,7 @@ class Zentropian(object):
         def wrapper(handler):
             handler_obj = Handler(kind=KINDS.EVENT, name=name, handler=handler,
                                   exact=exact, parse=parse, fuzzy=fuzzy, ignore_case=ignore_case, **kwargs)
-            self.events.add_handler(name, handler_obj)
+            self.add_handler(handler_obj)
             return handler
 
         return wrapper
@@ -131,33 +204,83 @@ class Zentropian(object):
         def wrapper(handler):
             handler_obj = Handler(kind=KINDS.MESSAGE, name=name, handler=handler,
                                   exact=exact, parse=parse, fuzzy=fuzzy, ignore_case=ignore_case, **kwargs)
-            self.messages.add_handler(name, handler_obj)
+            self.add_handler(handler_obj)
             return handler
 
         return wrapper
 
-    def emit(self, name, data=None, space=None, internal=False, reply_to=None):
+    def on_request(self, name, *, exact=True, parse=False, fuzzy=False, ignore_case=False, **kwargs):
+        def wrapper(handler):
+            handler_obj = Handler(kind=KINDS.REQUEST, name=name, handler=handler,
+                                  exact=exact, parse=parse, fuzzy=fuzzy, ignore_case=ignore_case, **kwargs)
+            self.add_handler(handler_obj)
+            return handler
+
+        return wrapper
+
+    def emit(self, name, data=None, space=None, internal=False, reply_to=None, target=None, retain=False,
+             ttl=None, deadline=None, priority=None, reliable=False):
+        """With ttl (seconds) or deadline (a time.time()) the event is
+        dropped by brokers and agents that get it after its deadline.
+        Events are queued as 'bulk' unless given another priority.
+        Agents send reliable events again until they are acked."""
         event = self.events.emit(name=name, data=data, space=space, internal=internal,
-                                 source=self.name, reply_to=reply_to)
+                                 source=self.name, reply_to=reply_to, target=target, retain=retain,
+                                 ttl=ttl, deadline=deadline, priority=priority, reliable=reliable)
         if not internal and self._connections.connected:
             self._connections.broadcast(frame=event)
         return event
 
-    def message(self, name, data=None, space=None, internal=False, reply_to=None):
+    def message(self, name, data=None, space=None, internal=False, reply_to=None, target=None,
+                ttl=None, deadline=None, priority=None, reliable=False):
         message = self.messages.message(name=name, data=data, space=space, internal=internal,
-                                        source=self.name, reply_to=reply_to)
+                                        source=self.name, reply_to=reply_to, target=target,
+                                        ttl=ttl, deadline=deadline, priority=priority, reliable=reliable)
         if not internal and self._connections.connected:
             self._connections.broadcast(frame=message)
         return message
 
+    def respond(self, request, value):
+        """Send value back to the source of request; dicts are sent as the
+        response data, anything else as {'value': value}."""
+        if self.requests.cancelled(request.id):
+            return None
+        response = self.requests.response(request, value, source=self.name)
+        if response.target == self.name or request.internal:
+            self.requests.resolve(response)
+        elif self._connections.connected:
+            self._connections.broadcast(frame=response)
+        return response
+
     def connect(self, endpoint, *, auth=None, tag='default'):
         self._connections.connect(endpoint, auth=auth, tag=tag)
 
     def bind(self, endpoint, *, tag='default'):
         self._connections.bind(endpoint, tag=tag)
 
-    def join(self, space, *, tags: Optional[Union[list, str]] = None):
-        self._connections.join(space, tags=tags)
+    def join(self, space, *, tags: Optional[Union[list, str]] = None, group: Optional[str] = None,
+             partition_by: Optional[str] = None, credits: Optional[int] = None, ordered: bool = False):
+        """With a group, each frame in space goes to only one of the
+        agents that joined it with the same group; with partition_by
+        frames with the same value at that dotted path go to the same one.
+        With credits, producers using emit_async() can send the group that
+        many frames more than its members have handled.
+        With ordered=True (not for groups) frames from each source in space
+        are handled in the order they were sent."""
+        if group is not None:
+            group = validate_name(group)
+        if partition_by is not None and (not group or not isinstance(partition_by, str)):
+            raise ValueError('Expected partition_by to be a dotted path like \'data.device_id\' '
+                             'for a group. Got: {!r} for group: {!r}'.format(partition_by, group))
+        if credits is not None and (not group or isinstance(credits, bool) or not isinstance(credits, int)
+                                    or credits < 1):
+            raise ValueError('Expected credits to be a positive integer for a group. '
+                             'Got: {!r} for group: {!r}'.format(credits, group))
+        if ordered and group:
+            raise ValueError('Expected ordered=False for group {!r}, its members each get '
+                             'only some of the frames in space {!r}.'.format(group, space))
+        self._connections.join(space, tags=tags, group=group, partition_by=partition_by, credits=credits,
+                               ordered=ordered)
 
     def leave(self, space, *, tags: Optional[Union[list, str]] = None):
         self._connections.leave(space, tags=tags)
@@ -214,3 +337,16 @@ def on_message(name, *, exact=True, parse=False, fuzzy=False, ignore_case=True,
         return handler
 
     return wrapper
+
+
+def on_request(name, *, exact=True, parse=False, fuzzy=False, ignore_case=False, **kwargs):
+    def wrapper(handler):
+        handler_obj = Handler(kind=KINDS.REQUEST, name=name, handler=handler,
+                              exact=exact, parse=parse, fuzzy=fuzzy, ignore_case=ignore_case, **kwargs)
+        if hasattr(handler, 'meta'):
+            handler.meta.append(handler_obj)
+        else:
+            handler.meta = [handler_obj]
+        return handler
+
+    return wrapper
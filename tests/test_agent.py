@@ -0,0 +1,387 @@
+# coding=utf-8
+import asyncio
+
+from zentropi import Agent, Event
+from zentropi.delivery import Delivery
+from zentropi.utils import run_agents
+
+
+def test_every_handler_sees_a_frame():
+    agent = Agent('dedup-agent')
+    seen = []
+
+    @agent.on_event('test')
+    def first(event):
+        seen.append('first')
+
+    @agent.on_event('test')
+    def second(event):
+        seen.append('second')
+
+    agent.handle_frame(Event('test'))
+    assert sorted(seen) == ['first', 'second']
+
+
+def test_duplicate_frame_is_handled_once():
+    agent = Agent('dedup-agent')
+    seen = []
+
+    @agent.on_event('test')
+    def first(event):
+        seen.append('first')
+
+    @agent.on_event('test')
+    def second(event):
+        seen.append('second')
+
+    event = Event('test')
+    agent.handle_frame(event)
+    agent.handle_frame(event)
+    assert sorted(seen) == ['first', 'second']
+
+
+def test_stop_drains_tasks_before_closing():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    first, second = Agent('first'), Agent('second')
+    received = []
+
+    @first.on_event('*** started')
+    async def work(event):
+        first.stop()
+        await asyncio.sleep(0.05)
+        first.emit('done')
+
+    @second.on_event('done')
+    def on_done(event):
+        received.append(event.source)
+        second.stop()
+
+    @second.on_timer(2)
+    def give_up():
+        second.stop()
+
+    run_agents(first, second, endpoint='inmemory://drain', loop=loop)
+    assert received == ['first']
+
+
+def test_targeted_event():
+    first, second, third = Agent('first'), Agent('second'), Agent('third')
+    first.bind('inmemory://targeted')
+    for agent in (second, third):
+        agent.connect('inmemory://targeted')
+    seen = []
+    for agent in (first, second, third):
+        agent.join('targeted')
+
+        @agent.on_event('psst')
+        def on_psst(event, name=agent.name):
+            seen.append(name)
+
+    first.emit('psst', target='third')
+    assert seen == ['third']
+
+
+def test_interests_follow_handlers():
+    first, second = Agent('first'), Agent('second')
+    first.bind('inmemory://interests')
+    second.connect('inmemory://interests')
+    first.join('interests')
+    second.join('interests')
+    first.emit('news')
+    assert second.counters['frames_handled'] == 0
+    seen = []
+
+    @second.on_event('news')
+    def on_news(event):
+        seen.append(event.name)
+
+    first.emit('news')
+    assert seen == ['news']
+
+
+def test_queue_group_shares_frames():
+    boss = Agent('boss')
+    boss.bind('inmemory://groups')
+    boss.join('jobs')
+    workers = [Agent('worker-{}'.format(i)) for i in range(3)]
+    done = []
+    for worker in workers:
+        worker.connect('inmemory://groups')
+        worker.join('jobs', group='workers')
+
+        @worker.on_event('job')
+        def on_job(event, name=worker.name):
+            done.append((name, event.data.number))
+
+    for number in range(6):
+        boss.emit('job', data={'number': number})
+    assert sorted(number for _, number in done) == list(range(6))
+    assert sorted(name for name, _ in done) == ['worker-0', 'worker-0', 'worker-1',
+                                                'worker-1', 'worker-2', 'worker-2']
+    workers[0].leave('jobs')
+    boss.emit('job', data={'number': 6})
+    boss.emit('job', data={'number': 7})
+    assert {name for name, number in done if number > 5} == {'worker-1', 'worker-2'}
+
+
+def test_partitioned_group_rebalance_event():
+    boss, first, second = Agent('boss'), Agent('first'), Agent('second')
+    boss.bind('inmemory://partitioned')
+    boss.join('readings')
+    rebalances = []
+    for worker in (first, second):
+        worker.connect('inmemory://partitioned')
+
+        @worker.on_event('*** group-rebalance')
+        def on_rebalance(event, name=worker.name):
+            rebalances.append((name, event.data.members))
+
+        worker.join('readings', group='workers', partition_by='data.device_id')
+    assert rebalances == [('first', ['first']),
+                          ('first', ['first', 'second']), ('second', ['first', 'second'])]
+
+
+def test_retained_event_is_replayed_on_join():
+    sensor, display = Agent('sensor'), Agent('display')
+    sensor.bind('inmemory://retained')
+    display.connect('inmemory://retained')
+    sensor.join('home.kitchen')
+    sensor.emit('temperature', data={'value': 21}, retain=True)
+    seen = []
+
+    @display.on_event('temperature')
+    def on_temperature(event):
+        seen.append(event.data.value)
+
+    display.join('home.kitchen')
+    assert seen == [21]
+
+
+def test_where_is_evaluated_at_the_broker():
+    sensor, monitor = Agent('sensor'), Agent('monitor')
+    sensor.bind('inmemory://where')
+    monitor.connect('inmemory://where')
+    sensor.join('lab')
+    monitor.join('lab')
+    seen = []
+
+    @monitor.on_event('temperature', where="data.value > 30 and data.room == 'lab'")
+    def on_hot(event):
+        seen.append(event.data.value)
+
+    for value in (25, 35, 40):
+        sensor.emit('temperature', data={'value': value, 'room': 'lab'})
+    sensor.emit('temperature', data={'value': 50, 'room': 'hall'})
+    assert seen == [35, 40]
+    assert monitor.counters['frames_handled'] == 2
+
+
+def test_expired_frames_are_dropped():
+    agent = Agent('expiry')
+    seen = []
+
+    @agent.on_event('reading')
+    def on_reading(event):
+        seen.append(event.data.value)
+
+    @agent.on_event('readings', batch=3)
+    def on_readings(events):
+        seen.append([event.data.value for event in events])
+
+    agent.handle_frame(Event('reading', data={'value': 1}, meta={'deadline': 1}))
+    agent.handle_frame(Event('reading', data={'value': 2}))
+    agent._invoke_batch(agent.events.match(Event('readings'))[1].pop(),
+                        [Event('readings', data={'value': 3}, meta={'deadline': 1}),
+                         Event('readings', data={'value': 4})])
+    assert seen == [2, [4]]
+    assert agent.counters['frames_expired'] == 2
+
+
+def test_inbox_handles_control_frames_first():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    agent = Agent('inbox', scheduling='strict')
+    seen = []
+
+    @agent.on_event('reading')
+    def on_reading(event):
+        seen.append(event.name)
+
+    @agent.on_event('alarm')
+    def on_alarm(event):
+        seen.append(event.name)
+
+    @agent.on_event('*** started')
+    async def flood(event):
+        for i in range(50):
+            agent.receive(Event('reading', data={'value': i}, source='sensor'))
+        agent.receive(Event('alarm', source='sensor', meta={'priority': 'control'}))
+        assert len(agent.inbox) == 51
+        await asyncio.sleep(0.01)
+        agent.stop()
+
+    agent.run()
+    assert seen[0] == 'alarm'
+    assert len(seen) == 51
+
+
+def test_emit_async_waits_for_credits():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    producer, consumer = Agent('producer'), Agent('consumer')
+    received = []
+
+    @consumer.on_event('*** started')
+    def join_with_credits(event):
+        consumer.join('jobs', group='workers', credits=2)
+
+    @consumer.on_event('job')
+    def on_job(event):
+        received.append(event.data.number)
+
+    @producer.on_event('*** started')
+    async def produce(event):
+        producer.join('jobs')
+        await asyncio.sleep(0.01)
+        for number in range(10):
+            await producer.emit_async('job', data={'number': number}, space='jobs')
+        await asyncio.sleep(0.01)
+        producer.stop()
+        consumer.stop()
+
+    run_agents(producer, consumer, endpoint='inmemory://credits', loop=loop)
+    assert received == list(range(10))
+    assert producer.credits.stalls['jobs'] >= 4
+    assert producer.credits.stalled() == {}
+
+
+def test_ordered_space_handles_frames_in_sequence():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    agent = Agent('ordered', reorder_wait=0.01)
+    agent.sequencer.join('sensors')
+    seen, gaps = [], []
+
+    @agent.on_event('reading')
+    def on_reading(event):
+        seen.append(event.seq)
+
+    @agent.on_event('*** sequence-gap')
+    def on_gap(event):
+        gaps.append((event.data.source, event.data.expected, event.data.missing))
+
+    @agent.on_event('*** started')
+    async def deliver(event):
+        for seq in (1, 3, 2, 6):
+            agent.receive(Event('reading', source='probe', space='sensors', meta={'seq': seq, 'epoch': 'a'}))
+        await asyncio.sleep(0.05)
+        agent.stop()
+
+    agent.run()
+    assert seen == [1, 2, 3, 6]
+    assert gaps == [('probe', 4, 2)]
+
+
+def test_frames_sent_to_a_space_are_numbered():
+    agent = Agent('numbered')
+    agent.bind('inmemory://numbered')
+    agent.join('sensors')
+    events = [agent.emit('reading', space='sensors') for _ in range(2)]
+    assert [event.seq for event in events] == [1, 2]
+    assert agent.emit('reading').seq is None
+    assert agent.emit('alarm', space='sensors', priority='control').seq == 1
+
+
+def test_reliable_event_is_redelivered_until_acked():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    shell = Agent('shell', delivery=Delivery(timeout=0.02))
+    relay = Agent('relay')
+    toggles = []
+
+    @relay.on_event('toggle')
+    def on_toggle(event):
+        toggles.append(event.data.power)
+
+    @shell.on_event('*** started')
+    async def send(event):
+        shell.join('gpio', reliable=True)
+        shell.emit('toggle', data={'power': True}, space='gpio')  # nobody to ack it yet.
+        await asyncio.sleep(0.01)
+        relay.join('gpio')
+        await asyncio.sleep(0.2)
+        shell.stop()
+        relay.stop()
+
+    run_agents(shell, relay, endpoint='inmemory://reliable', loop=loop)
+    assert toggles == [True]
+    assert len(shell.delivery) == 0
+    assert shell.delivery.counters['frames_redelivered'] >= 1
+    assert shell.delivery.counters['frames_acked'] == 1
+
+
+def test_reliable_event_echoed_to_its_sender_is_not_acked():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    shell = Agent('shell', delivery=Delivery(timeout=0.1))
+    relay = Agent('relay')
+    toggles = []
+
+    @shell.on_event('*')
+    def on_any(event):
+        pass
+
+    @relay.on_event('toggle')
+    def on_toggle(event):
+        toggles.append(event.data.power)
+
+    @shell.on_event('*** started')
+    async def send(event):
+        shell.join('gpio', reliable=True)
+        shell.emit('toggle', data={'power': True}, space='gpio')
+        await asyncio.sleep(0.15)  # echoed back to shell's '*' handler, which must not ack it.
+        relay.join('gpio')
+        await asyncio.sleep(0.3)
+        shell.stop()
+        relay.stop()
+
+    run_agents(shell, relay, endpoint='inmemory://reliable-echo', loop=loop)
+    assert toggles == [True]
+    assert shell.delivery.counters['frames_acked'] == 1
+
+
+def test_rate_limited_handlers_and_spaces():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    agent = Agent('throttled')
+    sampled, latest = [], []
+
+    @agent.on_event('reading', sample=2)
+    def on_reading(event):
+        sampled.append(event.data.value)
+
+    @agent.on_event('position', coalesce=0.01)
+    def on_position(event):
+        latest.append(event.data.value)
+
+    @agent.on_event('*** started')
+    async def emit(event):
+        for value in range(4):
+            agent.emit('reading', data={'value': value})
+            agent.emit('position', data={'value': value})
+        await asyncio.sleep(0.05)
+        agent.stop()
+
+    agent.run()
+    assert sampled == [0, 2]
+    assert latest == [3]
+    assert agent.rate_stats()['handlers']['position']['coalesced'] == 3
+
+    agent.rate_limit('sensors', rate=1, burst=1)
+    assert agent.emit('reading', space='sensors') is not None
+    assert agent.emit('reading', space='sensors') is None
+    assert agent.emit('alarm', space='sensors') is not None
+    assert agent.rate_stats()['spaces']['sensors']['rate_limited'] == 1
+    agent.rate_limit('sensors')
+    assert agent.emit('reading', space='sensors') is not None
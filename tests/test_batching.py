@@ -0,0 +1,69 @@
+# coding=utf-8
+import asyncio
+
+import pytest
+
+from zentropi import Agent
+from zentropi.batching import Batcher
+from zentropi.handlers import Handler
+from zentropi.symbols import KINDS
+
+
+def dummy(frames):  # pragma: no cover
+    pass
+
+
+def test_batcher():
+    batches = []
+    batcher = Batcher(callback=lambda handler, frames: batches.append(frames))
+    handler = Handler(KINDS.EVENT, 'reading', dummy, batch=2)
+    batcher.add(handler, 1)
+    assert batcher.pending() == {'reading': 1}
+    batcher.add(handler, 2)
+    batcher.add(handler, 3)
+    assert batches == [[1, 2]]
+    batcher.flush_all()
+    assert batches == [[1, 2], [3]]
+    assert batcher.pending() == {}
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_batch_fails_on_state_handler():
+    Handler(KINDS.STATE, 'reading', dummy, batch=2)
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_linger_fails_without_batch():
+    Handler(KINDS.EVENT, 'reading', dummy, linger=1)
+
+
+def test_agent_batch_size_and_stop():
+    agent = Agent('batch-agent')
+    batches = []
+
+    @agent.on_event('reading', batch=3, linger=10)
+    def on_readings(events):
+        batches.append([e.data.value for e in events])
+
+    for value in range(7):
+        agent.emit('reading', data={'value': value})
+    assert batches == [[0, 1, 2], [3, 4, 5]]
+    agent.stop()
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_agent_batch_linger():
+    loop = asyncio.new_event_loop()
+    agent = Agent('linger-agent')
+    agent.loop = loop
+    batches = []
+
+    @agent.on_event('reading', batch=100, linger=0.01)
+    def on_readings(events):
+        batches.append(len(events))
+
+    agent.emit('reading')
+    agent.emit('reading')
+    loop.run_until_complete(asyncio.sleep(0.05))
+    assert batches == [2]
+    loop.close()
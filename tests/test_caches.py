@@ -0,0 +1,43 @@
+# coding=utf-8
+import pytest
+
+from zentropi.caches import TTLCache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expires():
+    clock = Clock()
+    cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=1)
+    clock.now = 2
+    assert cache.get('a') == 1
+    assert 'b' not in cache
+    clock.now = 5
+    assert cache.get('a') is None
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    cache.invalidate('a')
+    assert len(cache) == 1
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_ttl_cache_fails_on_zero_maxsize():
+    TTLCache(maxsize=0)
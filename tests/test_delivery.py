@@ -0,0 +1,84 @@
+# coding=utf-8
+import pytest
+
+from zentropi.delivery import Delivery, ack_ranges
+from zentropi.frames import (
+    Command,
+    Event,
+    frame_meta
+)
+
+
+def toggle(target=None, reliable=True):
+    return Event('toggle', source='shell', space='gpio', target=target, meta=frame_meta(reliable=reliable))
+
+
+def test_ack_ranges():
+    assert ack_ranges([]) == []
+    assert ack_ranges([3, 1, 2, 5]) == [[1, 3], [5, 5]]
+
+
+def test_delivery_redelivers_until_acked():
+    delivery = Delivery(timeout=1, attempts=3)
+    frames = [toggle() for _ in range(3)]
+    for frame in frames:
+        delivery.outgoing(frame, now=0)
+    delivery.outgoing(toggle(reliable=False), now=0)
+    delivery.outgoing(Command('ack', target='shell'), now=0)
+    assert [frame.meta['rseq'] for frame in frames] == [1, 2, 3]
+    assert len(delivery) == 3
+    assert delivery.next_redelivery() == 1
+    delivery.acked('gpio', [[1, 2]])
+    assert delivery.overdue(now=0.5) == ([], [])
+    assert delivery.overdue(now=1) == ([frames[2]], [])
+    delivery.outgoing(frames[2], now=1)  # sent again as it is.
+    assert delivery.overdue(now=2) == ([frames[2]], [])
+    assert delivery.overdue(now=3) == ([], [frames[2]])
+    assert len(delivery) == 0
+    assert delivery.counters['frames_redelivered'] == 2
+    assert delivery.counters['frames_failed'] == 1
+
+
+def test_delivery_reliable_spaces_and_targets():
+    delivery = Delivery()
+    delivery.join('gpio')
+    untargeted, targeted = toggle(reliable=False), toggle(target='relay')
+    delivery.outgoing(untargeted, now=0)
+    delivery.outgoing(targeted, now=0)
+    delivery.outgoing(toggle(target='relay', reliable=False), now=0)
+    assert untargeted.meta['rseq'] == 1 and targeted.meta['rseq'] == 1
+    assert len(delivery) == 2
+    delivery.acked('relay', [[1, 1]])
+    assert len(delivery) == 1
+
+
+def test_delivery_window():
+    delivery = Delivery(window=2)
+    for _ in range(3):
+        delivery.outgoing(toggle(), now=0)
+    assert len(delivery) == 2
+    assert delivery.counters['frames_abandoned'] == 1
+
+
+def test_delivery_dedupes_and_batches_acks():
+    delivery = Delivery(ack_batch=3, dedupe_size=10)
+    frames = [toggle() for _ in range(3)]
+    sender = Delivery()
+    for frame in frames:
+        sender.outgoing(frame, now=0)
+    for frame in frames[:2]:
+        assert delivery.incoming(frame)
+        delivery.handled(frame)
+    assert not delivery.acks_due
+    assert not delivery.incoming(frames[1])  # acked again.
+    assert delivery.incoming(frames[2])
+    delivery.handled(frames[2])
+    assert delivery.acks_due
+    assert delivery.acks() == [('shell', [{'destination': 'gpio', 'ranges': [[1, 3]]}])]
+    assert delivery.acks() == []
+    assert delivery.counters['frames_duplicate'] == 1
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_delivery_fails_on_timeout():
+    Delivery(timeout=0)
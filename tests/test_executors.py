@@ -0,0 +1,141 @@
+# coding=utf-8
+import asyncio
+import os
+import threading
+
+import pytest
+
+from zentropi import Agent, Event
+from zentropi.executors import (
+    ExecutorRegistry,
+    Pool,
+    default_executors
+)
+from zentropi.handlers import Handler
+from zentropi.symbols import KINDS
+
+
+def blocking(value):
+    return threading.current_thread(), value
+
+
+def worker_pid(event):
+    return os.getpid(), event.name, event.data.value
+
+
+def test_pool():
+    loop = asyncio.new_event_loop()
+    pool = Pool('io', max_workers=2)
+    thread, value = loop.run_until_complete(pool.run(loop, blocking, 42))
+    assert thread is not threading.current_thread()
+    assert value == 42
+    stats = pool.stats()
+    assert stats['submitted'] == 1
+    assert stats['completed'] == 1
+    assert stats['in_flight'] == 0
+    pool.shutdown(wait=True)
+    loop.close()
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_pool_fails_on_invalid_max_workers():
+    Pool('io', max_workers=0)
+
+
+def test_executor_registry():
+    loop = asyncio.new_event_loop()
+    executors = ExecutorRegistry()
+    assert sorted(executors.pools) == ['process', 'thread']
+    executors.add_pool('io', max_workers=1)
+    _, value = loop.run_until_complete(executors.run('io', blocking, 'a', loop=loop))
+    assert value == 'a'
+    assert executors.stats()['io']['completed'] == 1
+    assert executors.stats()['thread']['submitted'] == 0
+    executors.shutdown(wait=True)
+    loop.close()
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_executor_registry_fails_on_unknown_pool():
+    ExecutorRegistry().pool('nope')
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_handler_fails_on_async_executor():
+    async def dummy_async(event):  # pragma: no cover
+        pass
+
+    Handler(KINDS.EVENT, 'test', dummy_async, executor='thread')
+
+
+def test_agent_executor_handler():
+    loop = asyncio.new_event_loop()
+    agent = Agent('executor-agent')
+    agent.loop = loop
+    seen = []
+
+    @agent.on_event('blocking', executor='thread')
+    def on_blocking(event):
+        seen.append((threading.current_thread(), event.name))
+
+    agent.emit('blocking')
+    loop.run_until_complete(asyncio.sleep(0.1))
+    thread, name = seen[0]
+    assert thread is not threading.current_thread()
+    assert name == 'blocking'
+    agent.executors.shutdown(wait=True)
+    loop.close()
+
+
+def test_process_handler():
+    loop = asyncio.new_event_loop()
+    executors = ExecutorRegistry()
+    handler = Handler(KINDS.EVENT, 'cpu', worker_pid, executor='process')
+    event = Event('cpu', data={'value': 3})
+    pid, name, value = loop.run_until_complete(
+        executors.run_handler('process', handler, event, event, loop=loop))
+    assert pid != os.getpid()
+    assert (name, value) == ('cpu', 3)
+    executors.shutdown(wait=True)
+    loop.close()
+
+
+def test_process_map_chunks():
+    loop = asyncio.new_event_loop()
+    executors = ExecutorRegistry()
+    executors.warm_up(['process'])
+    events = [Event('cpu', data={'value': i}) for i in range(10)]
+    results = loop.run_until_complete(executors.map('process', worker_pid, events, chunksize=4, loop=loop))
+    assert [value for _, _, value in results] == list(range(10))
+    assert executors.stats()['process']['completed'] == 3
+    executors.shutdown(wait=True)
+    loop.close()
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_handler_fails_on_process_method():
+    class Dummy(object):
+        def on_cpu(self, event):  # pragma: no cover
+            pass
+
+    Handler(KINDS.EVENT, 'test', Dummy.on_cpu, executor='process')
+
+
+def test_agents_share_executors():
+    first, second = Agent('first'), Agent('second')
+    assert first.executors is second.executors
+    assert first.executors is default_executors()
+    own = ExecutorRegistry()
+    assert Agent('third', executors=own).executors is own
+
+
+def test_process_pool_warm_up_is_shared():
+    executors = ExecutorRegistry()
+    pool = executors.pool('process')
+    assert pool.warm is False
+    assert len(pool.warm_up()) == pool.max_workers
+    executor = pool.executor
+    assert pool.warm_up() == []
+    executors.warm_up(['process'])
+    assert pool.executor is executor
+    executors.shutdown(wait=True)
@@ -3,6 +3,8 @@ import json
 import time
 import unittest
 
+import pytest
+
 from zentropi.frames import (
     Command,
     Event,
@@ -11,7 +13,9 @@ from zentropi.frames import (
     Message,
     Request,
     Response,
-    State
+    State,
+    expired,
+    frame_meta
 )
 from zentropi.symbols import KINDS
 
@@ -260,3 +264,37 @@ class TestZenceliumFrame(unittest.TestCase):
         frame = Frame.from_json(frame_as_json)
         assert frame.name == 'ohai'
         assert frame.data == {'name': 'geek'}
+
+
+def test_frame_deadline():
+    assert Event('reading').expired is False
+    assert Event('reading', meta=frame_meta(ttl=60)).expired is False
+    stale = Event('reading', meta=frame_meta(deadline=time.time() - 1))
+    assert stale.expired is True
+    assert expired(stale.as_dict()['meta'])
+    assert not expired(stale.as_dict()['meta'], now=stale.deadline - 1)
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_frame_meta_fails_on_ttl_and_deadline():
+    frame_meta(ttl=1, deadline=time.time())
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_frame_meta_fails_on_zero_ttl():
+    frame_meta(ttl=0)
+
+
+def test_frame_priority():
+    assert Command('join').priority == 'control'
+    assert State('running').priority == 'control'
+    assert Event('*** stopping').priority == 'control'
+    assert Request('status').priority == 'interactive'
+    assert Message('hello').priority == 'interactive'
+    assert Event('reading').priority == 'bulk'
+    assert Event('reading', meta=frame_meta(priority='interactive')).priority == 'interactive'
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_frame_meta_fails_on_priority():
+    frame_meta(priority='urgent')
@@ -0,0 +1,64 @@
+# coding=utf-8
+import asyncio
+
+import pytest
+
+from zentropi import Agent, Message
+from zentropi.handlers import Handler
+from zentropi.symbols import KINDS
+
+
+def dummy(frame):  # pragma: no cover
+    pass
+
+
+def test_message_handler_cache():
+    agent = Agent('kvstore')
+    calls = []
+
+    @agent.on_message('get {key}', parse=True, cache=60, invalidate_on='kvstore-set')
+    def get(message):
+        calls.append(message.data.key)
+        return 'value of {}'.format(message.data.key)
+
+    for text in ('get a', 'get a', 'get b', 'get a'):
+        agent.handle_frame(Message(text, source='user'))
+    assert calls == ['a', 'b']
+    assert agent.caches.stats()['get {key}']['hit_ratio'] == 0.5
+
+    agent.emit('kvstore-set', data={'key': 'a'})
+    agent.handle_frame(Message('get a', source='user'))
+    assert calls == ['a', 'b', 'a']
+
+    agent.caches.invalidate('get {key}')
+    agent.handle_frame(Message('get b', source='user'))
+    assert calls == ['a', 'b', 'a', 'b']
+
+
+def test_request_handler_cache():
+    loop = asyncio.new_event_loop()
+    agent = Agent('lookup')
+    agent.loop = loop
+    calls = []
+
+    @agent.on_request('square', cache=True)
+    def square(request):
+        calls.append(request.data.value)
+        return request.data.value ** 2
+
+    for value in (3, 3, 4):
+        response = loop.run_until_complete(agent.request('square', data={'value': value}))
+        assert response.data.value == value ** 2
+    assert calls == [3, 4]
+    assert agent.caches.stats()['square']['hits'] == 1
+    loop.close()
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_cache_fails_on_event_handler():
+    Handler(KINDS.EVENT, 'test', dummy, cache=10)
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_invalidate_on_fails_without_cache():
+    Handler(KINDS.MESSAGE, 'test', dummy, invalidate_on='changed')
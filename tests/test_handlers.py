@@ -1,10 +1,11 @@
 # coding=utf-8
 import pytest
 
-from zentropi.frames import Event
+from zentropi.frames import Event, Message
 from zentropi.handlers import (
     Handler,
     HandlerRegistry,
+    Interests,
     validate_handler,
     validate_kind,
     validate_name
@@ -167,3 +168,83 @@ def test_registry_remove_handler():
     assert handler_fuzzy in registry._handlers['test-event']
     registry.remove_handler('test-event', handler_fuzzy)
     assert handler_fuzzy not in registry._handlers['test-event']
+
+
+def test_handler_registry_interests():
+    registry = HandlerRegistry()
+    ping = Handler(kind=KINDS.EVENT, name='ping', handler=dummy)
+    get = Handler(kind=KINDS.EVENT, name='get {key}', handler=dummy, parse=True)
+    registry.add_handler('ping', ping)
+    registry.add_handler('get {key}', get)
+    interests = registry.interests()
+    assert interests.names == {'ping'}
+    assert interests.prefixes == ('get ',)
+    assert interests.wildcard is False
+    assert interests.accepts(Event('GET a'))
+    assert not interests.accepts(Event('pong'))
+    registry.remove_handler('ping', ping)
+    assert registry.interests().names == set()
+    any_ = Handler(kind=KINDS.EVENT, name='*', handler=dummy)
+    registry.add_handler('*', any_)
+    assert registry.interests().accepts(Event('pong'))
+
+
+def test_handler_where():
+    handler = Handler(KINDS.EVENT, 'temperature', dummy, where='data.value > 30')
+    assert handler.where(Event('temperature', data={'value': 31}))
+    registry = HandlerRegistry()
+    registry.add_handler('temperature', handler)
+    interests = registry.interests()
+    assert interests.names == set()
+    assert interests.as_dict()['predicates'] == {'temperature': ['data.value > 30']}
+    assert interests.accepts(Event('temperature', data={'value': 31}))
+    assert not interests.accepts(Event('temperature', data={'value': 29}))
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_handler_fails_on_where_for_state():
+    Handler(KINDS.STATE, 'temperature', dummy, where='data.value > 30')
+
+
+def test_handler_fields():
+    handler = Handler(KINDS.EVENT, 'tweet', dummy, fields=['text'], where='data.likes > 10')
+    assert handler.fields == {'text', 'likes'}
+    registry = HandlerRegistry()
+    registry.add_handler('tweet', handler)
+    registry.add_handler('tweet', Handler(KINDS.EVENT, 'tweet', dummy, fields=['user_id']))
+    assert registry.interests().fields == {'tweet': {'text', 'likes', 'user_id'}}
+    registry.add_handler('tweet', Handler(KINDS.EVENT, 'tweet', dummy))
+    assert registry.interests().fields == {}
+
+
+def test_interests_fields_with_parse_handler():
+    registry = HandlerRegistry()
+    registry.add_handler('get x', Handler(KINDS.MESSAGE, 'get x', dummy, fields=['a']))
+    registry.add_handler('set y', Handler(KINDS.MESSAGE, 'set y', dummy, fields=['a']))
+    registry.add_handler('get {key}', Handler(KINDS.MESSAGE, 'get {key}', dummy, parse=True))
+    interests = registry.interests()
+    assert interests.fields == {'set y': {'a'}}
+    assert interests.fields_for(Message('get x', data={'a': 1, 'b': 2})) is None
+    assert Interests(names=['get x'], prefixes=['get '], fields={'get x': ['a']}).fields_for(
+        Message('get x', data={'a': 1})) is None
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_handler_fails_on_fields_for_parse():
+    Handler(KINDS.MESSAGE, 'hello {name}', dummy, parse=True, fields=['name'])
+
+
+def test_handler_rate_controls():
+    handler = Handler(KINDS.EVENT, 'reading', dummy, rate=10, burst=20, coalesce=0.1, sample=2)
+    assert (handler.rate, handler.burst, handler.coalesce, handler.sample) == (10, 20, 0.1, 2)
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_handler_fails_on_rate_for_request():
+    Handler(KINDS.REQUEST, 'reading', dummy, rate=10)
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_handler_fails_on_bad_coalesce():
+    Handler(KINDS.EVENT, 'reading', dummy, coalesce=-1)
+
@@ -0,0 +1,113 @@
+# coding=utf-8
+import asyncio
+
+import pytest
+
+from zentropi import Agent, Event
+from zentropi.handlers import Handler
+from zentropi.partitions import HashRing, key_hash
+from zentropi.symbols import KINDS
+
+
+async def dummy_async(event):  # pragma: no cover
+    pass
+
+
+def test_key_hash_is_stable():
+    assert key_hash('chat-1') == key_hash('chat-1')
+    assert key_hash(42) == key_hash('42')
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_partition_by_fails_with_batch():
+    Handler(KINDS.EVENT, 'test', dummy_async, partition_by='data.chat_id', batch=10)
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_partition_by_fails_on_zero_lanes():
+    Handler(KINDS.EVENT, 'test', dummy_async, partition_by='data.chat_id', lanes=0)
+
+
+def test_agent_partition_by_orders_per_key():
+    loop = asyncio.new_event_loop()
+    agent = Agent('lanes-agent')
+    agent.loop = loop
+    handled = []
+
+    @agent.on_event('chat', partition_by='data.chat_id', lanes=4)
+    async def on_chat(event):
+        await asyncio.sleep(0.001 * (event.data.seq % 3))
+        handled.append((event.data.chat_id, event.data.seq))
+
+    for seq in range(20):
+        agent.emit('chat', data={'chat_id': seq % 3, 'seq': seq})
+    assert sum(agent.lane_depths()['chat']) > 0
+    loop.run_until_complete(agent.tasks.drain(timeout=1))
+    assert len(handled) == 20
+    for chat_id in range(3):
+        seqs = [seq for chat_id_, seq in handled if chat_id_ == chat_id]
+        assert seqs == sorted(seqs)
+    assert sum(agent.lane_depths()['chat']) == 0
+    loop.close()
+
+
+def test_agent_lane_size_drops():
+    agent = Agent('full-lanes-agent')
+
+    @agent.on_event('chat', partition_by='data.chat_id', lanes=1, lane_size=2)
+    def on_chat(event):
+        pass
+
+    @agent.on_event('*** started')
+    def on_started(event):
+        agent.stop()
+
+    for _ in range(3):
+        agent.emit('chat', data={'chat_id': 1})
+    assert agent.counters['lane_dropped'] == 1
+    assert agent.lane_depths() == {'chat': [2]}
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    agent.run()  # drains the lane.
+    assert agent.lane_depths() == {'chat': [0]}
+    loop.close()
+
+
+def test_agent_lanes_started_before_loop_are_drained():
+    agent = Agent('early-lanes-agent')
+    handled = []
+
+    @agent.on_event('chat', partition_by='data.chat_id')
+    async def on_chat(event):
+        handled.append(event.data.chat_id)
+
+    @agent.on_event('*** started')
+    def on_started(event):
+        agent.stop()
+
+    agent.emit('chat', data={'chat_id': 1})  # before the agent has a loop.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    agent.run()
+    assert handled == [1]
+    loop.close()
+
+
+def test_hash_ring_moves_few_keys():
+    ring = HashRing(['w1', 'w2', 'w3'])
+    keys = ['device-{}'.format(i) for i in range(1000)]
+    before = {key: ring.node(key) for key in keys}
+    assert all(700 // 3 < list(before.values()).count(w) < 1300 // 3 for w in ring.nodes)
+    ring.add('w4')
+    after = {key: ring.node(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert all(after[key] == 'w4' for key in moved)
+    assert len(moved) < 400
+    ring.remove('w4')
+    assert {key: ring.node(key) for key in keys} == before
+    assert HashRing().node('device-1') is None
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_hash_ring_fails_on_zero_replicas():
+    HashRing(replicas=0)
@@ -0,0 +1,54 @@
+# coding=utf-8
+import pytest
+
+from zentropi import Event
+from zentropi.predicates import (
+    Predicate,
+    PredicateIndex,
+    parse_where
+)
+
+
+def test_parse_where():
+    assert parse_where("data.value >= 30 and data.room == 'lab and office'") == \
+        (('data.value', '>=', 30), ('data.room', '==', 'lab and office'))
+    assert parse_where('data.level in [1, 2] and name != "x"') == \
+        (('data.level', 'in', (1, 2)), ('name', '!=', 'x'))
+
+
+@pytest.mark.parametrize('where', ['', 'data.value >', 'data.value ~ 3', 'data.a == 1 data.b == 2',
+                                   'data.a == 1 and', 'data.a in 3', "data.a > 'x'"])
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_parse_where_fails(where):
+    parse_where(where)
+
+
+def test_predicate():
+    hot_lab = Predicate("data.value > 30 and data.room == 'lab'")
+    assert hot_lab(Event('temperature', data={'value': 31, 'room': 'lab'}))
+    assert not hot_lab(Event('temperature', data={'value': 30, 'room': 'lab'}))
+    assert not hot_lab(Event('temperature', data={'value': '31', 'room': 'lab'}))
+    assert not hot_lab(Event('temperature', data={'room': 'lab'}))
+    assert hot_lab == Predicate("data.value > 30  and data.room == 'lab'")
+
+
+def test_predicate_index():
+    index = PredicateIndex()
+    wheres = {
+        'hot': 'data.value > 30',
+        'hot-lab': "data.value >= 30 and data.room == 'lab'",
+        'cold': 'data.value < 0',
+        'office': "data.room in ['office', 'hall'] and data.value <= 20",
+        'not-lab': "data.room != 'lab'",
+        'both': "data.room == 'lab' and data.room in ['lab']",
+    }
+    for key, where in wheres.items():
+        index.add('temperature', Predicate(where), key=key)
+    for data in ({'value': 35, 'room': 'lab'}, {'value': 30, 'room': 'lab'}, {'value': -5, 'room': 'office'},
+                 {'value': 20, 'room': 'hall'}, {'room': 'lab'}, {'value': 'x'}):
+        event = Event('temperature', data=data)
+        assert index.match(event) == {key for key, where in wheres.items() if Predicate(where)(event)}
+    assert index.match(Event('humidity', data={'value': 35})) == set()
+    index.remove_key('hot')
+    assert index.match(Event('temperature', data={'value': 35, 'room': 'hall'})) == {'not-lab'}
+    assert len(index) == 5
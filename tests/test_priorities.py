@@ -0,0 +1,57 @@
+# coding=utf-8
+import pytest
+
+from zentropi.frames import (
+    Command,
+    Event,
+    Request,
+    frame_meta
+)
+from zentropi.priorities import FrameQueue
+
+
+def flood(queue, bulk=40, control=4):
+    for i in range(bulk):
+        queue.push(Event('reading', data={'value': i}))
+    for i in range(control):
+        queue.push(Command('join', data={'space': str(i)}))
+    queue.push(Request('status'))
+
+
+def test_strict_scheduling():
+    queue = FrameQueue(scheduling='strict')
+    flood(queue)
+    assert len(queue) == 45
+    names = [queue.pop().name for _ in range(len(queue))]
+    assert names == ['join'] * 4 + ['status'] + ['reading'] * 40
+    assert not queue
+
+
+def test_weighted_scheduling():
+    queue = FrameQueue(scheduling='weighted', weights={'control': 2, 'interactive': 1, 'bulk': 1})
+    flood(queue)
+    names = [queue.pop().name for _ in range(6)]
+    assert names == ['join', 'join', 'status', 'reading', 'join', 'join']
+    assert queue.depths() == {'control': 0, 'interactive': 0, 'bulk': 39}
+
+
+def test_priority_from_meta():
+    queue = FrameQueue(scheduling='strict')
+    queue.push(Event('reading'))
+    queue.push(Event('alarm', meta=frame_meta(priority='control')))
+    assert queue.pop().name == 'alarm'
+
+
+@pytest.mark.xfail(raises=IndexError, strict=True)
+def test_frame_queue_fails_when_empty():
+    FrameQueue().pop()
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_frame_queue_fails_on_scheduling():
+    FrameQueue(scheduling='fifo')
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_frame_queue_fails_on_weights():
+    FrameQueue(weights={'bulk': 0})
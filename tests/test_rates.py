@@ -0,0 +1,86 @@
+# coding=utf-8
+import asyncio
+
+import pytest
+
+from zentropi.rates import RateLimit, TokenBucket
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills():
+    bucket = TokenBucket(rate=2, burst=2)
+    assert [bucket.take(now=0) for _ in range(3)] == [True, True, False]
+    assert bucket.take(now=0.25) is False
+    assert bucket.take(now=0.5) is True
+    assert [bucket.take(now=10) for _ in range(3)] == [True, True, False]
+
+
+def test_token_bucket_default_burst():
+    assert TokenBucket(rate=5).burst == 5
+    assert TokenBucket(rate=0.5).burst == 1
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_token_bucket_fails_on_bad_rate():
+    TokenBucket(rate=0)
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_rate_limit_fails_on_burst_without_rate():
+    RateLimit(burst=2)
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_rate_limit_fails_on_bad_sample():
+    RateLimit(sample=0)
+
+
+def test_rate_limit_per_key():
+    clock = Clock()
+    limit = RateLimit(rate=1, burst=1, clock=clock)
+    delivered = []
+    for key in ('a', 'a', 'b'):
+        limit.submit(key, key, delivered.append)
+    assert delivered == ['a', 'b']
+    clock.now = 1
+    limit.submit('a', 'a', delivered.append)
+    assert delivered == ['a', 'b', 'a']
+    assert limit.stats() == {'delivered': 3, 'sampled_out': 0, 'rate_limited': 1, 'coalesced': 0}
+
+
+def test_rate_limit_samples_before_limiting():
+    limit = RateLimit(rate=100, sample=3)
+    delivered = []
+    for value in range(7):
+        limit.submit('a', value, delivered.append)
+    assert delivered == [0, 3, 6]
+    assert limit.counters['sampled_out'] == 4
+
+
+def test_rate_limit_coalesces_to_newest():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    limit = RateLimit(coalesce=0.01)
+    delivered = []
+    for value in range(3):
+        assert limit.submit('a', value, delivered.append, loop=loop) is None
+    limit.submit('b', 'b', delivered.append, loop=loop)
+    assert delivered == []
+    loop.run_until_complete(asyncio.sleep(0.02))
+    assert delivered == [2, 'b']
+    assert limit.stats() == {'delivered': 2, 'sampled_out': 0, 'rate_limited': 0, 'coalesced': 2}
+    loop.close()
+
+
+def test_rate_limit_without_loop_does_not_coalesce():
+    limit = RateLimit(coalesce=1)
+    delivered = []
+    assert limit.submit('a', 1, delivered.append) is None
+    assert delivered == [1]
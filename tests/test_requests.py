@@ -0,0 +1,180 @@
+# coding=utf-8
+import asyncio
+
+import pytest
+
+from zentropi import (
+    Agent,
+    Request,
+    Zentropian,
+    on_request
+)
+
+
+def test_request_local_handler():
+    loop = asyncio.new_event_loop()
+    agent = Agent('rpc-agent')
+    agent.loop = loop
+
+    @agent.on_request('double')
+    def double(request):
+        return request.data.value * 2
+
+    response = loop.run_until_complete(agent.request('double', data={'value': 21}))
+    assert response.data.value == 42
+    assert response.reply_to
+    assert agent.requests.pending == []
+    loop.close()
+
+
+def test_request_between_agents():
+    loop = asyncio.new_event_loop()
+    server, client, other = Agent('rpc-server'), Agent('rpc-client'), Agent('rpc-other')
+    for agent in (server, client, other):
+        agent.loop = loop
+    server.bind('inmemory://rpc')
+    client.connect('inmemory://rpc')
+    other.connect('inmemory://rpc')
+    for agent in (server, client, other):
+        agent.join('rpc')
+
+    @server.on_request('kvstore-get')
+    async def kvstore_get(request):
+        await asyncio.sleep(0)
+        return {'key': request.data.key, 'value': 'b'}
+
+    response = loop.run_until_complete(client.request('kvstore-get', data={'key': 'a'},
+                                                      target='rpc-server', timeout=1))
+    assert response.source == 'rpc-server'
+    assert response.data.value == 'b'
+    assert other.counters['frames_handled'] == 0  # neither request nor response was for it.
+    loop.close()
+
+
+def test_request_times_out():
+    loop = asyncio.new_event_loop()
+    agent = Agent('lonely-agent')
+    agent.loop = loop
+    with pytest.raises(asyncio.TimeoutError):
+        loop.run_until_complete(agent.request('nobody-home', timeout=0.01))
+    assert agent.requests.pending == []
+    loop.close()
+
+
+def test_zentropian_on_request():
+    class Echo(Zentropian):
+        @on_request('echo')
+        def echo(self, request):
+            return request.data
+
+    loop = asyncio.new_event_loop()
+    echo = Echo('echo')
+    request = Request('echo', data={'text': 'hi'}, source='echo', internal=True)
+    future = loop.create_future()
+    echo.requests.expect(request.id, future)
+    echo.handle_frame(request)
+    assert future.result().data.text == 'hi'
+    loop.close()
+
+
+def _space(endpoint, *names):
+    loop = asyncio.new_event_loop()
+    agents = [Agent(name) for name in names]
+    for agent in agents:
+        agent.loop = loop
+    agents[0].bind(endpoint)
+    for agent in agents[1:]:
+        agent.connect(endpoint)
+    for agent in agents:
+        agent.join('gather')
+    return loop, agents
+
+
+def test_gather_first_k():
+    loop, (asker, *responders) = _space('inmemory://gather-k', 'asker', 'one', 'two', 'three')
+    answered = []
+    for responder in responders:
+        @responder.on_request('ping')
+        def ping(request, name=responder.name):
+            answered.append(name)
+            return name
+
+    responses = loop.run_until_complete(asker.gather('ping', k=2, timeout=1))
+    assert len(responses) == 2
+    assert len(answered) == 2  # the third responder was told to stop.
+    assert asker.requests.pending == []
+    loop.close()
+
+
+def test_gather_deadline():
+    loop, (asker, fast, slow) = _space('inmemory://gather-deadline', 'asker', 'fast', 'slow')
+
+    @fast.on_request('ping')
+    def fast_ping(request):
+        return 'fast'
+
+    @slow.on_request('ping')
+    async def slow_ping(request):
+        await asyncio.sleep(0.2)
+        return 'slow'
+
+    async def gather():
+        values = []
+        async for response in asker.gather('ping', timeout=0.05):
+            values.append(response.data.value)
+        return values
+
+    assert loop.run_until_complete(gather()) == ['fast']
+    loop.run_until_complete(slow.tasks.drain(timeout=1))
+    assert asker.counters['frames_handled'] == 1  # one response, the late reply was dropped.
+    loop.close()
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_gather_fails_on_zero_k():
+    loop = asyncio.new_event_loop()
+    agent = Agent('gather-agent')
+    agent.loop = loop
+    agent.gather('ping', k=0)
+
+
+def test_identical_requests_are_coalesced():
+    loop, (asker, server) = _space('inmemory://coalesce', 'asker', 'server')
+    calls = []
+
+    @server.on_request('lookup')
+    async def lookup(request):
+        calls.append(request.data.key)
+        await asyncio.sleep(0.01)
+        return {'key': request.data.key}
+
+    async def ask():
+        return await asyncio.gather(
+            asker.request('lookup', data={'key': 'a', 'n': 1}),
+            asker.request('lookup', data={'n': 1, 'key': 'a'}),
+            asker.request('lookup', data={'key': 'a', 'n': 1}),
+            asker.request('lookup', data={'key': 'b', 'n': 1}),
+            asker.request('lookup', data={'key': 'a', 'n': 1}, coalesce=False))
+
+    responses = loop.run_until_complete(ask())
+    assert [r.data.key for r in responses] == ['a', 'a', 'a', 'b', 'a']
+    assert sorted(calls) == ['a', 'a', 'b']
+    assert asker.counters['requests_coalesced'] == 2
+    loop.close()
+
+
+def test_request_result_cache():
+    loop, (asker, server) = _space('inmemory://request-cache', 'asker', 'server')
+    calls = []
+
+    @server.on_request('lookup')
+    def lookup(request):
+        calls.append(request.data.key)
+        return {'key': request.data.key}
+
+    for _ in range(3):
+        response = loop.run_until_complete(asker.request('lookup', data={'key': 'a'}, cache_ttl=10))
+        assert response.data.key == 'a'
+    assert calls == ['a']
+    assert asker.counters['requests_cache_hits'] == 2
+    loop.close()
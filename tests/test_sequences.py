@@ -0,0 +1,70 @@
+# coding=utf-8
+import pytest
+
+from zentropi.frames import Event
+from zentropi.sequences import Sequencer
+
+
+def reading(seq, epoch='a', space='sensors', priority=None):
+    meta = {'seq': seq, 'epoch': epoch}
+    if priority:
+        meta['priority'] = priority
+    return Event('reading', source='probe', space=space, meta=meta)
+
+
+def seqs(frames):
+    return [frame.seq for frame in frames]
+
+
+def ordered_sequencer(**kwargs):
+    sequencer = Sequencer(**kwargs)
+    sequencer.join('sensors')
+    return sequencer
+
+
+def test_sequencer_reorders():
+    sequencer = ordered_sequencer(wait=1)
+    assert seqs(sequencer.push(reading(1), now=0)[0]) == [1]
+    assert sequencer.push(reading(3), now=0) == ([], [])
+    assert sequencer.push(reading(4), now=0) == ([], [])
+    assert sequencer.next_release() == 1
+    assert seqs(sequencer.push(reading(2), now=0.5)[0]) == [2, 3, 4]
+    assert sequencer.next_release() is None
+    assert sequencer.counters['frames_held'] == 2
+
+
+def test_sequencer_reports_gaps_after_wait():
+    sequencer = ordered_sequencer(wait=1)
+    sequencer.push(reading(1), now=0)
+    sequencer.push(reading(4), now=0)
+    assert sequencer.release(now=0.5) == ([], [])
+    frames, gaps = sequencer.release(now=1)
+    assert seqs(frames) == [4]
+    assert gaps == [('probe', 'sensors', 'bulk', 2, 2)]
+    assert sequencer.counters['frames_missing'] == 2
+    assert sequencer.push(reading(2), now=2) == ([], [])  # too late.
+    assert sequencer.counters['frames_late'] == 1
+
+
+def test_sequencer_stops_waiting_when_full():
+    sequencer = ordered_sequencer(wait=1, size=2)
+    sequencer.push(reading(1), now=0)
+    sequencer.push(reading(3), now=0)
+    sequencer.push(reading(4), now=0)
+    frames, gaps = sequencer.push(reading(5), now=0)
+    assert seqs(frames) == [3, 4, 5]
+    assert gaps == [('probe', 'sensors', 'bulk', 2, 1)]
+
+
+def test_sequencer_streams():
+    sequencer = ordered_sequencer(wait=1)
+    sequencer.push(reading(7), now=0)
+    assert seqs(sequencer.push(reading(1, priority='control'), now=0)[0]) == [1]
+    assert seqs(sequencer.push(reading(1, epoch='b'), now=0)[0]) == [1]  # source restarted.
+    assert not sequencer.ordered(reading(1, space='elsewhere'))
+    assert not sequencer.ordered(Event('reading', source='probe', space='sensors'))
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_sequencer_fails_on_wait():
+    Sequencer(wait=0)
@@ -1,7 +1,34 @@
 # coding=utf-8
 import pytest
 
-from zentropi.spaces import Space, Spaces
+from zentropi import Connection, Event, Message
+from zentropi.frames import frame_meta
+from zentropi.handlers import Interests
+from zentropi.spaces import (
+    Space,
+    Spaces,
+    SubscriptionTrie,
+    space_matches
+)
+
+
+class Recorder(Connection):
+    def __init__(self):
+        super().__init__()
+        self.frames = []
+
+    def send(self, frame, internal=False):
+        self.frames.append(frame)
+
+
+def connected_spaces(*agent_names, space='test-space'):
+    spaces = Spaces()
+    connections = {}
+    for agent_name in agent_names:
+        connections[agent_name] = Recorder()
+        spaces.agent_connect(agent_name, connection=connections[agent_name])
+        spaces.join(agent_name, space)
+    return spaces, connections
 
 
 def test_space():
@@ -103,3 +130,231 @@ def test_spaces_join_fails():
     assert cmd.name == 'join'
     cmd = spaces.join(agent_name, space_name)
     assert cmd.name == 'join-failed'
+
+
+def test_spaces_broadcast_to_target():
+    spaces, connections = connected_spaces('a', 'b', 'c')
+    spaces.broadcast(Event('hello', source='a'))
+    assert [len(c.frames) for _, c in sorted(connections.items())] == [1, 1, 1]
+    spaces.broadcast(Event('psst', source='a', target='c'))
+    assert [len(c.frames) for _, c in sorted(connections.items())] == [1, 1, 2]
+    assert connections['c'].frames[-1].name == 'psst'
+
+
+def test_spaces_skip_uninterested_agents():
+    spaces, connections = connected_spaces('a', 'b', 'c')
+    spaces.update_interests('b', Interests(names=['ping'], prefixes=['get ']))
+    spaces.update_interests('c', Interests(wildcard=True))
+    for frame in (Event('ping', source='a'), Message('get a', source='a'), Event('pong', source='a')):
+        spaces.broadcast(frame)
+    assert [f.name for f in connections['b'].frames] == ['ping', 'get a']
+    assert len(connections['c'].frames) == 3
+    assert spaces.counters['frames_skipped'] == 1
+
+
+def names(connection, name='job'):
+    return [f.name for f in connection.frames if f.name == name]
+
+
+class Loaded(Recorder):
+    def __init__(self, load):
+        super().__init__()
+        self.tasks = load
+
+    def load(self):
+        return self.tasks
+
+
+def test_spaces_group_round_robin():
+    spaces, connections = connected_spaces('a')
+    for worker in ('w1', 'w2', 'w3'):
+        connections[worker] = Recorder()
+        spaces.agent_connect(worker, connection=connections[worker])
+        spaces.join(worker, 'test-space', group='workers')
+    for _ in range(6):
+        spaces.broadcast(Event('job', source='a'))
+    assert len(connections['a'].frames) == 6
+    assert [len(names(connections[w])) for w in ('w1', 'w2', 'w3')] == [2, 2, 2]
+    spaces.leave('w3', 'test-space')
+    for _ in range(4):
+        spaces.broadcast(Event('job', source='a'))
+    assert [len(names(connections[w])) for w in ('w1', 'w2', 'w3')] == [4, 4, 2]
+    assert spaces.join('w3', 'test-space', group='workers').data == {'space': 'test-space', 'group': 'workers'}
+    for _ in range(3):
+        spaces.broadcast(Event('job', source='a'))
+    assert [len(names(connections[w])) for w in ('w1', 'w2', 'w3')] == [5, 5, 3]
+
+
+def test_spaces_group_least_loaded():
+    spaces, connections = connected_spaces('a')
+    spaces.group_strategy = 'least-loaded'
+    for worker, load in (('busy', 5), ('idle', 0)):
+        connections[worker] = Loaded(load)
+        spaces.agent_connect(worker, connection=connections[worker])
+        spaces.join(worker, 'test-space', group='workers')
+    for _ in range(3):
+        spaces.broadcast(Event('job', source='a'))
+    assert len(names(connections['busy'])) == 0
+    assert len(names(connections['idle'])) == 3
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_spaces_fails_on_unknown_group_strategy():
+    Spaces(group_strategy='random')
+
+
+def test_spaces_group_partition_by():
+    spaces, connections = connected_spaces('a')
+    for worker in ('w1', 'w2', 'w3'):
+        connections[worker] = Recorder()
+        spaces.agent_connect(worker, connection=connections[worker])
+        spaces.join(worker, 'test-space', group='workers', partition_by='data.device_id')
+    rebalances = [f.data.members for f in connections['w1'].frames if f.name == 'group-rebalance']
+    assert rebalances == [['w1'], ['w1', 'w2'], ['w1', 'w2', 'w3']]
+
+    def owners():
+        for connection in connections.values():
+            connection.frames.clear()
+        for device in range(30):
+            for _ in range(2):
+                spaces.broadcast(Event('reading', data={'device_id': device}, source='a'))
+        return {f.data.device_id: worker for worker in ('w1', 'w2', 'w3')
+                for f in connections[worker].frames if f.name == 'reading'}
+
+    before = owners()
+    assert len(before) == 30
+    assert sum(len(names(connections[w], 'reading')) for w in ('w1', 'w2', 'w3')) == 60
+    spaces.leave('w2', 'test-space')
+    assert connections['w2'].frames[-1].data.left == 'w2'
+    after = owners()
+    assert {device for device in before if before[device] != after[device]} == \
+        {device for device in before if before[device] == 'w2'}
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_space_fails_on_mixed_partition_by():
+    space = Space('test-space')
+    space.join('w1', group='workers', partition_by='data.device_id')
+    space.join('w2', group='workers', partition_by='data.user_id')
+
+
+def test_subscription_trie():
+    trie = SubscriptionTrie()
+    for pattern in ('home.*', 'home.kitchen', 'sensors.#', '#.alarm', 'home.*.light'):
+        trie.add(pattern, pattern)
+    assert trie.match('home.kitchen') == {'home.*', 'home.kitchen'}
+    assert trie.match('home.kitchen.light') == {'home.*.light'}
+    assert trie.match('sensors') == {'sensors.#'}
+    assert trie.match('sensors.a.b') == {'sensors.#'}
+    assert trie.match('sensors.fire.alarm') == {'sensors.#', '#.alarm'}
+    assert trie.match('garage') == set()
+    trie.remove('home.*', 'home.*')
+    assert trie.match('home.kitchen') == {'home.kitchen'}
+    assert space_matches('home.*', 'home.*')
+    assert not space_matches('home.*', 'home.kitchen.sink')
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_subscription_trie_fails_on_partial_wildcard():
+    SubscriptionTrie().add('home.kit*', 'home.kit*')
+
+
+def test_spaces_broadcast_to_wildcards():
+    spaces, connections = connected_spaces('kitchen', space='home.kitchen')
+    for agent_name, pattern in (('home', 'home.*'), ('everything', '#'), ('garage', 'home.garage')):
+        connections[agent_name] = Recorder()
+        spaces.agent_connect(agent_name, connection=connections[agent_name])
+        spaces.join(agent_name, pattern)
+    spaces.join('home', 'home.kitchen')
+    spaces.broadcast(Event('hot', source='kitchen', space='home.kitchen'))
+    assert {name: len(c.frames) for name, c in connections.items()} == \
+        {'kitchen': 1, 'home': 1, 'everything': 1, 'garage': 0}
+    assert spaces.join('home', 'home.#.x*').name == 'join-failed'
+
+
+def test_spaces_retain_and_replay():
+    spaces = Spaces(retain_size=2)
+    connections = {'sensor': Recorder(), 'late': Recorder()}
+    for agent_name, connection in connections.items():
+        spaces.agent_connect(agent_name, connection=connection)
+    spaces.join('sensor', 'home.kitchen')
+    for name, value in (('temperature', 20), ('humidity', 40), ('temperature', 21), ('noise', 1)):
+        spaces.broadcast(Event(name, data={'value': value}, source='sensor', meta={'retain': True}))
+    spaces.broadcast(Event('ping', source='sensor'))
+    assert [(f.name, f.data.value) for f in spaces.retained('home.kitchen')] == [('temperature', 21), ('noise', 1)]
+    assert spaces.counters['retained_evicted'] == 1
+    spaces.join('late', 'home.*')
+    replay, = connections['late'].frames
+    assert replay.name == 'replay'
+    assert [f['name'] for f in replay.data.frames] == ['temperature', 'noise']
+    spaces.join('late', 'garage')
+    assert len(connections['late'].frames) == 1
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_spaces_fails_on_negative_retain_size():
+    Spaces(retain_size=-1)
+
+
+def test_spaces_project_fields():
+    spaces, connections = connected_spaces('a', 'b', 'c', 'd')
+    spaces.update_interests('b', Interests(names=['tweet'], fields={'tweet': ['text']}))
+    spaces.update_interests('c', Interests(names=['tweet'], fields={'tweet': ['text']}))
+    spaces.update_interests('d', Interests(names=['tweet']))
+    tweet = Event('tweet', data={'text': 'hi', 'user_id': 1, 'likes': 3}, source='a')
+    spaces.broadcast(tweet)
+    assert connections['b'].frames[0].data == {'text': 'hi'}
+    assert connections['b'].frames[0].id == tweet.id
+    assert connections['c'].frames[0] is connections['b'].frames[0]
+    assert connections['d'].frames[0] is tweet
+    assert spaces.counters['frames_projected'] == 1
+
+
+def test_spaces_drop_expired_frames():
+    spaces, connections = connected_spaces('a', 'b')
+    spaces.broadcast(Event('reading', source='a', meta={'deadline': 1}))
+    spaces.broadcast(Event('reading', source='a', meta={'deadline': 2 ** 40}))
+    assert len(connections['b'].frames) == 1
+    assert spaces.counters['frames_expired'] == 1
+
+
+def test_spaces_credits():
+    spaces, connections = connected_spaces('producer')
+    spaces.agent_connect('consumer', connection=Recorder())
+    spaces.join('consumer', 'test-space', group='workers', credits=2)
+    assert spaces.acquire('producer', 'test-space')
+    assert spaces.acquire('producer', 'test-space')
+    assert not spaces.acquire('producer', 'test-space')
+    assert spaces.counters['credits_exhausted'] == 1
+    spaces.grant('test-space', 'workers', 1)
+    assert names(connections['producer'], 'credit') == ['credit']
+    assert spaces.acquire('producer', 'test-space')
+    spaces.leave('consumer', 'test-space')
+    assert spaces.acquire('producer', 'test-space')  # no flow controlled group left.
+
+
+def test_spaces_refund_credits_of_frames_no_member_gets():
+    spaces, connections = connected_spaces('producer')
+    consumer = Recorder()
+    spaces.agent_connect('consumer', connection=consumer)
+    spaces.join('consumer', 'test-space', group='workers', credits=2)
+    spaces.update_interests('consumer', Interests(names=['job']))
+    for _ in range(3):
+        assert spaces.acquire('producer', 'test-space')
+        spaces.broadcast(Event('heartbeat', source='producer', space='test-space', meta=frame_meta(credit=True)))
+    assert spaces.counters['credits_refunded'] == 3
+    assert spaces.acquire('producer', 'test-space')
+    spaces.broadcast(Event('job', source='producer', space='test-space', meta=frame_meta(credit=True)))
+    assert names(consumer, 'job') == ['job']
+    assert spaces.counters['credits_refunded'] == 3
+
+
+def test_spaces_ordered_agents_get_every_frame():
+    spaces, connections = connected_spaces('sender', 'filtered')
+    spaces.agent_connect('ordered', connection=Recorder())
+    spaces.join('ordered', 'test-space', ordered=True)
+    for agent_name in ('filtered', 'ordered'):
+        spaces.update_interests(agent_name, Interests(names=['job']))
+    spaces.broadcast(Event('status', source='sender', space='test-space'))
+    assert names(connections['filtered'], 'status') == []
+    assert names(spaces._agents['ordered'], 'status') == ['status']
@@ -1,9 +1,11 @@
 # coding=utf-8
+import asyncio
+
 import pytest
 
 from zentropi import Field
 from zentropi.handlers import Handler
-from zentropi.states import States
+from zentropi.states import STATES_UPDATED, States
 from zentropi.symbols import KINDS
 
 
@@ -133,3 +135,83 @@ def test_states_with_callback_no_update():
     assert states.callback == _trigger_frame_handler
     states.the_answer = 42
     assert states.the_answer is None
+
+
+def recording_states():
+    seen = []
+
+    def _trigger_frame_handler(frame, handler, internal):
+        return handler(frame)
+
+    def record(state):
+        seen.append((state.name, state.data.value, state.data.last))
+        return state.data.value != 'veto'
+
+    def record_updated(state):
+        seen.append((state.name, state.data.names))
+
+    states = States(callback=_trigger_frame_handler)
+    for name in ('power', 'level', 'update'):
+        states.add_handler(name, handler=Handler(KINDS.STATE, name, record))
+    states.add_handler(STATES_UPDATED, handler=Handler(KINDS.STATE, STATES_UPDATED, record_updated))
+    states.power = False
+    states.level = 0
+    return states, seen
+
+
+def test_states_skip_unchanged_values():
+    states, seen = recording_states()
+    states.power = False
+    assert seen == []
+    states.power = True
+    assert seen == [('power', True, False)]
+
+
+def test_states_batch_update():
+    states, seen = recording_states()
+    assert states.batch_update({'power': True, 'level': 0, 'color': 'red'}) == {'power': True, 'color': 'red'}
+    assert seen == [('power', True, False), (STATES_UPDATED, ['power'])]
+    assert (states.power, states.level, states.color) == (True, 0, 'red')
+    assert states.batch_update({'power': True}) == {}
+
+
+def test_states_batch_update_is_all_or_nothing():
+    states, seen = recording_states()
+    assert states.batch_update({'level': 'veto', 'power': True}) == {}
+    assert seen == [('level', 'veto', 0)]  # vetoed before the power handler ran.
+    assert (states.power, states.level) == (False, 0)
+
+
+def test_states_named_like_methods():
+    states, seen = recording_states()
+    states['update'] = 1
+    states['update'] = 2
+    states.loop = 'main'
+    assert (states['update'], states.loop) == (2, 'main')
+    assert seen == [('update', 2, 1)]
+
+
+def test_states_debounce_and_throttle():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    states, seen = recording_states()
+    states.set_loop(loop)
+    states.debounce('power', 0.01)
+    states.throttle('level', 0.01)
+    for value in range(1, 4):
+        states.power = bool(value % 2)
+        states.level = value
+    assert seen == [('level', 1, 0)]
+    loop.run_until_complete(asyncio.sleep(0.03))
+    assert seen[0] == ('level', 1, 0)
+    assert sorted(seen[1:]) == [('level', 3, 1), ('power', True, False)]
+    states.debounce('power')
+    states.power = False
+    assert states.power is False
+    loop.close()
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_states_debounce_fails_on_bad_seconds():
+    States().debounce('power', 0)
+
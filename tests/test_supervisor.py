@@ -0,0 +1,78 @@
+# coding=utf-8
+import os
+from functools import partial
+
+import pytest
+
+from zentropi import Agent, on_event
+from zentropi.supervisor import (
+    Supervisor,
+    build_agents,
+    partition,
+    pin_to_core
+)
+
+
+class OneShotAgent(Agent):
+    @on_event('*** started')
+    def on_started(self, event):
+        self.stop()
+
+
+class CrashOnceAgent(Agent):
+    def __init__(self, marker):
+        super().__init__()
+        self.marker = marker
+
+    @on_event('*** started')
+    def on_started(self, event):
+        if not self.marker.exists():
+            self.marker.write('crashed')
+            raise RuntimeError('crash')
+        self.stop()
+
+
+def test_partition():
+    assert partition(list(range(5)), 2) == [[0, 2, 4], [1, 3]]
+    assert partition(['a'], 4) == [['a']]
+
+
+def test_pin_to_core():
+    if not hasattr(os, 'sched_setaffinity'):  # pragma: no cover
+        assert pin_to_core(0) is None
+        return
+    cores = os.sched_getaffinity(0)
+    try:
+        assert pin_to_core(1) in cores
+    finally:
+        os.sched_setaffinity(0, cores)
+
+
+def test_build_agents():
+    agent = Agent('built')
+    agents = build_agents([agent, OneShotAgent])
+    assert agents[0] is agent
+    assert isinstance(agents[1], OneShotAgent)
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_supervisor_fails_on_inmemory_processes():
+    Supervisor([OneShotAgent, OneShotAgent], processes=2, endpoint='inmemory://test')
+
+
+def test_supervisor_runs_worker():
+    supervisor = Supervisor([OneShotAgent], processes=1, endpoint='inmemory://supervisor')
+    stats = supervisor.run()
+    assert len(stats) == 1
+    assert stats[0]['alive'] is False
+    assert stats[0]['restarts'] == 0
+    assert supervisor.stopped
+
+
+def test_supervisor_restarts_crashed_worker(tmpdir):
+    marker = tmpdir.join('crashed')
+    supervisor = Supervisor([Agent, partial(CrashOnceAgent, marker)], processes=1,
+                            endpoint='inmemory://supervisor-crash')
+    stats = supervisor.run()
+    assert marker.exists()
+    assert stats[0]['restarts'] == 1
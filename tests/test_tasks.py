@@ -0,0 +1,93 @@
+# coding=utf-8
+import asyncio
+
+import pytest
+
+from zentropi import Agent
+from zentropi.handlers import Handler
+from zentropi.symbols import KINDS
+from zentropi.tasks import TaskRegistry
+
+
+async def dummy_async(event):  # pragma: no cover
+    pass
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_max_concurrency_fails_on_zero():
+    Handler(KINDS.EVENT, 'test', dummy_async, max_concurrency=0)
+
+
+def test_task_registry_drain():
+    loop = asyncio.new_event_loop()
+    tasks = TaskRegistry()
+    handler = Handler(KINDS.EVENT, 'slow', dummy_async)
+    asyncio.set_event_loop(loop)
+    tasks.spawn(loop, asyncio.sleep(10), handler=handler)
+    assert tasks.in_flight() == {'slow': 1}
+    cancelled = loop.run_until_complete(tasks.drain(timeout=0.01))
+    assert cancelled == 1
+    loop.run_until_complete(asyncio.sleep(0))
+    assert tasks.in_flight() == {}
+    loop.close()
+
+
+def test_agent_max_concurrency():
+    loop = asyncio.new_event_loop()
+    agent = Agent('bounded-agent')
+    agent.loop = loop
+    running = []
+    peak = []
+
+    @agent.on_event('work', max_concurrency=2)
+    async def on_work(event):
+        running.append(event)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(event)
+
+    for _ in range(5):
+        agent.emit('work')
+    loop.run_until_complete(asyncio.sleep(0))
+    assert agent.tasks.in_flight() == {'work': 2}
+    assert agent.tasks.queued() == {'work': 3}
+    loop.run_until_complete(agent.tasks.drain(timeout=1))
+    assert max(peak) == 2
+    assert len(peak) == 5
+    loop.close()
+
+
+def test_task_registry_drain_closes_queued():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    tasks = TaskRegistry()
+    handler = Handler(KINDS.EVENT, 'slow', dummy_async, max_concurrency=1)
+    assert tasks.spawn(loop, asyncio.sleep(10), handler=handler)
+    assert tasks.spawn(loop, asyncio.sleep(10), handler=handler) is None
+    assert tasks.queued() == {'slow': 1}
+    cancelled = loop.run_until_complete(tasks.drain(timeout=0.01))
+    assert cancelled == 2
+    assert tasks.queued() == {}
+    loop.close()
+
+
+def test_agent_task_errors_are_surfaced():
+    loop = asyncio.new_event_loop()
+    agent = Agent('failing-agent')
+    agent.loop = loop
+    errors = []
+
+    @agent.on_event('fail')
+    async def on_fail(event):
+        raise RuntimeError('boom')
+
+    @agent.on_event('*** task-error')
+    def on_task_error(event):
+        errors.append(event.data)
+
+    agent.emit('fail')
+    loop.run_until_complete(agent.tasks.drain(timeout=1))
+    assert agent.counters['task_errors'] == 1
+    assert errors[0]['handler'] == 'fail'
+    assert 'boom' in errors[0]['error']
+    loop.close()
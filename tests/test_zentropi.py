@@ -11,3 +11,27 @@ def test_main():
 
     assert 'shell' in result.output
     assert result.exit_code == 0
+
+
+def test_run_fails_on_bad_agent_spec():
+    runner = CliRunner()
+    result = runner.invoke(main, ['run', 'no_colon_here'])
+
+    assert result.exit_code != 0
+    assert 'module:attribute' in result.output
+
+
+def test_run_fails_on_missing_agent_module():
+    runner = CliRunner()
+    result = runner.invoke(main, ['run', 'no_such_module:Agent'])
+
+    assert result.exit_code != 0
+    assert 'no_such_module' in result.output
+
+
+def test_load_agent_spec_from_current_directory(tmpdir):
+    from zentropi.cli import load_agent_spec
+
+    tmpdir.join('cwd_agents.py').write('AGENT = 42\n')
+    with tmpdir.as_cwd():
+        assert load_agent_spec('cwd_agents:AGENT') == 42
@@ -65,3 +65,13 @@ def test_zentropian_sub_class():
     zen = Test()
     zen.emit('test-event')
     zen.emit('test-event-2')
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_zentropian_join_fails_on_credits_without_group():
+    Zentropian().join('jobs', credits=10)
+
+
+@pytest.mark.xfail(raises=ValueError, strict=True)
+def test_zentropian_join_fails_on_ordered_group():
+    Zentropian().join('jobs', group='workers', ordered=True)